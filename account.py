@@ -0,0 +1,287 @@
+"""
+帳戶狀態服務
+- 常駐 Bybit 私有 WebSocket（wallet / position / order），記憶體內維護餘額與持倉，逐筆增量更新
+- 連線（含重連）後以 REST 取一次完整快照；私有推送無法連線時由定時任務補快照
+- /balance、/position 直接讀記憶體，只保留非零的幣種與持倉
+- 未實現盈虧依公開行情的標記價格即時重算，觸及門檻即通知（不輪詢）；持倉幣種自動加入公開行情訂閱
+- 快照失敗視同連線失敗，退避後重連
+"""
+
+import os
+import time
+import json
+import asyncio
+import logging
+import aiohttp
+
+from http_client import http
+from price_feed import WS_PING_INTERVAL, WS_HEARTBEAT_TIMEOUT, WS_BACKOFF_MAX
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_WS_URL = os.getenv("ACCOUNT_WS_URL", "wss://stream.bybit.com/v5/private")
+ACCOUNT_POLL_INTERVAL = float(os.getenv("ACCOUNT_POLL_INTERVAL", "60"))
+ACCOUNT_STALE_AFTER = float(os.getenv("ACCOUNT_STALE_AFTER", "300"))
+# 預設盈虧門檻（USDT，逗號分隔；正數為獲利 ≥、負數為虧損 ≤）
+PNL_ALERT_LEVELS = [float(v) for v in os.getenv("PNL_ALERT_LEVELS", "").split(",") if v.strip()]
+
+TOPICS = ["wallet", "position", "order"]
+TOTAL = "TOTAL"
+
+
+def _float(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class PnlAlert:
+    __slots__ = ("id", "symbol", "level", "armed")
+
+    def __init__(self, alert_id: int, symbol: str, level: float):
+        self.id = alert_id
+        self.symbol = symbol          # 交易對或 TOTAL（全部持倉合計）
+        self.level = level
+        self.armed = True
+
+    def crossed(self, pnl: float) -> bool:
+        return pnl >= self.level if self.level >= 0 else pnl <= self.level
+
+    def describe(self) -> str:
+        name = "總持倉" if self.symbol == TOTAL else self.symbol
+        return f"#{self.id} {name} {'≥' if self.level >= 0 else '≤'} ${self.level:,.0f}"
+
+
+class AccountState:
+    def __init__(self, trader, url: str = ACCOUNT_WS_URL, stale_after: float = ACCOUNT_STALE_AFTER):
+        self.trader = trader
+        self.url = url
+        self.stale_after = stale_after
+        self.coins = {}               # coin → 錢包欄位（只保留非零餘額）
+        self.equity = 0.0
+        self.positions = {}           # (symbol, positionIdx) → 持倉欄位（只保留 size > 0）
+        self.updated = 0.0            # 最近一次快照或推送（monotonic）
+        self.connected = False
+        self.reconnects = 0
+        self.error = None
+        self.order_listeners = []     # callback(order dict)，例如 ExecutionEngine.apply
+        self.notify = None            # async callback(text)，盈虧提醒
+        self.watch = None             # callback(symbols)，持倉幣種需要公開行情的標記價格，例如 PriceFeed.watch
+        self.alerts = [PnlAlert(i + 1, TOTAL, level) for i, level in enumerate(PNL_ALERT_LEVELS)]
+        self._alert_ids = len(self.alerts)
+        self.stats = {"pushes": 0, "snapshots": 0, "alerts": 0}
+        self._task = None
+
+    # ─── 查詢 ───────────────────────────────────────────────
+
+    @property
+    def ready(self) -> bool:
+        return self.updated > 0 and (self.connected or time.monotonic() - self.updated < self.stale_after)
+
+    def age(self) -> float:
+        return time.monotonic() - self.updated if self.updated else float("inf")
+
+    def balances(self) -> list:
+        """[(coin, walletBalance, usdValue)]，依美元價值排序"""
+        rows = [(c, _float(d.get("walletBalance")), _float(d.get("usdValue"))) for c, d in self.coins.items()]
+        return sorted(rows, key=lambda r: -r[2])
+
+    def open_positions(self) -> list:
+        return sorted(self.positions.values(), key=lambda p: p["symbol"])
+
+    def pnl(self, symbol: str = TOTAL) -> float:
+        return sum(_float(p.get("unrealisedPnl")) for p in self.positions.values()
+                   if symbol == TOTAL or p["symbol"] == symbol)
+
+    def summary(self) -> str:
+        if not self.updated:
+            return "未同步" if self._task else "未啟用"
+        source = "✅ 推送" if self.connected else "🔁 輪詢"
+        s = self.stats
+        return (f"{source} / {len(self.coins)} 幣種 {len(self.positions)} 持倉 / {self.age():.0f}s 前更新 / "
+                f"推送 {s['pushes']} 快照 {s['snapshots']} / 提醒 {len(self.alerts)}")
+
+    # ─── 狀態更新 ───────────────────────────────────────────
+
+    def apply_wallet(self, accounts: list):
+        for account in accounts:
+            if account.get("totalEquity") not in (None, ""):
+                self.equity = _float(account["totalEquity"])
+            for coin in account.get("coin", []):
+                if _float(coin.get("walletBalance")) > 0:
+                    self.coins[coin["coin"]] = {**self.coins.get(coin["coin"], {}), **coin}
+                else:
+                    self.coins.pop(coin["coin"], None)
+        self.updated = time.monotonic()
+
+    def apply_positions(self, positions: list, snapshot: bool = False):
+        if snapshot:
+            self.positions = {}
+        touched = set()
+        for pos in positions:
+            key = (pos["symbol"], int(pos.get("positionIdx", 0)))
+            if _float(pos.get("size")) > 0:
+                self.positions[key] = {**self.positions.get(key, {}), **pos}
+            else:
+                self.positions.pop(key, None)
+            touched.add(pos["symbol"])
+        self.updated = time.monotonic()
+        if self.watch is not None and self.positions:
+            self.watch([symbol for symbol, _ in self.positions])
+        self._check(touched)
+
+    def on_tick(self, symbol: str, data: dict):
+        """公開行情監聽：以標記價格重算該幣種持倉的未實現盈虧"""
+        mark = _float(data.get("markPrice"))
+        if not mark:
+            return
+        changed = False
+        for (pos_symbol, _), pos in self.positions.items():
+            if pos_symbol != symbol:
+                continue
+            direction = 1 if pos.get("side") == "Buy" else -1
+            pos["markPrice"] = data["markPrice"]
+            pos["unrealisedPnl"] = str((mark - _float(pos.get("avgPrice"))) * _float(pos.get("size")) * direction)
+            changed = True
+        if changed:
+            self._check({symbol})
+
+    def handle(self, message: dict):
+        topic = message.get("topic", "")
+        data = message.get("data") or []
+        if not topic:
+            return
+        self.stats["pushes"] += 1
+        if topic == "wallet":
+            self.apply_wallet(data)
+        elif topic == "position":
+            self.apply_positions(data)
+        elif topic == "order":
+            for order in data:
+                for listener in self.order_listeners:
+                    try:
+                        listener(order)
+                    except Exception as e:
+                        logger.error(f"訂單推送處理錯誤: {e}")
+
+    async def refresh(self) -> dict:
+        """REST 完整快照；回傳第一個失敗的結果（全部成功為 retCode 0）"""
+        wallet, positions = await asyncio.gather(
+            self.trader.get_wallet_balance(),
+            self.trader.get_positions(settle_coin="USDT"),
+        )
+        for result in (wallet, positions):
+            if result.get("retCode") != 0:
+                self.error = result.get("retMsg", "錯誤")
+                return result
+        self.apply_wallet(wallet.get("result", {}).get("list", []))
+        self.apply_positions(positions.get("result", {}).get("list", []), snapshot=True)
+        self.stats["snapshots"] += 1
+        self.error = None
+        return {"retCode": 0}
+
+    async def run_job(self, context):
+        """私有推送未連線時定時補快照"""
+        if not self.connected:
+            await self.refresh()
+
+    # ─── 盈虧提醒 ───────────────────────────────────────────
+
+    def add_alert(self, level: float, symbol: str = TOTAL) -> PnlAlert:
+        self._alert_ids += 1
+        alert = PnlAlert(self._alert_ids, symbol, level)
+        alert.armed = not alert.crossed(self.pnl(symbol)) if self.updated else True
+        self.alerts.append(alert)
+        return alert
+
+    def remove_alert(self, alert_id: int = None) -> int:
+        """刪除指定提醒；未指定則全部刪除，回傳刪除數量"""
+        before = len(self.alerts)
+        self.alerts = [a for a in self.alerts if alert_id is not None and a.id != alert_id]
+        return before - len(self.alerts)
+
+    def _check(self, symbols: set):
+        """穿越門檻觸發一次，回到門檻內側後重新啟用"""
+        fired = []
+        for alert in self.alerts:
+            if alert.symbol != TOTAL and alert.symbol not in symbols:
+                continue
+            pnl = self.pnl(alert.symbol)
+            if alert.crossed(pnl):
+                if alert.armed:
+                    alert.armed = False
+                    fired.append((alert, pnl))
+            else:
+                alert.armed = True
+        if not fired or self.notify is None:
+            return
+        self.stats["alerts"] += len(fired)
+        lines = [f"{'🟢' if pnl >= 0 else '🔴'} {alert.describe()}：目前 ${pnl:,.2f}" for alert, pnl in fired]
+        asyncio.ensure_future(self.notify("💹 盈虧提醒\n" + "\n".join(lines)))
+
+    # ─── 私有推送 ───────────────────────────────────────────
+
+    def start(self):
+        if self._task is None and self.trader.signer and self.trader.api_key:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"✅ 帳戶推送啟動: {self.url}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
+
+    def _auth_args(self) -> list:
+        """Bybit 私有推送驗證：sign("GET/realtime" + expires)"""
+        expires = int((time.time() + 10) * 1000)
+        signature = self.trader.signer.sign(f"GET/realtime{expires}".encode("utf-8"))
+        return [self.trader.api_key, expires, signature]
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                async with http.session.ws_connect(self.url, heartbeat=None) as ws:
+                    await ws.send_json({"op": "auth", "args": self._auth_args()})
+                    reply = await ws.receive_json(timeout=10)
+                    if not reply.get("success"):
+                        raise ConnectionError(f"驗證失敗: {reply.get('ret_msg')}")
+                    await ws.send_json({"op": "subscribe", "args": TOPICS})
+                    # 訂閱後再取快照，之後的推送直接疊加；快照失敗不可視為已同步
+                    result = await self.refresh()
+                    if result.get("retCode") != 0:
+                        raise ConnectionError(f"快照失敗: {result.get('retMsg')}")
+                    self.connected = True
+                    backoff = 1.0
+                    await self._consume(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"帳戶推送斷線: {e}")
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_BACKOFF_MAX)
+
+    async def _consume(self, ws):
+        pinger = asyncio.ensure_future(self._ping(ws))
+        try:
+            while True:
+                msg = await ws.receive(timeout=WS_HEARTBEAT_TIMEOUT)
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self.handle(json.loads(msg.data))
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                    return
+        finally:
+            pinger.cancel()
+
+    async def _ping(self, ws):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            await ws.send_json({"op": "ping"})
@@ -0,0 +1,179 @@
+"""
+價格提醒引擎
+- 每個幣種兩個排序陣列：向上突破（>）與向下跌破（<）的門檻
+- 每筆行情只處理被穿越的門檻：O(log n + k)，不掃描全部提醒
+- SQLite 持久化，重啟後還原；第一次使用（或啟動時 load）才開檔，import 不做 I/O
+- 觸發結果按 chat 合併，批次送出；送達後才刪除（送出失敗或重啟會重送）
+"""
+
+import os
+import time
+import bisect
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+ALERT_DB = os.getenv("ALERT_DB", os.path.join(DATA_DIR, "alerts.db"))
+ALERT_MAX_PER_CHAT = int(os.getenv("ALERT_MAX_PER_CHAT", "50"))
+
+
+class AlertBook:
+    """單一幣種：門檻排序陣列 + 對應的提醒"""
+
+    def __init__(self):
+        self.above = []   # 遞增 (threshold, alert_id)；price >= threshold 觸發
+        self.below = []   # 遞增 (threshold, alert_id)；price <= threshold 觸發
+
+    def add(self, direction: str, threshold: float, alert_id: int):
+        bisect.insort(self.above if direction == ">" else self.below, (threshold, alert_id))
+
+    def remove(self, direction: str, threshold: float, alert_id: int):
+        side = self.above if direction == ">" else self.below
+        i = bisect.bisect_left(side, (threshold, alert_id))
+        if i < len(side) and side[i] == (threshold, alert_id):
+            del side[i]
+
+    def cross(self, price: float) -> list:
+        """移除並回傳被穿越的 alert_id"""
+        # above：門檻 <= price 的前綴
+        i = bisect.bisect_right(self.above, (price, float("inf")))
+        hit = [alert_id for _, alert_id in self.above[:i]]
+        del self.above[:i]
+        # below：門檻 >= price 的後綴
+        j = bisect.bisect_left(self.below, (price, -1))
+        hit += [alert_id for _, alert_id in self.below[j:]]
+        del self.below[j:]
+        return hit
+
+    def __len__(self):
+        return len(self.above) + len(self.below)
+
+
+class AlertEngine:
+    def __init__(self, path: str = ALERT_DB):
+        self.path = path
+        self._db = None
+        self.books = {}      # symbol -> AlertBook
+        self.alerts = {}     # id -> (chat_id, symbol, direction, threshold)
+        self.by_chat = {}    # chat_id -> set(id)
+        self.pending = {}    # chat_id -> [(alert_id, alert, price)]，已觸發、等待送達
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.load()
+        return self._db
+
+    def load(self):
+        """開檔並還原提醒；行情回呼只讀記憶體，需在行情推送開始前呼叫（第一次存取 db 也會觸發）"""
+        if self._db is not None:
+            return
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = self._db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL,"
+            " symbol TEXT NOT NULL, direction TEXT NOT NULL, threshold REAL NOT NULL,"
+            " created_at REAL NOT NULL, triggered_price REAL)"
+        )
+        try:
+            # 舊資料庫沒有 triggered_price 欄位
+            db.execute("ALTER TABLE alerts ADD COLUMN triggered_price REAL")
+        except sqlite3.OperationalError:
+            pass
+        db.execute("CREATE INDEX IF NOT EXISTS alerts_chat ON alerts (chat_id)")
+        for alert_id, chat_id, symbol, direction, threshold, triggered in db.execute(
+                "SELECT id, chat_id, symbol, direction, threshold, triggered_price FROM alerts"):
+            if triggered is None:
+                self._index(alert_id, chat_id, symbol, direction, threshold)
+            else:
+                self.pending.setdefault(chat_id, []).append(
+                    (alert_id, (chat_id, symbol, direction, threshold), triggered))
+
+    def _index(self, alert_id, chat_id, symbol, direction, threshold):
+        self.alerts[alert_id] = (chat_id, symbol, direction, threshold)
+        self.by_chat.setdefault(chat_id, set()).add(alert_id)
+        self.books.setdefault(symbol, AlertBook()).add(direction, threshold, alert_id)
+
+    def _unindex(self, alert_id):
+        chat_id, symbol, direction, threshold = self.alerts.pop(alert_id)
+        ids = self.by_chat.get(chat_id)
+        if ids:
+            ids.discard(alert_id)
+            if not ids:
+                del self.by_chat[chat_id]
+        return chat_id, symbol, direction, threshold
+
+    @property
+    def symbols(self) -> list:
+        return [s for s, book in self.books.items() if len(book)]
+
+    def add(self, chat_id: int, symbol: str, direction: str, threshold: float) -> int:
+        if direction not in (">", "<"):
+            raise ValueError("方向需為 > 或 <")
+        if len(self.by_chat.get(chat_id, ())) >= ALERT_MAX_PER_CHAT:
+            raise ValueError(f"每個聊天最多 {ALERT_MAX_PER_CHAT} 個提醒")
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO alerts (chat_id, symbol, direction, threshold, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, symbol, direction, threshold, time.time()),
+            )
+        self._index(cur.lastrowid, chat_id, symbol, direction, threshold)
+        return cur.lastrowid
+
+    def remove(self, chat_id: int, alert_id: int) -> bool:
+        alert = self.alerts.get(alert_id)
+        if alert is None or alert[0] != chat_id:
+            return False
+        _, symbol, direction, threshold = self._unindex(alert_id)
+        self.books[symbol].remove(direction, threshold, alert_id)
+        with self.db:
+            self.db.execute("DELETE FROM alerts WHERE id = ?", (alert_id,))
+        return True
+
+    def for_chat(self, chat_id: int) -> list:
+        return sorted((alert_id, *self.alerts[alert_id][1:]) for alert_id in self.by_chat.get(chat_id, ()))
+
+    def on_price(self, symbol: str, price: float):
+        """行情回呼：觸發的提醒移入 pending 並記下觸發價，送達後才刪除"""
+        book = self.books.get(symbol)
+        if not book:
+            return
+        hit = book.cross(price)
+        if not hit:
+            return
+        for alert_id in hit:
+            alert = self._unindex(alert_id)
+            self.pending.setdefault(alert[0], []).append((alert_id, alert, price))
+        with self.db:
+            self.db.executemany("UPDATE alerts SET triggered_price = ? WHERE id = ?",
+                                [(price, alert_id) for alert_id in hit])
+
+    def on_tick(self, symbol: str, data: dict):
+        """PriceFeed 監聽回呼"""
+        self.on_price(symbol, float(data["lastPrice"]))
+
+    def drain(self) -> dict:
+        """取出待送的觸發結果 {chat_id: [(alert_id, alert, price)]}；送達後呼叫 ack，失敗呼叫 requeue"""
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def ack(self, hits: list):
+        """已送達（或聊天已不存在）：刪除紀錄"""
+        with self.db:
+            self.db.executemany("DELETE FROM alerts WHERE id = ?", [(alert_id,) for alert_id, _, _ in hits])
+
+    def requeue(self, chat_id: int, hits: list):
+        """送出失敗：放回 pending，下次批次重送"""
+        self.pending.setdefault(chat_id, [])[:0] = hits
+
+    def summary(self) -> str:
+        return f"{len(self.alerts)} 個提醒 / {len(self.by_chat)} 個聊天 / 待送 {sum(map(len, self.pending.values()))}"
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
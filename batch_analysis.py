@@ -0,0 +1,144 @@
+"""
+多幣種批次 AI 分析
+- 多個幣種的行情打包成一次請求，要求依 JSON Schema 回傳結構化結果
+- 解析後依幣種（價格分桶）各自寫入 LLM 快取，下次只補缺少的幣種
+- 幣種過多時分批並行送出
+"""
+
+import os
+import re
+import json
+import asyncio
+import logging
+
+from llm_cache import LLMCache, price_bucket
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_SYMBOLS = int(os.getenv("BATCH_MAX_SYMBOLS", "25"))
+BATCH_TTL = float(os.getenv("BATCH_TTL", "300"))
+
+BIASES = ("bullish", "bearish", "neutral")
+BIAS_EMOJI = {"bullish": "📈", "bearish": "📉", "neutral": "➖"}
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.S)
+
+
+def analysis_schema(symbols: list) -> dict:
+    """OpenAI 相容 response_format（json_schema）"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "market_batch",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "analyses": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "symbol": {"type": "string", "enum": list(symbols)},
+                                "bias": {"type": "string", "enum": list(BIASES)},
+                                "comment": {"type": "string"},
+                            },
+                            "required": ["symbol", "bias", "comment"],
+                            "additionalProperties": False,
+                        },
+                    },
+                },
+                "required": ["analyses"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def build_prompt(items: list) -> str:
+    """items: [{"symbol", "price", "change", "levels"}]，每個幣種一行"""
+    lines = []
+    for item in items:
+        line = f"{item['symbol']}: ${item['price']:.6g} 24h {item['change']:+.2f}%"
+        if item.get("levels"):
+            line += f" | {item['levels']}"
+        lines.append(line)
+    return (
+        "以下是多個幣種的即時數據：\n" + "\n".join(lines) +
+        "\n\n對每個幣種給出短線偏向（bullish / bearish / neutral）與一句繁體中文點評（30字內）。"
+        "只回傳 JSON：{\"analyses\": [{\"symbol\", \"bias\", \"comment\"}]}，每個幣種一筆。"
+    )
+
+
+def parse_batch(text: str, symbols: list) -> dict:
+    """模型回應 → {symbol: {"bias", "comment"}}；容忍 ``` 包裹與多餘文字，無效項目略過"""
+    match = _JSON_OBJECT.search(text or "")
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    wanted = set(symbols)
+    results = {}
+    for item in data.get("analyses", []) if isinstance(data, dict) else []:
+        if not isinstance(item, dict):
+            continue
+        symbol = str(item.get("symbol", "")).upper()
+        comment = str(item.get("comment", "")).strip()
+        if symbol in wanted and comment:
+            bias = item.get("bias") if item.get("bias") in BIASES else "neutral"
+            results[symbol] = {"bias": bias, "comment": comment}
+    return results
+
+
+class BatchAnalyzer:
+    def __init__(self, call, cache: LLMCache, model: str, ttl: float = BATCH_TTL,
+                 max_symbols: int = BATCH_MAX_SYMBOLS):
+        """call(prompt, schema) → 模型回應文字（「❌」開頭為錯誤）"""
+        self.call = call
+        self.cache = cache
+        self.model = model
+        self.ttl = ttl
+        self.max_symbols = max_symbols
+        self.stats = {"requests": 0, "symbols": 0, "cached": 0, "failed": 0}
+
+    def _key(self, item: dict) -> str:
+        return LLMCache.make_key(self.model, "", f"batch:{item['symbol']}:{price_bucket(item['price'])}:{item['change']:.0f}")
+
+    async def _request(self, items: list) -> dict:
+        symbols = [item["symbol"] for item in items]
+        self.stats["requests"] += 1
+        text = await self.call(build_prompt(items), analysis_schema(symbols))
+        if text.startswith("❌"):
+            self.stats["failed"] += len(items)
+            return {}
+        results = parse_batch(text, symbols)
+        self.stats["failed"] += len(items) - len(results)
+        for item in items:
+            result = results.get(item["symbol"])
+            if result:
+                self.cache.put(self._key(item), json.dumps(result, ensure_ascii=False), self.ttl)
+        return results
+
+    async def analyze(self, items: list) -> dict:
+        """{symbol: {"bias", "comment"}}；快取命中的幣種不再送出"""
+        results = {}
+        missing = []
+        for item in items:
+            cached = self.cache.get(self._key(item))
+            if cached is not None:
+                results[item["symbol"]] = json.loads(cached)
+                self.stats["cached"] += 1
+            else:
+                missing.append(item)
+        self.stats["symbols"] += len(missing)
+
+        chunks = [missing[i:i + self.max_symbols] for i in range(0, len(missing), self.max_symbols)]
+        for batch in await asyncio.gather(*(self._request(chunk) for chunk in chunks)):
+            results.update(batch)
+        return results
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"請求 {s['requests']} / 幣種 {s['symbols']} / 快取 {s['cached']} / 失敗 {s['failed']}"
@@ -0,0 +1,281 @@
+"""
+訂閱推播管線
+- 報告只渲染一次，寫入持久化投遞佇列（SQLite），重啟後續送；第一次使用時才開檔
+- 固定數量 worker 併發送出，遵守 Telegram 全域與單一 chat 速率限制
+- RetryAfter 全體暫停、封鎖/不存在的 chat 自動移除訂閱、其他錯誤退避重試
+- Markdown 解析失敗改送純文字（AI 產生的內容常有未閉合的符號）
+"""
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from request_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+BROADCAST_DB = os.getenv("BROADCAST_DB", os.path.join(DATA_DIR, "broadcast.db"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))            # 全域每秒訊息數（Telegram 上限約 30）
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1"))  # 同一 chat 間隔秒數
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+
+
+class Broadcaster:
+    def __init__(self, bot=None, path: str = BROADCAST_DB, workers: int = BROADCAST_WORKERS,
+                 rate: float = BROADCAST_RATE, chat_interval: float = BROADCAST_CHAT_INTERVAL):
+        self.path = path
+        self._db = None
+        self.bot = bot
+        self.workers = workers
+        self.bucket = TokenBucket(rate, rate)
+        self.chat_interval = chat_interval
+        self.queue = asyncio.Queue()
+        self._queued = set()        # 已在佇列中的 delivery id
+        self._next_chat_slot = {}   # chat_id -> 下次可送時間
+        self._paused_until = 0.0
+        self._tasks = []
+        self._retries = set()       # 退避中、尚未放回佇列的重試
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "pruned": 0, "plain": 0}
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS subscribers ("
+                " chat_id INTEGER NOT NULL, topic TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (chat_id, topic));"
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL,"
+                " text TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0);"
+            )
+        return self._db
+
+    # ─── 訂閱 ───────────────────────────────────────────────
+
+    def subscribe(self, chat_id: int, topic: str) -> bool:
+        with self.db:
+            cur = self.db.execute(
+                "INSERT OR IGNORE INTO subscribers (chat_id, topic, created_at) VALUES (?, ?, ?)",
+                (chat_id, topic, time.time()),
+            )
+        return cur.rowcount > 0
+
+    def unsubscribe(self, chat_id: int, topic: str = None) -> bool:
+        with self.db:
+            if topic:
+                cur = self.db.execute("DELETE FROM subscribers WHERE chat_id = ? AND topic = ?", (chat_id, topic))
+            else:
+                cur = self.db.execute("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,))
+        return cur.rowcount > 0
+
+    def subscribers(self, topic: str) -> list:
+        return [row[0] for row in self.db.execute("SELECT chat_id FROM subscribers WHERE topic = ?", (topic,))]
+
+    def topics(self, chat_id: int) -> list:
+        return [row[0] for row in self.db.execute("SELECT topic FROM subscribers WHERE chat_id = ?", (chat_id,))]
+
+    # ─── 投遞 ───────────────────────────────────────────────
+
+    def publish(self, topic: str, text: str) -> int:
+        """報告渲染一次，為每位訂閱者寫入投遞佇列"""
+        chat_ids = self.subscribers(topic)
+        if not chat_ids:
+            return 0
+        with self.db:
+            first = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM deliveries").fetchone()[0]
+            self.db.executemany("INSERT INTO deliveries (chat_id, text) VALUES (?, ?)", [(c, text) for c in chat_ids])
+        for row in self.db.execute("SELECT id, chat_id, text, attempts FROM deliveries WHERE id > ? ORDER BY id", (first,)):
+            self._push(row)
+        return len(chat_ids)
+
+    def start(self, bot=None):
+        if bot is not None:
+            self.bot = bot
+        # 重啟後續送未完成的投遞
+        for row in self.db.execute("SELECT id, chat_id, text, attempts FROM deliveries ORDER BY id"):
+            self._push(row)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"✅ 推播管線啟動: {self.workers} workers, 待送 {self.queue.qsize()}")
+
+    def _push(self, row):
+        if row[0] not in self._queued:
+            self._queued.add(row[0])
+            self.queue.put_nowait(row)
+
+    async def stop(self):
+        for task in self._tasks + list(self._retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """等到佇列清空且沒有退避中的重試"""
+        while True:
+            await self.queue.join()
+            if not self._retries:
+                return
+            await asyncio.gather(*self._retries, return_exceptions=True)
+
+    async def _requeue_later(self, delay: float, row):
+        try:
+            await asyncio.sleep(delay)
+            self.queue.put_nowait(row)
+        except asyncio.CancelledError:
+            # 停止時放棄；紀錄仍在 SQLite，下次啟動續送
+            self._queued.discard(row[0])
+            raise
+        finally:
+            self._retries.discard(asyncio.current_task())
+
+    async def _wait_turn(self, chat_id: int):
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._next_chat_slot.get(chat_id, 0) - now)
+            if wait <= 0 and self.bucket.try_take():
+                self._next_chat_slot[chat_id] = now + self.chat_interval
+                return
+            await asyncio.sleep(max(wait, self.bucket.wait_time(), 0.01))
+
+    async def _worker(self):
+        while True:
+            row = await self.queue.get()
+            try:
+                await self._deliver(*row)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"推播錯誤: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, delivery_id: int, chat_id: int, text: str, attempts: int):
+        await self._wait_turn(chat_id)
+        try:
+            await self._send(chat_id, text)
+        except RetryAfter as e:
+            # Flood 控制：全體暫停後重新排入
+            retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+            self._paused_until = time.monotonic() + float(retry_after)
+            self.stats["retried"] += 1
+            self.queue.put_nowait((delivery_id, chat_id, text, attempts))
+            return
+        except (Forbidden, BadRequest) as e:
+            if isinstance(e, Forbidden) or "chat not found" in str(e).lower():
+                self.unsubscribe(chat_id)
+                self.stats["pruned"] += 1
+            else:
+                self.stats["failed"] += 1
+            self._done(delivery_id)
+            return
+        except Exception as e:
+            attempts += 1
+            if attempts >= BROADCAST_MAX_ATTEMPTS:
+                logger.warning(f"推播放棄 {chat_id}: {e}")
+                self.stats["failed"] += 1
+                self._done(delivery_id)
+                return
+            self.stats["retried"] += 1
+            with self.db:
+                self.db.execute("UPDATE deliveries SET attempts = ? WHERE id = ?", (attempts, delivery_id))
+            task = asyncio.ensure_future(self._requeue_later(min(2 ** attempts, 60), (delivery_id, chat_id, text, attempts)))
+            self._retries.add(task)
+            return
+        self.stats["sent"] += 1
+        self._done(delivery_id)
+
+    async def _send(self, chat_id: int, text: str):
+        try:
+            await self.bot.send_message(chat_id, text, parse_mode='Markdown')
+        except BadRequest as e:
+            if "parse entities" not in str(e).lower():
+                raise
+            self.stats["plain"] += 1
+            await self.bot.send_message(chat_id, text)
+
+    def _done(self, delivery_id: int):
+        self._queued.discard(delivery_id)
+        with self.db:
+            self.db.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+
+    def summary(self) -> str:
+        s = self.stats
+        count = self.db.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+        return (f"{count} 訂閱 / 待送 {self.queue.qsize()} / 已送 {s['sent']} / "
+                f"重試 {s['retried']} / 失敗 {s['failed']} / 移除 {s['pruned']}")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+async def _benchmark(chats: int = 2000):
+    """對本地假 Bot API 伺服器量測推播吞吐量：python broadcast.py"""
+    from aiohttp import web
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    received = []
+
+    async def get_me(request):
+        return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}})
+
+    async def send_message(request):
+        data = await request.post() if request.content_type != "application/json" else await request.json()
+        chat_id = int(data["chat_id"])
+        received.append(chat_id)
+        if len(received) == chats // 2:
+            # 模擬一次 flood 限制
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                      "parameters": {"retry_after": 1}}, status=429)
+        if chat_id % 97 == 0:
+            return web.json_response({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, status=403)
+        if chat_id % 101 == 0 and data.get("parse_mode"):
+            return web.json_response({"ok": False, "error_code": 400,
+                                      "description": "Bad Request: can't parse entities: can't find end of the entity"}, status=400)
+        if chat_id == 7 and received.count(7) == 1:
+            # 暫時性錯誤：1 秒後退避重試
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(received), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "x",
+        }})
+
+    app = web.Application()
+    app.router.add_post("/botTEST/getMe", get_me)
+    app.router.add_post("/botTEST/sendMessage", send_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8089).start()
+
+    broadcaster = Broadcaster(path=":memory:", rate=1e6, chat_interval=0)
+    bot = Bot("TEST", base_url="http://127.0.0.1:8089/bot",
+              request=HTTPXRequest(connection_pool_size=broadcaster.workers))
+    for chat_id in range(1, chats + 1):
+        broadcaster.subscribe(chat_id, "radar")
+    async with bot:
+        started = time.perf_counter()
+        broadcaster.publish("radar", "🌐 *FlowAI 全景報告*")
+        broadcaster.start(bot)
+        await broadcaster.join()
+        elapsed = time.perf_counter() - started
+        stats = broadcaster.stats
+        # join() 需等退避中的重試送完才返回
+        assert stats["sent"] + stats["pruned"] + stats["failed"] == chats and stats["retried"] >= 1, stats
+        assert stats["plain"] == chats // 101, stats
+        await broadcaster.stop()
+    await runner.cleanup()
+    print(f"{chats} 則 / {elapsed:.2f}s = {chats / elapsed:,.0f} 則/秒（{broadcaster.workers} workers，不限速，含 1 次 retry_after=1s、1 次退避重試、Markdown 失敗改送純文字）")
+    print(broadcaster.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(_benchmark())
@@ -1,83 +1,58 @@
 """
 交易客戶端 v2.1
-- 公開數據：CoinCap API（不擋雲端 IP）
+- 公開數據：多來源行情（CoinCap / Bybit / Binance），依延遲與健康度路由
 - 私有交易：Bybit API
 """
 
 import os
 import time
-import base64
 import logging
-import aiohttp
+from yarl import URL
 
-try:
-    from cryptography.hazmat.primitives import hashes, serialization
-    from cryptography.hazmat.primitives.asymmetric import padding
-    from cryptography.hazmat.backends import default_backend
-    HAS_CRYPTO = True
-except ImportError:
-    HAS_CRYPTO = False
+from http_client import http, timeout
+from market_cache import TTLCache
+from market_data import MarketRouter
+from metrics import timed
+from signing import make_signer, sign_payload, canonical_query, canonical_body
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BYBIT_API_KEY = os.getenv("BYBIT_API_KEY", "")
 BYBIT_PRIVATE_KEY = os.getenv("BYBIT_PRIVATE_KEY", "")
+BYBIT_API_SECRET = os.getenv("BYBIT_API_SECRET", "")  # HMAC 金鑰（設置時優先於 RSA）
 PROXY_URL = os.getenv("PROXY_URL", "")
 
-BYBIT_URL = "https://api.bybit.com"
+BYBIT_URL = os.getenv("BYBIT_URL", "https://api.bybit.com")
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 
-# CoinCap 幣種對應
-COINCAP_IDS = {
-    "BTCUSDT": "bitcoin",
-    "ETHUSDT": "ethereum",
-    "SOLUSDT": "solana"
-}
-
-def load_private_key(private_key_str: str):
-    if not HAS_CRYPTO:
-        raise ImportError("cryptography not installed")
-    private_key_str = private_key_str.replace("\\n", "\n")
-    return serialization.load_pem_private_key(
-        private_key_str.encode(), 
-        password=None, 
-        backend=default_backend()
-    )
-
-def generate_signature(private_key, param_str: str) -> str:
-    signature = private_key.sign(
-        param_str.encode('utf-8'), 
-        padding.PKCS1v15(), 
-        hashes.SHA256()
-    )
-    return base64.b64encode(signature).decode('utf-8')
-
 class BybitTrader:
     def __init__(self):
         self.api_key = BYBIT_API_KEY
         self.private_key_str = BYBIT_PRIVATE_KEY
-        self.private_key = None
+        self.signer = None
         self.recv_window = "5000"
         self.proxy = PROXY_URL if PROXY_URL else None
+        self.ticker_cache = TTLCache()
+        self.market = MarketRouter()
+        self.feed = None  # PriceFeed，啟用時優先讀取推送行情
+        self.funding = None  # FundingStore，本地資金費率序列
+        self.candles = None  # CandleService，提供真實 24h 高低點
         
-        if self.private_key_str and HAS_CRYPTO:
-            try:
-                self.private_key = load_private_key(self.private_key_str)
-                logger.info("✅ RSA 私鑰載入成功")
-            except Exception as e:
-                logger.error(f"❌ RSA 私鑰載入失敗: {e}")
+        try:
+            self.signer = make_signer(self.private_key_str, BYBIT_API_SECRET)
+            if self.signer:
+                logger.info(f"✅ {self.signer.name} 簽名金鑰載入成功")
+        except Exception as e:
+            logger.error(f"❌ 簽名金鑰載入失敗: {e}")
     
     def _get_timestamp(self) -> str:
         return str(int(time.time() * 1000))
     
-    def _sign_request(self, timestamp: str, params: dict = None) -> str:
-        param_str = f"{timestamp}{self.api_key}{self.recv_window}"
-        if params:
-            sorted_params = "&".join([f"{k}={v}" for k, v in sorted(params.items())])
-            param_str += sorted_params
-        if self.private_key:
-            return generate_signature(self.private_key, param_str)
+    def _sign_request(self, timestamp: str, payload: str = "") -> str:
+        """payload 為已正規化的查詢字串或 JSON body（與送出內容相同）"""
+        if self.signer:
+            return sign_payload(self.signer, timestamp, self.api_key, self.recv_window, payload)
         raise ValueError("私鑰未設置")
     
     def _get_headers(self, timestamp: str, signature: str) -> dict:
@@ -90,92 +65,144 @@ class BybitTrader:
             "User-Agent": USER_AGENT
         }
     
+    @timed("bybit")
     async def _bybit_request(self, method: str, endpoint: str, params: dict = None) -> dict:
         """Bybit 私有 API 請求"""
         url = f"{BYBIT_URL}{endpoint}"
         timestamp = self._get_timestamp()
         
         try:
-            signature = self._sign_request(timestamp, params)
+            # 參數只正規化一次，簽名與送出的內容完全相同
+            payload = canonical_query(params) if method == "GET" else canonical_body(params)
+            signature = self._sign_request(timestamp, payload)
             headers = self._get_headers(timestamp, signature)
             
-            async with aiohttp.ClientSession() as session:
-                if method == "GET":
-                    if params:
-                        query = "&".join([f"{k}={v}" for k, v in params.items()])
-                        url = f"{url}?{query}"
-                    async with session.get(url, headers=headers, proxy=self.proxy, timeout=15) as resp:
-                        if resp.content_type == 'application/json':
-                            return await resp.json()
-                        else:
-                            text = await resp.text()
-                            return {"retCode": -1, "retMsg": f"IP 被封鎖，請用 VPS 部署"}
-                else:
-                    async with session.post(url, headers=headers, json=params, proxy=self.proxy, timeout=15) as resp:
-                        if resp.content_type == 'application/json':
-                            return await resp.json()
-                        else:
-                            return {"retCode": -1, "retMsg": f"IP 被封鎖，請用 VPS 部署"}
+            session = http.session
+            if method == "GET":
+                if payload:
+                    url = f"{url}?{payload}"
+                # encoded=True：避免 yarl 重新編碼導致與簽名不一致
+                async with session.get(URL(url, encoded=True), headers=headers, proxy=self.proxy, timeout=timeout(15)) as resp:
+                    if resp.content_type == 'application/json':
+                        return await resp.json()
+                    else:
+                        return {"retCode": -1, "retMsg": f"IP 被封鎖，請用 VPS 部署"}
+            else:
+                async with session.post(url, headers=headers, data=payload.encode("utf-8"), proxy=self.proxy, timeout=timeout(15)) as resp:
+                    if resp.content_type == 'application/json':
+                        return await resp.json()
+                    else:
+                        return {"retCode": -1, "retMsg": f"IP 被封鎖，請用 VPS 部署"}
         
         except Exception as e:
             logger.error(f"Bybit API 錯誤: {e}")
             return {"retCode": -1, "retMsg": str(e)}
     
+    @timed("get_ticker")
     async def get_ticker(self, category: str = "linear", symbol: str = "BTCUSDT") -> dict:
-        """用 CoinCap 獲取即時價格（不擋雲端 IP）"""
-        coin_id = COINCAP_IDS.get(symbol, "bitcoin")
-        url = f"https://api.coincap.io/v2/assets/{coin_id}"
+        """即時價格：優先讀推送行情，否則經 TTL 快取（同時請求合併為一次上游呼叫）"""
+        if self.feed:
+            tick = self.feed.get(symbol)
+            if tick:
+                return tick
+        ticker = await self.ticker_cache.get(symbol, lambda: self._fetch_ticker(symbol))
+        return self._with_range(symbol, ticker)
+    
+    def _with_range(self, symbol: str, ticker: dict) -> dict:
+        """以本地 K 線的 24h 高低點取代來源的估算值"""
+        hl = self.candles.range_24h(symbol) if self.candles else None
+        if not hl or ticker.get("retCode") != 0:
+            return ticker
+        data = dict(ticker["result"]["list"][0], highPrice24h=str(hl[0]), lowPrice24h=str(hl[1]))
+        return {**ticker, "result": {**ticker["result"], "list": [data]}}
+    
+    async def _fetch_ticker(self, symbol: str) -> dict:
+        """單一幣種經行情路由（不支援的幣種回傳錯誤，不再退回 BTC）"""
+        return (await self.market.fetch([symbol]))[symbol]
+    
+    async def get_tickers(self, symbols: list, category: str = "linear") -> dict:
+        """批次獲取多個幣種價格（一次上游請求）
         
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        data = result.get("data", {})
-                        
-                        price = float(data.get("priceUsd", 0))
-                        change = float(data.get("changePercent24Hr", 0))
-                        
-                        return {
-                            "retCode": 0,
-                            "result": {
-                                "list": [{
-                                    "symbol": symbol,
-                                    "lastPrice": str(price),
-                                    "price24hPcnt": str(change / 100),
-                                    "highPrice24h": str(price * 1.02),  # 估算
-                                    "lowPrice24h": str(price * 0.98),   # 估算
-                                    "volume24h": data.get("volumeUsd24Hr", "0")
-                                }]
-                            }
-                        }
-                    return {"retCode": -1, "retMsg": f"CoinCap 錯誤: {resp.status}"}
-        except Exception as e:
-            logger.error(f"CoinCap 錯誤: {e}")
-            return {"retCode": -1, "retMsg": str(e)}
+        回傳 {symbol: Bybit 格式 ticker}，快取命中的不再請求上游
+        """
+        results = {}
+        missing = []
+        for symbol in symbols:
+            cached = self.feed.get(symbol) if self.feed else None
+            if cached:
+                results[symbol] = cached
+                continue
+            cached = self.ticker_cache.peek(symbol)
+            if cached:
+                self.ticker_cache.stats["hits"] += 1
+                results[symbol] = cached
+            elif self.market.supports(symbol):
+                missing.append(symbol)
+            else:
+                results[symbol] = {"retCode": -1, "retMsg": f"不支援的幣種: {symbol}"}
+        
+        if missing:
+            self.ticker_cache.stats["misses"] += len(missing)
+            results.update(await self._fetch_tickers(missing))
+        
+        return {symbol: self._with_range(symbol, results[symbol]) for symbol in symbols}
+    
+    async def _fetch_tickers(self, symbols: list) -> dict:
+        """批次請求並寫入快取"""
+        tickers = await self.market.fetch(symbols)
+        for symbol, ticker in tickers.items():
+            self.ticker_cache.put(symbol, ticker)
+        return tickers
     
     async def get_funding_rate(self, category: str = "linear", symbol: str = "BTCUSDT") -> dict:
-        """資金費率 - 雲端無法獲取，返回提示"""
+        """資金費率：優先讀本地序列，其次推送行情的預估費率"""
+        latest = self.funding.latest(symbol) if self.funding else None
+        if latest:
+            ts, rate = latest
+            return {
+                "retCode": 0,
+                "result": {
+                    "list": [{
+                        "symbol": symbol,
+                        "fundingRate": str(rate),
+                        "fundingRateTimestamp": str(ts)
+                    }]
+                }
+            }
+        tick = self.feed.get(symbol) if self.feed else None
+        if tick and tick["result"]["list"][0].get("fundingRate"):
+            return {
+                "retCode": 0,
+                "result": {
+                    "list": [{
+                        "symbol": symbol,
+                        "fundingRate": tick["result"]["list"][0]["fundingRate"]
+                    }]
+                }
+            }
         return {
             "retCode": 0, 
             "result": {
                 "list": [{
                     "fundingRate": "0.0001"  # 預設值
                 }],
-                "note": "雲端部署無法獲取即時費率，顯示預設值"
+                "note": "尚無費率資料，顯示預設值"
             }
         }
     
     async def get_wallet_balance(self, account_type: str = "UNIFIED") -> dict:
         return await self._bybit_request("GET", "/v5/account/wallet-balance", {"accountType": account_type})
     
-    async def get_positions(self, category: str = "linear", symbol: str = None) -> dict:
+    async def get_positions(self, category: str = "linear", symbol: str = None, settle_coin: str = None) -> dict:
         params = {"category": category}
         if symbol:
             params["symbol"] = symbol
+        elif settle_coin:
+            params["settleCoin"] = settle_coin
         return await self._bybit_request("GET", "/v5/position/list", params)
     
-    async def place_order(self, symbol: str, side: str, qty: str, order_type: str = "Market", category: str = "linear") -> dict:
+    async def place_order(self, symbol: str, side: str, qty: str, order_type: str = "Market", category: str = "linear",
+                          price: str = None, order_link_id: str = None, reduce_only: bool = False) -> dict:
         params = {
             "category": category, 
             "symbol": symbol, 
@@ -183,15 +210,38 @@ class BybitTrader:
             "orderType": order_type, 
             "qty": qty
         }
+        if price:
+            params["price"] = price
+        if order_link_id:
+            params["orderLinkId"] = order_link_id
+        if reduce_only:
+            params["reduceOnly"] = True
         return await self._bybit_request("POST", "/v5/order/create", params)
     
-    async def cancel_order(self, symbol: str, order_id: str, category: str = "linear") -> dict:
-        params = {"category": category, "symbol": symbol, "orderId": order_id}
+    async def place_batch_orders(self, orders: list, category: str = "linear") -> dict:
+        """批次下單：orders 為 /v5/order/create 的參數（不含 category）
+        
+        結果依送出順序對應 result.list 與 retExtInfo.list（逐筆 code / msg）
+        """
+        return await self._bybit_request("POST", "/v5/order/create-batch", {"category": category, "request": orders})
+    
+    async def cancel_order(self, symbol: str, order_id: str = None, category: str = "linear",
+                           order_link_id: str = None) -> dict:
+        params = {"category": category, "symbol": symbol}
+        if order_id:
+            params["orderId"] = order_id
+        if order_link_id:
+            params["orderLinkId"] = order_link_id
         return await self._bybit_request("POST", "/v5/order/cancel", params)
     
     async def get_open_orders(self, category: str = "linear") -> dict:
         return await self._bybit_request("GET", "/v5/order/realtime", {"category": category})
     
+    async def get_order(self, symbol: str, order_link_id: str, category: str = "linear") -> dict:
+        """以 orderLinkId 查詢單筆訂單（含最近完成的訂單）"""
+        params = {"category": category, "symbol": symbol, "orderLinkId": order_link_id}
+        return await self._bybit_request("GET", "/v5/order/realtime", params)
+    
     async def set_leverage(self, symbol: str, leverage: str, category: str = "linear") -> dict:
         params = {
             "category": category, 
@@ -0,0 +1,321 @@
+"""
+K 線儲存與指標引擎
+- SQLite 儲存 OHLCV（主鍵 (symbol, interval, ts)），第一次使用時才開檔
+- 由推送行情增量聚合 K 線，Bybit kline 端點補齊歷史
+- 指標逐根增量更新（EMA / RSI / ATR / VWAP / 滾動高低點），不重算整段歷史
+"""
+
+import os
+import time
+import logging
+import sqlite3
+from collections import deque
+
+from http_client import http, timeout
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+CANDLE_DB = os.getenv("CANDLE_DB", os.path.join(DATA_DIR, "candles.db"))
+KLINE_API_URL = os.getenv("KLINE_API_URL", "https://api.bybit.com")
+CANDLE_INTERVAL = int(os.getenv("CANDLE_INTERVAL", "3600"))  # 秒
+CANDLE_WARMUP = int(os.getenv("CANDLE_WARMUP", "500"))
+
+# K 線秒數 → Bybit kline interval 參數（日線以上為 D / W，不是分鐘數）
+BYBIT_INTERVALS = {
+    60: "1", 180: "3", 300: "5", 900: "15", 1800: "30", 3600: "60", 7200: "120",
+    14400: "240", 21600: "360", 43200: "720", 86400: "D", 604800: "W",
+}
+
+# bar = (ts, open, high, low, close, volume)，ts 為該根 K 線開始的 epoch 秒
+
+
+class RollingExtreme:
+    """單調佇列：最近 N 根的最高/最低，攤銷 O(1)"""
+
+    def __init__(self, size: int, highest: bool):
+        self.size = size
+        self.highest = highest
+        self._items = deque()   # (index, value)
+
+    def push(self, index: int, value: float):
+        items = self._items
+        if self.highest:
+            while items and items[-1][1] <= value:
+                items.pop()
+        else:
+            while items and items[-1][1] >= value:
+                items.pop()
+        items.append((index, value))
+        while items[0][0] <= index - self.size:
+            items.popleft()
+
+    @property
+    def value(self):
+        return self._items[0][1] if self._items else None
+
+
+class IndicatorState:
+    """單一幣種的增量指標狀態"""
+
+    def __init__(self, ema_periods=(20, 50), rsi_period: int = 14, atr_period: int = 14,
+                 range_bars: int = 24, vwap_bars: int = 24):
+        self.count = 0
+        self.last_ts = None
+        self.prev_close = None
+        self.ema = {n: None for n in ema_periods}
+        self.rsi_period = rsi_period
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.atr_period = atr_period
+        self.atr = None
+        self._tr_sum = 0.0
+        self.high = RollingExtreme(range_bars, highest=True)
+        self.low = RollingExtreme(range_bars, highest=False)
+        self._vwap_window = deque(maxlen=vwap_bars)
+        self._pv = 0.0
+        self._v = 0.0
+
+    def update(self, bar):
+        ts, _, high, low, close, volume = bar
+        self.count += 1
+        n = self.count
+
+        for period, value in self.ema.items():
+            alpha = 2 / (period + 1)
+            self.ema[period] = close if value is None else value + alpha * (close - value)
+
+        if self.prev_close is not None:
+            change = close - self.prev_close
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            p = self.rsi_period
+            if n <= p + 1:
+                # 前 p 期用簡單平均
+                self.avg_gain += gain / p
+                self.avg_loss += loss / p
+            else:
+                self.avg_gain = (self.avg_gain * (p - 1) + gain) / p
+                self.avg_loss = (self.avg_loss * (p - 1) + loss) / p
+            tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        else:
+            tr = high - low
+
+        p = self.atr_period
+        if n <= p:
+            self._tr_sum += tr
+            if n == p:
+                self.atr = self._tr_sum / p
+        else:
+            self.atr = (self.atr * (p - 1) + tr) / p
+
+        self.high.push(n, high)
+        self.low.push(n, low)
+
+        typical = (high + low + close) / 3
+        if len(self._vwap_window) == self._vwap_window.maxlen:
+            old_pv, old_v = self._vwap_window[0]
+            self._pv -= old_pv
+            self._v -= old_v
+        self._vwap_window.append((typical * volume, volume))
+        self._pv += typical * volume
+        self._v += volume
+
+        self.prev_close = close
+        self.last_ts = ts
+
+    @property
+    def rsi(self):
+        if self.count <= self.rsi_period:
+            return None
+        if self.avg_loss == 0:
+            return 100.0
+        return 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+
+    @property
+    def vwap(self):
+        return self._pv / self._v if self._v > 0 else None
+
+    def snapshot(self) -> dict:
+        return {
+            "ema": dict(self.ema),
+            "rsi": self.rsi,
+            "atr": self.atr,
+            "vwap": self.vwap,
+            "high": self.high.value,
+            "low": self.low.value,
+            "close": self.prev_close,
+            "bars": self.count,
+        }
+
+
+class CandleStore:
+    def __init__(self, path: str = CANDLE_DB):
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS candles ("
+                " symbol TEXT NOT NULL, interval INTEGER NOT NULL, ts INTEGER NOT NULL,"
+                " open REAL, high REAL, low REAL, close REAL, volume REAL,"
+                " PRIMARY KEY (symbol, interval, ts)) WITHOUT ROWID"
+            )
+        return self._db
+
+    def upsert(self, symbol: str, interval: int, bars: list):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(symbol, interval, *bar) for bar in bars],
+            )
+
+    def load(self, symbol: str, interval: int, limit: int = CANDLE_WARMUP, since: int = None) -> list:
+        """時間遞增的 bars"""
+        if since is not None:
+            rows = self.db.execute(
+                "SELECT ts, open, high, low, close, volume FROM candles"
+                " WHERE symbol = ? AND interval = ? AND ts >= ? ORDER BY ts",
+                (symbol, interval, since),
+            ).fetchall()
+            return rows
+        rows = self.db.execute(
+            "SELECT ts, open, high, low, close, volume FROM candles"
+            " WHERE symbol = ? AND interval = ? ORDER BY ts DESC LIMIT ?",
+            (symbol, interval, limit),
+        ).fetchall()
+        return rows[::-1]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CandleService:
+    """行情 → K 線聚合 → 指標；同時提供 24h 高低點與提示詞用的技術面文字"""
+
+    def __init__(self, store: CandleStore, symbols: list, interval: int = CANDLE_INTERVAL,
+                 base_url: str = KLINE_API_URL):
+        if interval not in BYBIT_INTERVALS:
+            raise ValueError(f"不支援的 K 線週期 {interval}s，可用: {sorted(BYBIT_INTERVALS)}")
+        self.store = store
+        self.symbols = list(dict.fromkeys(symbols))
+        self.interval = interval
+        self.base_url = base_url
+        self.current = {}       # symbol -> [ts, o, h, l, c, v]（未收盤）
+        self.indicators = {}    # symbol -> IndicatorState
+        self._last_volume = {}
+        self.range_bars = max(1, 86400 // interval)
+
+    def _state(self, symbol: str) -> IndicatorState:
+        state = self.indicators.get(symbol)
+        if state is None:
+            state = self.indicators[symbol] = IndicatorState(range_bars=self.range_bars, vwap_bars=self.range_bars)
+        return state
+
+    def load(self):
+        """啟動時由本地儲存暖機指標"""
+        for symbol in self.symbols:
+            for bar in self.store.load(symbol, self.interval):
+                self._state(symbol).update(bar)
+
+    def _close_bars(self, symbol: str, bars: list):
+        """寫入已收盤 K 線；只有比目前狀態新的才更新指標"""
+        if not bars:
+            return
+        self.store.upsert(symbol, self.interval, bars)
+        state = self._state(symbol)
+        for bar in bars:
+            if state.last_ts is None or bar[0] > state.last_ts:
+                state.update(bar)
+
+    def on_tick(self, symbol: str, data: dict, now: float = None):
+        """PriceFeed 監聽回呼：增量聚合目前這根 K 線"""
+        price = float(data["lastPrice"])
+        volume24h = float(data.get("volume24h") or 0)
+        # 24h 滾動成交量的差值近似本筆成交量（視窗滑動可能為負，取 0）
+        prev = self._last_volume.get(symbol)
+        volume = max(volume24h - prev, 0.0) if prev is not None else 0.0
+        self._last_volume[symbol] = volume24h
+
+        bucket = int((now or time.time()) // self.interval * self.interval)
+        bar = self.current.get(symbol)
+        if bar is None or bar[0] != bucket:
+            if bar is not None and bar[0] < bucket:
+                self._close_bars(symbol, [tuple(bar)])
+            self.current[symbol] = [bucket, price, price, price, price, volume]
+            return
+        bar[2] = max(bar[2], price)
+        bar[3] = min(bar[3], price)
+        bar[4] = price
+        bar[5] += volume
+
+    async def backfill(self, symbol: str, limit: int = 200) -> int:
+        """Bybit kline 補齊已收盤的 K 線"""
+        url = f"{self.base_url}/v5/market/kline"
+        params = {"category": "linear", "symbol": symbol, "interval": BYBIT_INTERVALS[self.interval], "limit": str(limit)}
+        try:
+            async with http.session.get(url, params=params, timeout=timeout(10)) as resp:
+                result = await resp.json(content_type=None)
+        except Exception as e:
+            logger.warning(f"K 線補齊失敗 {symbol}: {e}")
+            return 0
+        if result.get("retCode") != 0:
+            return 0
+        open_bucket = int(time.time() // self.interval * self.interval)
+        bars = sorted(
+            (int(item[0]) // 1000, float(item[1]), float(item[2]), float(item[3]), float(item[4]), float(item[5]))
+            for item in result.get("result", {}).get("list", [])
+        )
+        closed = [bar for bar in bars if bar[0] < open_bucket]
+        self._close_bars(symbol, closed)
+        return len(closed)
+
+    async def run_job(self, context):
+        """JobQueue 回呼：補齊所有幣種"""
+        for symbol in self.symbols:
+            await self.backfill(symbol)
+
+    # ─── 查詢 ───────────────────────────────────────────────
+
+    def range_24h(self, symbol: str):
+        """(high, low)：最近 24h 已收盤 K 線 + 目前這根"""
+        state = self.indicators.get(symbol)
+        bar = self.current.get(symbol)
+        highs = [v for v in (state.high.value if state else None, bar[2] if bar else None) if v is not None]
+        lows = [v for v in (state.low.value if state else None, bar[3] if bar else None) if v is not None]
+        if not highs:
+            return None
+        return max(highs), min(lows)
+
+    def levels(self, symbol: str):
+        state = self.indicators.get(symbol)
+        if state is None or state.count == 0:
+            return None
+        snap = state.snapshot()
+        hl = self.range_24h(symbol)
+        if hl:
+            snap["high"], snap["low"] = hl
+        return snap
+
+    def levels_text(self, symbol: str) -> str:
+        """給 AI 提示詞的技術面摘要（無資料回傳空字串）"""
+        snap = self.levels(symbol)
+        if not snap:
+            return ""
+        lines = [f"24h 高/低：${snap['high']:,.2f} / ${snap['low']:,.2f}"]
+        ema = " / ".join(f"EMA{n} ${v:,.2f}" for n, v in snap["ema"].items() if v is not None)
+        if ema:
+            lines.append(ema)
+        if snap["rsi"] is not None:
+            lines.append(f"RSI14：{snap['rsi']:.1f}")
+        if snap["atr"] is not None:
+            lines.append(f"ATR14：${snap['atr']:,.2f}")
+        if snap["vwap"] is not None:
+            lines.append(f"24h VWAP：${snap['vwap']:,.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,375 @@
+"""
+下單執行引擎
+- 批次下單（/v5/order/create-batch），不同幣種並行送出、同幣種依序
+- orderLinkId 本地產生：重試沿用同一 id，交易所回報重複即視為已受理（冪等）
+- 本地訂單狀態由下單回應與訂單推送（apply）更新，不需輪詢 get_open_orders
+- TWAP 依時間均分切單；冰山單成交一片才掛下一片；切單任務在背景執行，可取消
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+from decimal import Decimal, ROUND_DOWN
+
+logger = logging.getLogger(__name__)
+
+EXEC_BATCH_SIZE = int(os.getenv("EXEC_BATCH_SIZE", "10"))
+EXEC_MAX_RETRIES = int(os.getenv("EXEC_MAX_RETRIES", "3"))
+EXEC_RETRY_DELAY = float(os.getenv("EXEC_RETRY_DELAY", "0.5"))
+EXEC_FILL_TIMEOUT = float(os.getenv("EXEC_FILL_TIMEOUT", "15"))
+EXEC_HISTORY = int(os.getenv("EXEC_HISTORY", "500"))   # 保留的已完成訂單數
+EXEC_QTY_STEP = os.getenv("EXEC_QTY_STEP", "0.001")     # TWAP 切片數量精度
+
+# 可重試：連線失敗 / 時間戳超出 recv_window / 限頻 / 伺服器錯誤
+RETRYABLE_CODES = {-1, 10002, 10006, 10016}
+# 無法確定交易所是否已受理（連線失敗、逾時、5xx）
+UNCERTAIN_CODES = {-1, 10016}
+ORDER_NOT_EXISTS = 110001
+DUPLICATE_LINK_ID = 110072
+TERMINAL = {"Filled", "Cancelled", "Rejected", "Deactivated", "PartiallyFilledCanceled"}
+
+_sequence = itertools.count(1)
+
+
+def new_link_id(prefix: str = "fa") -> str:
+    """orderLinkId（36 字元內）：前綴-毫秒時間-序號-隨機"""
+    return f"{prefix}-{int(time.time() * 1000):x}-{next(_sequence):x}-{os.urandom(3).hex()}"
+
+
+def split_qty(total: str, parts: int, step: str) -> list:
+    """總量均分為 parts 份（向下取整到 step，餘數併入最後一份）"""
+    total, step = Decimal(total), Decimal(step)
+    base = (total / parts).quantize(step, rounding=ROUND_DOWN)
+    if base <= 0:
+        return [str(total)]
+    return [str(base)] * (parts - 1) + [str(total - base * (parts - 1))]
+
+
+def split_visible(total: str, visible: str) -> list:
+    """冰山單：每片 visible，最後一片為餘數"""
+    total, visible = Decimal(total), Decimal(visible)
+    count, rest = divmod(total, visible)
+    return [str(visible)] * int(count) + ([str(rest)] if rest > 0 else [])
+
+
+class Order:
+    __slots__ = ("link_id", "symbol", "side", "qty", "order_type", "price", "category", "reduce_only",
+                 "job", "status", "order_id", "filled", "avg_price", "error", "attempts", "uncertain",
+                 "created", "event")
+
+    def __init__(self, symbol: str, side: str, qty: str, order_type: str = "Market", price: str = None,
+                 category: str = "linear", reduce_only: bool = False, job: int = None, link_id: str = None):
+        self.link_id = link_id or new_link_id()
+        self.symbol = symbol
+        self.side = side
+        self.qty = str(qty)
+        self.order_type = order_type
+        self.price = price
+        self.category = category
+        self.reduce_only = reduce_only
+        self.job = job
+        self.status = "Pending"       # 送出前；Unknown 為無法確認是否已下單；其餘沿用 Bybit orderStatus
+        self.order_id = None
+        self.filled = "0"
+        self.avg_price = None
+        self.error = None
+        self.attempts = 0
+        self.uncertain = False        # 曾遇到結果不明的回應，可能已在交易所掛單
+        self.created = time.time()
+        self.event = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL
+
+    def params(self) -> dict:
+        params = {"symbol": self.symbol, "side": self.side, "orderType": self.order_type,
+                  "qty": self.qty, "orderLinkId": self.link_id}
+        if self.price:
+            params["price"] = self.price
+        if self.reduce_only:
+            params["reduceOnly"] = True
+        return params
+
+    def accept(self, order_id: str = None):
+        self.order_id = order_id or self.order_id
+        if self.status == "Pending":
+            self.status = "New"
+
+    def reject(self, message: str):
+        self.status = "Rejected"
+        self.error = message
+        self.event.set()
+
+
+class SliceJob:
+    def __init__(self, job_id: int, kind: str, symbol: str, side: str, qty: str, slices: list):
+        self.id = job_id
+        self.kind = kind              # twap / iceberg
+        self.symbol = symbol
+        self.side = side
+        self.qty = qty
+        self.slices = slices
+        self.orders = []
+        self.status = "running"       # running / done / cancelled / failed
+        self.task = None
+
+    def filled(self) -> Decimal:
+        return sum((Decimal(o.filled) for o in self.orders), Decimal(0))
+
+    def summary(self) -> str:
+        return (f"#{self.id} {self.kind} {self.symbol} {self.side} {self.qty}："
+                f"{len(self.orders)}/{len(self.slices)} 片，成交 {self.filled()}（{self.status}）")
+
+
+class ExecutionEngine:
+    def __init__(self, trader, batch_size: int = EXEC_BATCH_SIZE, max_retries: int = EXEC_MAX_RETRIES,
+                 retry_delay: float = EXEC_RETRY_DELAY):
+        self.trader = trader
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.orders = {}              # orderLinkId → Order（插入順序即下單順序）
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self.stats = {"orders": 0, "batches": 0, "retries": 0, "duplicates": 0, "rejected": 0}
+
+    # ─── 下單 ───────────────────────────────────────────────
+
+    async def submit(self, orders: list) -> list:
+        """送出訂單：依 (category, symbol) 分組並行，組內每 batch_size 筆一批依序送出"""
+        groups = {}
+        for order in orders:
+            self.orders[order.link_id] = order
+            groups.setdefault((order.category, order.symbol), []).append(order)
+        self.stats["orders"] += len(orders)
+        await asyncio.gather(*(self._submit_group(category, group) for (category, _), group in groups.items()))
+        self._prune()
+        return orders
+
+    async def _submit_group(self, category: str, orders: list):
+        for i in range(0, len(orders), self.batch_size):
+            await self._send(category, orders[i:i + self.batch_size])
+
+    async def _send(self, category: str, chunk: list):
+        pending = chunk
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            for order in pending:
+                order.attempts += 1
+            self.stats["batches"] += 1
+            if len(pending) == 1:
+                pending = await self._send_one(category, pending[0])
+            else:
+                pending = await self._send_batch(category, pending)
+            # 等待回應期間已由推送確認完成的訂單不再重送
+            pending = [o for o in pending if not o.done]
+            if not pending:
+                break
+        for order in pending:
+            if order.uncertain:
+                order.status = "Unknown"
+            else:
+                self.stats["rejected"] += 1
+                order.reject(order.error or "重試次數用盡")
+        # 重複 id 受理（無 orderId）與結果不明的訂單，以 orderLinkId 查回實際狀態
+        await asyncio.gather(*(self._resolve(o) for o in chunk if o.status == "Unknown"
+                               or (o.status == "New" and not o.order_id)))
+
+    async def _resolve(self, order: Order):
+        result = await self.refresh(order)
+        if order.status != "Unknown" or result.get("retCode") != 0:
+            return
+        if not (result.get("result") or {}).get("list"):
+            # 交易所查無此訂單：確定未下單
+            self.stats["rejected"] += 1
+            order.reject(order.error or "重試次數用盡")
+
+    async def _send_one(self, category: str, order: Order) -> list:
+        """單筆走 /v5/order/create；回傳需重試的訂單"""
+        result = await self.trader.place_order(
+            order.symbol, order.side, order.qty, order.order_type, category,
+            price=order.price, order_link_id=order.link_id, reduce_only=order.reduce_only,
+        )
+        return self._handle(order, result.get("retCode"), result.get("retMsg", ""),
+                            (result.get("result") or {}).get("orderId"))
+
+    async def _send_batch(self, category: str, orders: list) -> list:
+        result = await self.trader.place_batch_orders([o.params() for o in orders], category)
+        code = result.get("retCode")
+        if code != 0:
+            retry = []
+            for order in orders:
+                retry += self._handle(order, code, result.get("retMsg", ""))
+            return retry
+        items = (result.get("result") or {}).get("list") or []
+        infos = (result.get("retExtInfo") or {}).get("list") or []
+        retry = []
+        for i, order in enumerate(orders):
+            item = items[i] if i < len(items) else {}
+            info = infos[i] if i < len(infos) else {"code": -1, "msg": "缺少回應"}
+            retry += self._handle(order, info.get("code", 0), info.get("msg", ""), item.get("orderId"))
+        return retry
+
+    def _handle(self, order: Order, code, message: str, order_id: str = None) -> list:
+        if code == 0:
+            order.accept(order_id)
+        elif code == DUPLICATE_LINK_ID:
+            # 前一次已被受理（回應遺失），不重複下單
+            self.stats["duplicates"] += 1
+            order.accept(order_id)
+        elif code in RETRYABLE_CODES:
+            order.error = message
+            order.uncertain = order.uncertain or code in UNCERTAIN_CODES
+            return [order]
+        else:
+            self.stats["rejected"] += 1
+            order.reject(message)
+        return []
+
+    async def place(self, symbol: str, side: str, qty: str, order_type: str = "Market", price: str = None,
+                    category: str = "linear", reduce_only: bool = False) -> Order:
+        order = Order(symbol, side, qty, order_type, price, category, reduce_only)
+        await self.submit([order])
+        return order
+
+    async def cancel(self, order: Order) -> dict:
+        """以 orderLinkId 撤單（重複 id 受理或仍在送出中的訂單沒有 orderId）"""
+        if order.done:
+            return {"retCode": 0}
+        result = await self.trader.cancel_order(order.symbol, category=order.category, order_link_id=order.link_id)
+        if result.get("retCode") == 0:
+            order.status = "Cancelled"
+            order.event.set()
+        elif result.get("retCode") == ORDER_NOT_EXISTS:
+            # 已成交或從未送達：以查詢結果為準，查無則視為已撤
+            found = await self.refresh(order)
+            if found.get("retCode") == 0 and not (found.get("result") or {}).get("list"):
+                order.status = "Cancelled"
+                order.event.set()
+                return {"retCode": 0}
+        return result
+
+    # ─── 訂單狀態 ───────────────────────────────────────────
+
+    def apply(self, data: dict):
+        """Bybit 訂單推送 / 查詢結果（orderLinkId、orderStatus、cumExecQty、avgPrice）→ 本地狀態"""
+        order = self.orders.get(data.get("orderLinkId"))
+        if order is None:
+            return
+        order.order_id = data.get("orderId") or order.order_id
+        order.status = data.get("orderStatus") or order.status
+        order.filled = data.get("cumExecQty") or order.filled
+        order.avg_price = data.get("avgPrice") or order.avg_price
+        if order.status == "Rejected":
+            order.error = data.get("rejectReason") or order.error
+        if order.done:
+            order.event.set()
+
+    async def refresh(self, order: Order) -> dict:
+        """推送未到時以 orderLinkId 查詢單筆"""
+        result = await self.trader.get_order(order.symbol, order.link_id, order.category)
+        for item in (result.get("result") or {}).get("list") or []:
+            self.apply(item)
+        return result
+
+    async def wait(self, order: Order, timeout: float = EXEC_FILL_TIMEOUT) -> Order:
+        """等待訂單完成；每次逾時查詢一次，直到完成"""
+        while not order.done:
+            try:
+                await asyncio.wait_for(order.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                await (self._resolve(order) if order.status == "Unknown" else self.refresh(order))
+        return order
+
+    def open_orders(self, symbol: str = None) -> list:
+        return [o for o in self.orders.values() if not o.done and o.status != "Pending"
+                and (symbol is None or o.symbol == symbol)]
+
+    def _prune(self):
+        excess = len(self.orders) - EXEC_HISTORY
+        if excess <= 0:
+            return
+        for link_id in [k for k, o in self.orders.items() if o.done][:excess]:
+            del self.orders[link_id]
+
+    # ─── 切單 ───────────────────────────────────────────────
+
+    def _start(self, kind: str, symbol: str, side: str, qty: str, slices: list, runner) -> SliceJob:
+        job = SliceJob(next(self._job_ids), kind, symbol, side, qty, slices)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, runner))
+        return job
+
+    async def _run(self, job: SliceJob, runner):
+        try:
+            await runner(job)
+            if job.status == "running":
+                job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            logger.error(f"切單任務 #{job.id} 失敗: {e}")
+
+    def twap(self, symbol: str, side: str, qty: str, slices: int, duration: float,
+             step: str = EXEC_QTY_STEP, category: str = "linear") -> SliceJob:
+        """市價單於 duration 秒內均分 slices 片送出"""
+        parts = split_qty(qty, max(1, slices), step)
+        interval = duration / max(1, len(parts) - 1) if len(parts) > 1 else 0
+
+        async def runner(job):
+            for i, part in enumerate(parts):
+                if i:
+                    await asyncio.sleep(interval)
+                order = Order(symbol, side, part, "Market", category=category, job=job.id)
+                job.orders.append(order)
+                await self.submit([order])
+                if order.status in ("Rejected", "Unknown"):
+                    # 狀態不明時不再送下一片，避免超量成交
+                    job.status = "failed"
+                    return
+
+        return self._start("twap", symbol, side, qty, parts, runner)
+
+    def iceberg(self, symbol: str, side: str, qty: str, visible: str, price: str,
+                category: str = "linear") -> SliceJob:
+        """限價單每次只掛 visible 數量，成交後再掛下一片"""
+        parts = split_visible(qty, visible)
+
+        async def runner(job):
+            for part in parts:
+                order = Order(symbol, side, part, "Limit", price, category, job=job.id)
+                job.orders.append(order)
+                await self.submit([order])
+                await self.wait(order)
+                if order.status != "Filled":
+                    job.status = "failed" if order.status == "Rejected" else "cancelled"
+                    return
+
+        return self._start("iceberg", symbol, side, qty, parts, runner)
+
+    async def cancel_job(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.status != "running":
+            return False
+        job.task.cancel()
+        await asyncio.gather(job.task, return_exceptions=True)
+        await asyncio.gather(*(self.cancel(o) for o in job.orders if not o.done))
+        job.status = "cancelled"
+        return True
+
+    async def stop(self):
+        for job in list(self.jobs.values()):
+            if job.status == "running":
+                await self.cancel_job(job.id)
+
+    def summary(self) -> str:
+        s = self.stats
+        running = sum(1 for j in self.jobs.values() if j.status == "running")
+        return (f"訂單 {s['orders']} / 未完成 {len(self.open_orders())} / 請求 {s['batches']} / "
+                f"重試 {s['retries']} / 重複 {s['duplicates']} / 拒絕 {s['rejected']} / 切單 {running}")
@@ -0,0 +1,221 @@
+"""
+資金費率收集與時間序列
+- SQLite 持久化（主鍵 (symbol, ts)），只追加；第一次使用時才開檔載入，import 不做 I/O
+- 記憶體內 array 序列 + 前綴和，最新值與滾動平均 O(1)
+- 定時向公開端點拉取（FUNDING_API_URL 可指向本地測試伺服器）
+- 第一次執行時以 endTime 分頁往回補齊 FUNDING_BACKFILL_DAYS 日的歷史
+"""
+
+import os
+import time
+import asyncio
+import logging
+import sqlite3
+from array import array
+
+from http_client import http, timeout
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+FUNDING_DB = os.getenv("FUNDING_DB", os.path.join(DATA_DIR, "funding.db"))
+FUNDING_API_URL = os.getenv("FUNDING_API_URL", "https://api.bybit.com")
+FUNDING_SYMBOLS = [
+    s.strip().upper() for s in os.getenv("FUNDING_SYMBOLS", "BTCUSDT,ETHUSDT,SOLUSDT").split(",") if s.strip()
+]
+FUNDING_POLL_INTERVAL = float(os.getenv("FUNDING_POLL_INTERVAL", "600"))
+FUNDING_BACKFILL_DAYS = float(os.getenv("FUNDING_BACKFILL_DAYS", "365"))
+FUNDING_BACKFILL_PAGES = int(os.getenv("FUNDING_BACKFILL_PAGES", "60"))   # 每個幣種最多分頁數（1h 結算一年約 44 頁）
+FUNDING_PAGE_LIMIT = 200
+
+# 預設每 8 小時結算一次：3 期 = 1 日；部分幣種為 4h / 1h，依實際時間戳推算
+PERIODS_PER_DAY = 3
+DAY_MS = 86400 * 1000
+
+
+class FundingSeries:
+    """單一幣種的費率序列（時間遞增）"""
+
+    def __init__(self):
+        self.ts = array("q")
+        self.rates = array("d")
+        self.prefix = array("d", [0.0])
+
+    def __len__(self):
+        return len(self.rates)
+
+    def append(self, ts: int, rate: float) -> bool:
+        if self.ts and ts <= self.ts[-1]:
+            return False
+        self.ts.append(ts)
+        self.rates.append(rate)
+        self.prefix.append(self.prefix[-1] + rate)
+        return True
+
+    @property
+    def periods_per_day(self) -> float:
+        """由最近幾期的結算間隔（中位數）推算每日期數；不足兩期用預設值"""
+        if len(self.ts) < 2:
+            return PERIODS_PER_DAY
+        recent = self.ts[-31:]
+        gaps = sorted(b - a for a, b in zip(recent, recent[1:]))
+        return DAY_MS / gaps[len(gaps) // 2]
+
+    def average(self, periods: int):
+        n = min(periods, len(self.rates))
+        if n == 0:
+            return None
+        return (self.prefix[-1] - self.prefix[-1 - n]) / n
+
+
+class FundingStore:
+    def __init__(self, path: str = FUNDING_DB):
+        self.path = path
+        self._db = None
+        self._loaded = None     # symbol -> FundingSeries，第一次存取時由 SQLite 載入
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS funding ("
+                " symbol TEXT NOT NULL, ts INTEGER NOT NULL, rate REAL NOT NULL,"
+                " PRIMARY KEY (symbol, ts)) WITHOUT ROWID"
+            )
+        return self._db
+
+    @property
+    def series(self) -> dict:
+        if self._loaded is None:
+            self._loaded = {}
+            for symbol, ts, rate in self.db.execute("SELECT symbol, ts, rate FROM funding ORDER BY symbol, ts"):
+                self._series(symbol).append(ts, rate)
+        return self._loaded
+
+    def _series(self, symbol: str) -> FundingSeries:
+        series = self.series.get(symbol)
+        if series is None:
+            series = self.series[symbol] = FundingSeries()
+        return series
+
+    def extend(self, symbol: str, rows: list) -> int:
+        """rows: [(ts_ms, rate)]，寫入比現有資料新或舊的部分（補歷史），回傳新增筆數"""
+        series = self._series(symbol)
+        rows = sorted(rows)
+        older = [(ts, rate) for ts, rate in rows if series.ts and ts < series.ts[0]]
+        if older:
+            # 前綴和只能往後追加：補進較舊的資料時重建序列
+            rebuilt = FundingSeries()
+            for ts, rate in older + list(zip(series.ts, series.rates)):
+                rebuilt.append(ts, rate)
+            series = self.series[symbol] = rebuilt
+        fresh = older + [(ts, rate) for ts, rate in rows if series.append(ts, rate)]
+        if fresh:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO funding (symbol, ts, rate) VALUES (?, ?, ?)",
+                    [(symbol, ts, rate) for ts, rate in fresh],
+                )
+        return len(fresh)
+
+    def latest(self, symbol: str):
+        """(ts_ms, rate) 或 None"""
+        series = self.series.get(symbol)
+        if not series:
+            return None
+        return series.ts[-1], series.rates[-1]
+
+    def average(self, symbol: str, days: float):
+        series = self.series.get(symbol)
+        if not series:
+            return None
+        return series.average(max(1, round(days * series.periods_per_day)))
+
+    def periods_per_day(self, symbol: str) -> float:
+        series = self.series.get(symbol)
+        return series.periods_per_day if series else PERIODS_PER_DAY
+
+    def history(self, symbol: str, periods: int = None):
+        """(ts array, rate array)，periods 指定時只取最近 N 期"""
+        series = self.series.get(symbol)
+        if not series:
+            return array("q"), array("d")
+        if periods:
+            return series.ts[-periods:], series.rates[-periods:]
+        return series.ts, series.rates
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class FundingCollector:
+    def __init__(self, store: FundingStore, symbols: list = None, base_url: str = FUNDING_API_URL):
+        self.store = store
+        self.symbols = symbols or FUNDING_SYMBOLS
+        self.base_url = base_url
+        self.last_error = None
+        self.backfilled = False
+
+    async def poll(self) -> int:
+        counts = await asyncio.gather(*[self._poll_symbol(s) for s in self.symbols])
+        return sum(counts)
+
+    async def _fetch(self, symbol: str, end_time: int = None):
+        """一頁（最多 200 期，新到舊）；end_time 指定時取該時間（含）以前；失敗回傳 None"""
+        url = f"{self.base_url}/v5/market/funding/history"
+        params = {"category": "linear", "symbol": symbol, "limit": str(FUNDING_PAGE_LIMIT)}
+        if end_time is not None:
+            params["endTime"] = str(end_time)
+        try:
+            async with http.session.get(url, params=params, timeout=timeout(10)) as resp:
+                result = await resp.json(content_type=None)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.warning(f"資金費率拉取失敗 {symbol}: {e}")
+            return None
+        if result.get("retCode") != 0:
+            self.last_error = result.get("retMsg")
+            return None
+        self.last_error = None
+        return [
+            (int(item["fundingRateTimestamp"]), float(item["fundingRate"]))
+            for item in result.get("result", {}).get("list", [])
+        ]
+
+    async def _poll_symbol(self, symbol: str) -> int:
+        rows = await self._fetch(symbol)
+        return self.store.extend(symbol, rows) if rows else 0
+
+    async def backfill(self, symbol: str, days: float = FUNDING_BACKFILL_DAYS) -> bool:
+        """以 endTime 往回分頁補到 days 日前（或上架日）；完成回傳 True，途中失敗回傳 False"""
+        since = int(time.time() * 1000 - days * DAY_MS)
+        for _ in range(FUNDING_BACKFILL_PAGES):
+            series = self.store.series.get(symbol)
+            if series and series.ts[0] <= since:
+                return True
+            rows = await self._fetch(symbol, series.ts[0] - 1 if series else None)
+            if rows is None:
+                return False
+            self.store.extend(symbol, rows)
+            if len(rows) < FUNDING_PAGE_LIMIT:
+                return True      # 已到上架日
+        return True
+
+    def summary(self) -> str:
+        total = sum(len(self.store.series.get(s, ())) for s in self.symbols)
+        state = f"❌ {self.last_error}" if self.last_error else "✅"
+        return f"{state} {len(self.symbols)} 幣種 / {total} 筆"
+
+    async def run_job(self, context):
+        """JobQueue 回呼；第一次（或上次補歷史失敗）先補齊歷史"""
+        if not self.backfilled:
+            done = await asyncio.gather(*[self.backfill(s) for s in self.symbols])
+            self.backfilled = all(done)
+        added = await self.poll()
+        if added:
+            logger.info(f"資金費率新增 {added} 筆")
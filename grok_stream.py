@@ -0,0 +1,62 @@
+"""
+Grok 串流（SSE）
+- 逐段解析 data: 行，依序 yield 文字
+- 非 200、連線中斷、未收到 [DONE] 一律拋出 GrokStreamError（附上已收到的部分文字），呼叫端不會誤把殘缺回應當成完整結果
+- collect() 累積文字並限速回報進度，供編輯 Telegram 訊息
+"""
+
+import json
+import time
+import logging
+
+from http_client import http, timeout
+
+logger = logging.getLogger(__name__)
+
+
+class GrokStreamError(Exception):
+    """訊息以「❌」開頭；partial 為中斷前已收到的文字"""
+
+    def __init__(self, message: str, partial: str = ""):
+        super().__init__(message)
+        self.partial = partial
+
+
+async def stream_chat(url: str, headers: dict, payload: dict, seconds: float = 90):
+    """POST stream=True 的 chat completions，逐段 yield delta 內容"""
+    try:
+        async with http.session.post(url, headers=headers, json={**payload, "stream": True},
+                                     timeout=timeout(seconds)) as resp:
+            if resp.status != 200:
+                raise GrokStreamError(f"❌ API 錯誤: {resp.status}")
+            async for raw in resp.content:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                delta = json.loads(data)["choices"][0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+    except GrokStreamError:
+        raise
+    except Exception as e:
+        raise GrokStreamError(f"❌ 錯誤: {e}") from e
+    raise GrokStreamError("❌ 錯誤: 串流未完成即中斷")
+
+
+async def collect(chunks, on_text=None, interval: float = 1.2) -> str:
+    """累積串流文字；on_text(目前文字) 至多每 interval 秒呼叫一次（第一段立即）"""
+    text = ""
+    last = 0.0
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if on_text and time.monotonic() - last >= interval:
+                await on_text(text)
+                last = time.monotonic()
+    except GrokStreamError as e:
+        e.partial = text
+        raise
+    return text
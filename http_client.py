@@ -0,0 +1,60 @@
+"""
+共用 HTTP 連線池
+- 單一 aiohttp.ClientSession，Application 啟動時建立、關閉時釋放
+- Keep-Alive + 每主機連線上限 + DNS 快取
+"""
+
+import os
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+
+
+class HttpClient:
+    """管理共用的 ClientSession（懶建立，可重複 start/close）"""
+
+    def __init__(self):
+        self._session = None
+
+    def _build_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self._build_session()
+        return self._session
+
+    async def start(self):
+        _ = self.session
+        logger.info(f"✅ HTTP 連線池啟動 (limit={HTTP_POOL_LIMIT}, per_host={HTTP_POOL_LIMIT_PER_HOST})")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP 連線池已關閉")
+        self._session = None
+
+
+def timeout(seconds: float) -> aiohttp.ClientTimeout:
+    """單次請求逾時（連線逾時沿用全域設定）"""
+    return aiohttp.ClientTimeout(total=seconds, connect=HTTP_CONNECT_TIMEOUT)
+
+
+http = HttpClient()
@@ -0,0 +1,114 @@
+"""
+LLM 回應快取
+- key = model + 正規化 prompt（或呼叫端指定的 cache_key）
+- 每筆各自 TTL、LRU 淘汰、記憶體上限
+- Single-flight：相同 prompt 同時請求只打一次上游
+- 命中 / 未命中 / 合併次數同時記入 metrics 計數器（llm_cache）
+"""
+
+import os
+import re
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def price_bucket(price: float, step_pct: float = 0.25) -> str:
+    """價格分桶（預設 0.25% 一格），讓相近價格共用同一筆快取"""
+    if price <= 0:
+        return "0"
+    step = price * step_pct / 100
+    # 步長取 10 的冪次，分桶邊界才不會隨價格漂移
+    magnitude = 10 ** math.floor(math.log10(step))
+    return f"{round(price / magnitude) * magnitude:.8g}"
+
+
+class LLMCache:
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (text, expires_at, size)
+        self._inflight = {}
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(model: str, prompt: str, cache_key: str = None) -> str:
+        raw = f"{model}\x00{cache_key or normalize_prompt(prompt)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, text: str, ttl: float):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (text, time.monotonic() + ttl, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_call(self, key: str, ttl: float, call) -> str:
+        """call: 無參數 coroutine function；以「❌」開頭的錯誤回應不快取"""
+        cached = self.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            metrics.inc("llm_cache", result="hit")
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            metrics.inc("llm_cache", result="coalesced")
+        else:
+            self.stats["misses"] += 1
+            metrics.inc("llm_cache", result="miss")
+            task = asyncio.ensure_future(self._run(key, ttl, call))
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, ttl: float, call) -> str:
+        try:
+            text = await call()
+            if not text.startswith("❌"):
+                self.put(key, text, ttl)
+            return text
+        finally:
+            self._inflight.pop(key, None)
+
+    def summary(self) -> str:
+        s = self.stats
+        kb = self._bytes / 1024
+        return f"{len(self._entries)} 筆 {kb:.0f}KB / 命中 {s['hits']} / 未命中 {s['misses']} / 合併 {s['coalesced']}"
@@ -1,72 +1,297 @@
 """
 FlowAI 交易機器人 v5.1
-雲端友好版：CoinCap 價格 + Grok AI 分析
+雲端友好版：多來源行情 + Grok AI 分析
 """
 
 import os
+import sys
+import math
+import time
 import asyncio
 import logging
+from decimal import Decimal
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-import aiohttp
+from telegram.error import BadRequest, Forbidden
+from telegram.helpers import escape_markdown
 
 from bybit_trader import BybitTrader
+from market_data import MARKET_HEALTH_INTERVAL
+from symbols import registry as symbol_registry, SYMBOL_REFRESH_INTERVAL
+from price_pipeline import PricePipeline
+from batch_analysis import BatchAnalyzer, BIAS_EMOJI, BATCH_MAX_SYMBOLS
+from http_client import http, timeout
+from grok_stream import GrokStreamError, stream_chat, collect
+from price_feed import PriceFeed
+from llm_cache import LLMCache, price_bucket
+from report_scheduler import ReportScheduler
+from funding_store import FundingStore, FundingCollector, FUNDING_SYMBOLS, FUNDING_POLL_INTERVAL, DAY_MS
+from arb_backtest import HAS_NUMPY, ARB_ROUNDTRIP_FEE, align_series, backtest, window_distribution
+from candles import CandleStore, CandleService, CANDLE_INTERVAL
+from orderbook import OrderFlowEngine, liquidation_bands
+from alerts import AlertEngine
+from broadcast import Broadcaster
+from execution import ExecutionEngine
+from account import AccountState, ACCOUNT_POLL_INTERVAL, TOTAL
+from signals import SignalLog, SIGNAL_FORMAT, PROMPT_VERSION, strip_signal_line, replay
+from webhook import run_webhook
+from update_processor import ChatOrderedProcessor
+from metrics import metrics, timed, instrument, TelegramRequest, start_metrics_server, METRICS_PORT
+from request_scheduler import RequestScheduler, PRIORITY_ADMIN, PRIORITY_PUBLIC, PRIORITY_BACKGROUND
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
 GROK_API_KEY = os.getenv("GROK_API_KEY", "")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID", "")
+# polling / webhook（也可用 `python main.py webhook` 指定）
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+PRICE_FEED_ENABLED = os.getenv("PRICE_FEED_ENABLED", "1") == "1"
+SOURCE_TIMEOUT = float(os.getenv("SOURCE_TIMEOUT", "8"))
+USD_TWD = float(os.getenv("USD_TWD", "32"))
+FLOW_SYMBOLS = [
+    s.strip().upper() for s in os.getenv("FLOW_SYMBOLS", "BTCUSDT,ETHUSDT").split(",") if s.strip()
+]
+ARB_LOOKBACK_DAYS = int(os.getenv("ARB_LOOKBACK_DAYS", "90"))
+ALERT_CHECK_INTERVAL = float(os.getenv("ALERT_CHECK_INTERVAL", "5"))
+REPORT_INTERVALS = {
+    "radar": float(os.getenv("REPORT_INTERVAL_RADAR", "60")),
+    "gold": float(os.getenv("REPORT_INTERVAL_GOLD", "300")),
+    "calendar": float(os.getenv("REPORT_INTERVAL_CALENDAR", "3600")),
+}
+# 可訂閱的報告與推送間隔（秒）
+BROADCAST_INTERVALS = {
+    "radar": float(os.getenv("BROADCAST_INTERVAL_RADAR", "3600")),
+    "gold": float(os.getenv("BROADCAST_INTERVAL_GOLD", "14400")),
+    "calendar": float(os.getenv("BROADCAST_INTERVAL_CALENDAR", "86400")),
+}
+RADAR_WATCHLIST = [
+    s.strip().upper() for s in os.getenv("RADAR_WATCHLIST", "BTCUSDT,ETHUSDT,SOLUSDT").split(",") if s.strip()
+]
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 trader = BybitTrader()
+grok_cache = LLMCache()
+reports = ReportScheduler()
+grok_limiter = RequestScheduler()
+funding_store = FundingStore()          # 第一次使用時才開檔載入
+funding_collector = FundingCollector(funding_store)
+trader.funding = funding_store
+candle_store = CandleStore()
+candles = CandleService(candle_store, ["BTCUSDT", "ETHUSDT", "SOLUSDT"] + RADAR_WATCHLIST)
+trader.candles = candles
+order_flow = OrderFlowEngine(FLOW_SYMBOLS)
+alert_engine = AlertEngine()
+broadcaster = Broadcaster()
+signal_log = SignalLog()
+executor = ExecutionEngine(trader)
+account = AccountState(trader)
+account.order_listeners.append(executor.apply)
+
+GROK_MODEL = os.getenv("GROK_MODEL", "grok-4-1-fast-reasoning")
+GROK_API_URL = os.getenv("GROK_API_URL", "https://api.x.ai/v1/chat/completions")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# 各命令的 Grok 回應快取秒數（0 = 不快取）
+GROK_TTL = {
+    "btc": 60,
+    "eth": 60,
+    "sol": 60,
+    "price": 60,
+    "flow": 120,
+    "signal": 120,
+    "liq": 120,
+    "gold": 300,
+    "calendar": 3600,
+}
+
+# 各命令處理逾時秒數（未列出者用 UPDATE_TIMEOUT）
+COMMAND_TIMEOUTS = {
+    # 含 Grok 呼叫（最長 90s，另加排隊與行情抓取）的命令須大於 90s
+    "radar": 120,
+    "btc": 120,
+    "eth": 120,
+    "sol": 120,
+    "price": 120,
+    "signal": 120,
+    "flow": 120,
+    "liq": 120,
+    "gold": 150,
+    "calendar": 150,
+    "arb": 30,
+    # 下單重試鏈最壞約 4 次 × 15s 加退避與查詢，須在送出完成前不被取消
+    "long": 120,
+    "short": 120,
+}
+
+# 開啟命令追蹤的聊天（/trace）
+trace_chats = set()
+
+# 不同 chat 併發、同 chat 依序；同 chat 的新命令會取消進行中的 AI 分析
+update_processor = ChatOrderedProcessor(timeouts=COMMAND_TIMEOUTS, cancellable=GROK_TTL)
 
 # ═══════════════════════════════════════════════════════════════════════
 # API 函數
 # ═══════════════════════════════════════════════════════════════════════
 
+@timed("fear_greed")
 async def get_fear_greed_index():
     """恐懼貪婪指數"""
     url = "https://api.alternative.me/fng/"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=10) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("data", [{}])[0]
+        async with http.session.get(url, timeout=timeout(10)) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                return data.get("data", [{}])[0]
     except:
         pass
     return None
 
+# 逾時/失敗來源的佔位結果
+PENDING = {"retCode": -1, "retMsg": "獲取中..."}
+
+async def _with_deadline(name: str, coro, deadline: float):
+    try:
+        return await asyncio.wait_for(coro, timeout=deadline)
+    except asyncio.TimeoutError:
+        logger.warning(f"資料源逾時: {name} (>{deadline}s)")
+    except Exception as e:
+        logger.error(f"資料源錯誤: {name}: {e}")
+    return None
+
+async def fetch_all(sources: dict, deadlines: dict = None) -> dict:
+    """並行抓取多個資料源，總耗時約等於最慢的單一來源
+    
+    sources: {名稱: coroutine}；deadlines: {名稱: 秒數}（預設 SOURCE_TIMEOUT）
+    逾時或失敗的來源回傳 None，不影響其他來源
+    """
+    deadlines = deadlines or {}
+    names = list(sources)
+    results = await asyncio.gather(*[
+        _with_deadline(name, sources[name], deadlines.get(name, SOURCE_TIMEOUT))
+        for name in names
+    ])
+    return dict(zip(names, results))
+
 async def get_gold_price():
     """黃金價格 - 用 Grok 搜尋"""
     # 直接用 AI 獲取最新價格
     return None  # 改用 AI 分析
 
-async def call_grok(prompt: str) -> str:
-    """Grok AI 分析"""
+def grok_priority(update: Update) -> int:
+    """管理員的請求優先於公開分析"""
+    return PRIORITY_ADMIN if str(update.effective_chat.id) == ADMIN_CHAT_ID else PRIORITY_PUBLIC
+
+async def call_grok(prompt: str, ttl: float = 0, cache_key: str = None,
+                    chat_id=None, priority: int = PRIORITY_PUBLIC, schema: dict = None) -> str:
+    """Grok AI 分析
+    
+    ttl > 0 時經回應快取；cache_key 可取代 prompt 作為快取 key（如價格分桶）
+    schema 為 response_format（結構化 JSON 輸出）
+    實際外呼經 grok_limiter 排程（併發上限、限速、優先級、chat 公平）
+    延遲只在 _post_grok 記錄（grok_api）；快取命中 / 未命中記為 llm_cache 計數器
+    """
     if not GROK_API_KEY:
         return "❌ Grok API 未配置"
-    
-    url = "https://api.x.ai/v1/chat/completions"
+    if ttl > 0:
+        key = LLMCache.make_key(GROK_MODEL, prompt, cache_key)
+        return await grok_cache.get_or_call(key, ttl, lambda: _request_grok(prompt, chat_id, priority, schema))
+    return await _request_grok(prompt, chat_id, priority, schema)
+
+async def _request_grok(prompt: str, chat_id=None, priority: int = PRIORITY_PUBLIC, schema: dict = None) -> str:
+    async with grok_limiter.slot(chat_id, priority):
+        return await _post_grok(prompt, schema)
+
+@timed("grok_api")
+async def _post_grok(prompt: str, schema: dict = None) -> str:
+    url = GROK_API_URL
     headers = {"Authorization": f"Bearer {GROK_API_KEY}", "Content-Type": "application/json"}
     payload = {
-        "model": "grok-4-1-fast-reasoning",
+        "model": GROK_MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": 0.7
     }
+    if schema:
+        payload["response_format"] = schema
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload, timeout=90) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data["choices"][0]["message"]["content"]
-                return f"❌ API 錯誤: {resp.status}"
+        async with http.session.post(url, headers=headers, json=payload, timeout=timeout(90)) as resp:
+            if resp.status == 200:
+                data = await resp.json()
+                return data["choices"][0]["message"]["content"]
+            return f"❌ API 錯誤: {resp.status}"
     except Exception as e:
         return f"❌ 錯誤: {str(e)}"
 
+async def stream_grok(prompt: str, chat_id=None, priority: int = PRIORITY_PUBLIC):
+    """Grok 串流模式（SSE），逐段 yield 文字；失敗拋出 GrokStreamError"""
+    if not GROK_API_KEY:
+        raise GrokStreamError("❌ Grok API 未配置")
+    
+    headers = {"Authorization": f"Bearer {GROK_API_KEY}", "Content-Type": "application/json"}
+    payload = {
+        "model": GROK_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.7,
+    }
+    async with grok_limiter.slot(chat_id, priority):
+        async for chunk in stream_chat(GROK_API_URL, headers, payload):
+            yield chunk
+
+async def _edit(message, text: str, parse_mode: str = None):
+    try:
+        await message.edit_text(text, parse_mode=parse_mode)
+    except BadRequest as e:
+        if parse_mode and "not modified" not in str(e):
+            # Markdown 解析失敗時改送純文字
+            await message.edit_text(text)
+
+async def reply_streaming(message, header: str, prompt: str, footer: str = "",
+                          ttl: float = 0, cache_key: str = None,
+                          chat_id=None, priority: int = PRIORITY_PUBLIC) -> str:
+    """把佔位訊息逐步編輯成 Grok 回應（限速批次編輯），回傳完整分析文字
+    
+    ttl > 0 時經 grok_cache 單飛：相同 key 的並行請求共用一條串流，其餘請求在完成後直接顯示結果
+    串流失敗時顯示已收到的部分與錯誤訊息，不寫入快取
+    """
+    async def show_progress(text: str):
+        # 串流中用純文字，避免未閉合的 Markdown 導致編輯失敗
+        await _edit(message, f"{header}{text} ▌")
+    
+    def stream():
+        return collect(stream_grok(prompt, chat_id, priority), show_progress, STREAM_EDIT_INTERVAL)
+    
+    try:
+        if ttl > 0:
+            analysis = await grok_cache.get_or_call(LLMCache.make_key(GROK_MODEL, prompt, cache_key), ttl, stream)
+        else:
+            analysis = await stream()
+    except GrokStreamError as e:
+        analysis = f"{e.partial}\n\n{e}" if e.partial else str(e)
+    
+    await _edit(message, f"{header}{analysis}{footer}", parse_mode='Markdown')
+    return analysis
+
+# ═══════════════════════════════════════════════════════════════════════
+# 報告預算
+# ═══════════════════════════════════════════════════════════════════════
+
+async def build_ai_report(name: str, parts) -> str:
+    """產生 AI 報告全文；Grok 失敗時回傳 None（不覆蓋舊報告）"""
+    header, prompt, footer = parts()
+    analysis = await call_grok(prompt, GROK_TTL[name], priority=PRIORITY_BACKGROUND)
+    if analysis.startswith("❌"):
+        return None
+    return f"{header}{analysis}{footer}"
+
+async def reply_precomputed(update: Update, name: str) -> bool:
+    text = reports.get(name)
+    if text is None:
+        return False
+    await update.message.reply_text(text, parse_mode='Markdown')
+    return True
+
 # ═══════════════════════════════════════════════════════════════════════
 # 基本命令
 # ═══════════════════════════════════════════════════════════════════════
@@ -78,20 +303,33 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /btc - BTC 即時分析
 /eth - ETH 分析
 /sol - SOL 分析
+/price DOGE - 任一幣種分析
 /radar - 全景報告
 /gold - 黃金分析
 
 📈 *進階分析*
 /flow - Order Flow 分析
 /signal - 交易信號
+/signals - 信號回測
 /funding - 資金費率
 /arb - 套利計算器
 /liq - 清算地圖
 /calendar - 財經日曆
 
+🔔 *價格提醒*
+/alert BTC > 70000 - 新增提醒
+/alerts - 我的提醒
+/unalert - 刪除提醒
+/subscribe - 訂閱定時報告
+/unsubscribe - 取消訂閱
+
 💰 *交易功能* ⚠️需VPS
 /balance - 查詢餘額
 /position - 查詢持倉
+/long BTC 0.01 - 做多（支援 twap / iceberg）
+/short BTC 0.01 - 做空
+/orders - 訂單與切單任務
+/pnlalert 500 - 盈虧門檻提醒
 
 ⚙️ *系統*
 /status - 系統狀態
@@ -103,102 +341,67 @@ _FlowAI v5.1 - Order Flow 交易系統_"""
 # 價格查詢
 # ═══════════════════════════════════════════════════════════════════════
 
-async def btc(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🔶 正在獲取 BTC 數據...")
-    
-    ticker = await trader.get_ticker(symbol="BTCUSDT")
-    fng = await get_fear_greed_index()
-    
-    if ticker.get("retCode") == 0:
-        data = ticker["result"]["list"][0]
-        price = float(data["lastPrice"])
-        change = float(data["price24hPcnt"]) * 100
-        
-        fng_value = fng.get("value", "N/A") if fng else "N/A"
-        fng_text = fng.get("value_classification", "") if fng else ""
-        
-        prompt = f"""BTC 即時數據：
-價格：${price:,.2f}
-24h 漲跌：{change:+.2f}%
-恐懼貪婪指數：{fng_value} ({fng_text})
-
-用繁體中文分析（100字內）：
-1. 市場情緒解讀
-2. 短線方向判斷
-3. 關鍵支撐/阻力價位"""
-        
-        analysis = await call_grok(prompt)
-        
-        result = f"""🔶 *BTC/USDT*
-━━━━━━━━━━━━━━━━
-💰 價格：${price:,.2f}
-📊 24h：{change:+.2f}%
-😱 恐懼貪婪：{fng_value} ({fng_text})
-⏰ {datetime.now().strftime('%H:%M:%S')}
-
-📝 *AI 分析：*
-{analysis}"""
-    else:
-        result = f"❌ 錯誤: {ticker.get('retMsg', '未知')}"
-    
+price_pipeline = PricePipeline(
+    trader, call_grok, get_fear_greed_index, levels=candles.levels_text,
+    registry=symbol_registry, ai_ttl=GROK_TTL["price"],
+)
+
+# 多幣種一次請求、逐幣快取（全景報告與自訂清單）
+batch_analyzer = BatchAnalyzer(
+    lambda prompt, schema: call_grok(prompt, schema=schema, priority=PRIORITY_BACKGROUND),
+    grok_cache, GROK_MODEL,
+)
+
+async def reply_price(update: Update, info):
+    """任一幣種的分析（共用 price_pipeline）"""
+    await update.message.reply_text(f"{info.emoji} 正在獲取 {info.base} 數據...")
+    result = await price_pipeline.run(info, chat_id=update.effective_chat.id, priority=grok_priority(update))
     await update.message.reply_text(result, parse_mode='Markdown')
 
-async def eth(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🔷 正在獲取 ETH 數據...")
-    
-    ticker = await trader.get_ticker(symbol="ETHUSDT")
-    
-    if ticker.get("retCode") == 0:
-        data = ticker["result"]["list"][0]
-        price = float(data["lastPrice"])
-        change = float(data["price24hPcnt"]) * 100
-        
-        prompt = f"ETH 價格 ${price:,.2f}，24h {change:+.2f}%。用繁體中文簡短分析市場情緒和短線方向（50字內）"
-        analysis = await call_grok(prompt)
-        
-        result = f"""🔷 *ETH/USDT*
-━━━━━━━━━━━━━━━━
-💰 ${price:,.2f}
-📊 {change:+.2f}%
+async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/price <SYMBOL>：任何已註冊的幣種"""
+    info = symbol_registry.resolve(context.args[0]) if context.args else None
+    if info is None:
+        hint = f"❌ 不支援的幣種：{context.args[0]}\n" if context.args else ""
+        await update.message.reply_text(f"{hint}💡 用法：`/price DOGE` 或 `/price ARBUSDT`", parse_mode='Markdown')
+        return
+    await reply_price(update, info)
 
-📝 {analysis}"""
-    else:
-        result = f"❌ 錯誤: {ticker.get('retMsg')}"
-    
-    await update.message.reply_text(result, parse_mode='Markdown')
+async def btc(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_price(update, symbol_registry.get("BTCUSDT"))
+
+async def eth(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_price(update, symbol_registry.get("ETHUSDT"))
 
 async def sol(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🟣 正在獲取 SOL 數據...")
-    
-    ticker = await trader.get_ticker(symbol="SOLUSDT")
-    
-    if ticker.get("retCode") == 0:
+    await reply_price(update, symbol_registry.get("SOLUSDT"))
+
+def radar_items(symbols: list, tickers: dict) -> list:
+    """批次 AI 分析的輸入：有行情的幣種 + RSI"""
+    items = []
+    for symbol in symbols:
+        ticker = tickers.get(symbol) or PENDING
+        if ticker.get("retCode") != 0:
+            continue
         data = ticker["result"]["list"][0]
-        price = float(data["lastPrice"])
-        change = float(data["price24hPcnt"]) * 100
-        
-        prompt = f"SOL 價格 ${price:,.2f}，24h {change:+.2f}%。用繁體中文簡短分析（50字內）"
-        analysis = await call_grok(prompt)
-        
-        result = f"""🟣 *SOL/USDT*
-━━━━━━━━━━━━━━━━
-💰 ${price:,.2f}
-📊 {change:+.2f}%
-
-📝 {analysis}"""
-    else:
-        result = f"❌ 錯誤: {ticker.get('retMsg')}"
-    
-    await update.message.reply_text(result, parse_mode='Markdown')
-
-async def radar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """全景報告"""
-    await update.message.reply_text("🌐 正在生成全景報告...")
-    
-    btc_ticker = await trader.get_ticker(symbol="BTCUSDT")
-    eth_ticker = await trader.get_ticker(symbol="ETHUSDT")
-    sol_ticker = await trader.get_ticker(symbol="SOLUSDT")
-    fng = await get_fear_greed_index()
+        snap = candles.levels(symbol)
+        items.append({
+            "symbol": symbol,
+            "price": float(data["lastPrice"]),
+            "change": float(data["price24hPcnt"]) * 100,
+            "levels": f"RSI14 {snap['rsi']:.0f}" if snap and snap["rsi"] is not None else "",
+        })
+    return items
+
+async def build_radar_report(symbols: list = None) -> str:
+    """全景報告文字（預算排程與即時命令共用）；symbols 為自訂清單"""
+    symbols = symbols or RADAR_WATCHLIST
+    sources = await fetch_all({
+        "tickers": trader.get_tickers(symbols),
+        "fng": get_fear_greed_index(),
+    })
+    tickers = sources["tickers"] or {}
+    fng = sources["fng"]
     
     msg = "🌐 *FlowAI 全景報告*\n━━━━━━━━━━━━━━━━\n"
     
@@ -209,25 +412,56 @@ async def radar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         emoji = "😱" if value < 25 else "😰" if value < 50 else "😐" if value < 75 else "🤑"
         msg += f"{emoji} 恐懼貪婪：{value} ({classification})\n\n"
     
+    # 每個幣種的 AI 點評：一次批次請求
+    analyses = {}
+    if GROK_API_KEY:
+        try:
+            analyses = await batch_analyzer.analyze(radar_items(symbols, tickers))
+        except Exception as e:
+            logger.error(f"批次分析失敗: {e}")
+    
     # 加密貨幣
-    for name, ticker in [("BTC", btc_ticker), ("ETH", eth_ticker), ("SOL", sol_ticker)]:
+    for symbol in symbols:
+        name = symbol.removesuffix("USDT")
+        ticker = tickers.get(symbol) or PENDING
         if ticker.get("retCode") == 0:
             data = ticker["result"]["list"][0]
             price = float(data["lastPrice"])
             change = float(data["price24hPcnt"]) * 100
             emoji = "🟢" if change >= 0 else "🔴"
-            msg += f"{emoji} {name}: ${price:,.2f} ({change:+.1f}%)\n"
+            price_text = f"{price:,.2f}" if price >= 1 else f"{price:.6g}"
+            msg += f"{emoji} {name}: ${price_text} ({change:+.1f}%)\n"
+            analysis = analyses.get(symbol)
+            if analysis:
+                # AI 點評為自由文字，跳脫後才能放進 Markdown 訊息
+                msg += f"   └ {BIAS_EMOJI[analysis['bias']]} {escape_markdown(analysis['comment'])}\n"
         else:
             msg += f"⚪ {name}: 獲取中...\n"
     
     msg += f"\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     
-    await update.message.reply_text(msg, parse_mode='Markdown')
+    return msg
 
-async def gold(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """黃金分析 - 用 AI 獲取"""
-    await update.message.reply_text("🥇 正在分析黃金...")
+async def radar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """全景報告；/radar DOGE PEPE ARB 為自訂清單（即時生成）"""
+    if context.args:
+        infos = [symbol_registry.resolve(arg) for arg in context.args]
+        symbols = list(dict.fromkeys(info.symbol for info in infos if info))[:BATCH_MAX_SYMBOLS]
+        if not symbols:
+            await update.message.reply_text("💡 用法：`/radar` 或 `/radar DOGE PEPE ARB`", parse_mode='Markdown')
+            return
+        await update.message.reply_text("🌐 正在生成自訂清單...")
+        await update.message.reply_text(await build_radar_report(symbols), parse_mode='Markdown')
+        return
     
+    msg = reports.get("radar")
+    if msg is None:
+        await update.message.reply_text("🌐 正在生成全景報告...")
+        msg = await build_radar_report()
+    
+    await update.message.reply_text(msg, parse_mode='Markdown')
+
+def gold_report_parts():
     prompt = """查詢現在 XAUUSD 黃金的即時價格，並用繁體中文分析：
 1. 當前價格（美元/盎司）
 2. 今日漲跌
@@ -236,40 +470,110 @@ async def gold(update: Update, context: ContextTypes.DEFAULT_TYPE):
 5. 短線方向建議
 
 控制在 150 字內"""
-    
-    analysis = await call_grok(prompt)
-    
-    result = f"""🥇 *XAUUSD 黃金分析*
-━━━━━━━━━━━━━━━━
-{analysis}
+    header = "🥇 *XAUUSD 黃金分析*\n━━━━━━━━━━━━━━━━\n"
+    footer = f"\n\n⏰ {datetime.now().strftime('%H:%M:%S')}"
+    return header, prompt, footer
 
-⏰ {datetime.now().strftime('%H:%M:%S')}"""
-    
-    await update.message.reply_text(result, parse_mode='Markdown')
+async def gold(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """黃金分析 - 用 AI 獲取"""
+    if await reply_precomputed(update, "gold"):
+        return
+    placeholder = await update.message.reply_text("🥇 正在分析黃金...")
+    header, prompt, footer = gold_report_parts()
+    await reply_streaming(placeholder, header, prompt, footer, GROK_TTL["gold"],
+                          chat_id=update.effective_chat.id, priority=grok_priority(update))
 
 # ═══════════════════════════════════════════════════════════════════════
 # 進階分析
 # ═══════════════════════════════════════════════════════════════════════
 
+def flow_symbol(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """命令參數中的幣種（如 /flow eth ai），預設 BTC；不在 FLOW_SYMBOLS 的幣種回傳 None"""
+    for arg in context.args or []:
+        if arg.lower() == "ai":
+            continue
+        symbol = arg.upper()
+        symbol = symbol if symbol.endswith("USDT") else f"{symbol}USDT"
+        return symbol if symbol in FLOW_SYMBOLS else None
+    return "BTCUSDT"
+
+async def reply_flow_unsupported(update: Update):
+    names = ", ".join(s.removesuffix("USDT") for s in FLOW_SYMBOLS)
+    await update.message.reply_text(f"❌ 不支援的幣種（盤口數據僅支援：{names}）")
+
+def wants_ai(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return any(arg.lower() == "ai" for arg in context.args or [])
+
+def render_flow(symbol: str) -> str:
+    """盤口數據報告（毫秒級，無外呼）"""
+    snap = order_flow.snapshot(symbol)
+    name = symbol.removesuffix("USDT")
+    imbalance = snap["imbalance"] * 100
+    bias = "🟢 買盤主導" if imbalance > 15 else "🔴 賣盤主導" if imbalance < -15 else "🟡 均衡"
+    msg = f"""📊 *Order Flow：{name}*
+━━━━━━━━━━━━━━━━
+💰 中間價：${snap['mid']:,.2f}（價差 {snap['spread']:.2f}）
+⚖️ 盤口失衡：{imbalance:+.1f}% {bias}
+├ 買盤：{snap['bid_total']:,.3f}
+└ 賣盤：{snap['ask_total']:,.3f}
+
+📈 *成交 Delta：*
+├ {order_flow.flows[symbol].window / 60:.0f} 分鐘：{snap['window_delta']:+,.3f}
+└ 累計 CVD：{snap['cvd']:+,.3f}（買 {snap['buy_volume']:,.3f} / 賣 {snap['sell_volume']:,.3f}）
+"""
+    walls = snap["walls"]
+    if walls["bids"] or walls["asks"]:
+        msg += "\n🧱 *大單牆：*\n"
+        for price, qty in walls["asks"]:
+            msg += f"🔴 ${price:,.2f} × {qty:,.3f}\n"
+        for price, qty in walls["bids"]:
+            msg += f"🟢 ${price:,.2f} × {qty:,.3f}\n"
+    return msg
+
 async def flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Order Flow 分析"""
+    symbol = flow_symbol(context)
+    if symbol is None:
+        await reply_flow_unsupported(update)
+        return
+    if order_flow.ready(symbol):
+        msg = render_flow(symbol)
+        if not wants_ai(context):
+            await update.message.reply_text(msg + "\n💡 `/flow ai` 加上 AI 解讀", parse_mode='Markdown')
+            return
+        placeholder = await update.message.reply_text(msg + "\n🧠 AI 解讀中...", parse_mode='Markdown')
+        prompt = f"""以下是 {symbol} 即時盤口與成交數據：
+{msg}
+作為 Order Flow 交易專家，用繁體中文（100字內）解讀多空力量、大單牆意義與短線操作建議。"""
+        snap = order_flow.snapshot(symbol)
+        cache_key = f"flowdata:{symbol}:{price_bucket(snap['mid'])}:{snap['imbalance']:.1f}"
+        await reply_streaming(placeholder, msg + "\n🧠 *AI 解讀：*\n", prompt, "", GROK_TTL["flow"], cache_key,
+                              chat_id=update.effective_chat.id, priority=grok_priority(update))
+        return
+    
     await update.message.reply_text("📊 正在分析 Order Flow...")
     
-    ticker = await trader.get_ticker(symbol="BTCUSDT")
-    fng = await get_fear_greed_index()
+    sources = await fetch_all({
+        "ticker": trader.get_ticker(symbol=symbol),
+        "fng": get_fear_greed_index(),
+    })
+    ticker = sources["ticker"] or PENDING
+    fng = sources["fng"]
     
     if ticker.get("retCode") == 0:
         data = ticker["result"]["list"][0]
         price = float(data["lastPrice"])
         change = float(data["price24hPcnt"]) * 100
         fng_value = int(fng.get("value", 50)) if fng else 50
+        name = symbol.removesuffix("USDT")
         
-        prompt = f"""作為 Order Flow 交易專家，分析 BTC：
+        prompt = f"""作為 Order Flow 交易專家，分析 {name}：
 
 數據：
 - 價格：${price:,.2f}
 - 24h 漲跌：{change:+.2f}%
 - 恐懼貪婪：{fng_value}
+{candles.levels_text(symbol)}
 
 用繁體中文分析（150字內）：
 1. 大單動向推測（機構買/賣壓力）
@@ -277,11 +581,14 @@ async def flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
 3. 關鍵價位（支撐/阻力）
 4. 短線操作建議"""
         
-        analysis = await call_grok(prompt)
+        analysis = await call_grok(
+            prompt, GROK_TTL["flow"], f"flow:{symbol}:{price_bucket(price)}:{change:.0f}:{fng_value}",
+            chat_id=update.effective_chat.id, priority=grok_priority(update)
+        )
         
         result = f"""📊 *Order Flow 分析*
 ━━━━━━━━━━━━━━━━
-💰 BTC: ${price:,.2f} ({change:+.2f}%)
+💰 {name}: ${price:,.2f} ({change:+.2f}%)
 😱 恐懼貪婪: {fng_value}
 
 🔍 *大單分析：*
@@ -295,8 +602,12 @@ async def signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """交易信號"""
     await update.message.reply_text("🎯 正在生成交易信號...")
     
-    btc = await trader.get_ticker(symbol="BTCUSDT")
-    fng = await get_fear_greed_index()
+    sources = await fetch_all({
+        "ticker": trader.get_ticker(symbol="BTCUSDT"),
+        "fng": get_fear_greed_index(),
+    })
+    btc = sources["ticker"] or PENDING
+    fng = sources["fng"]
     
     if btc.get("retCode") == 0:
         btc_price = float(btc["result"]["list"][0]["lastPrice"])
@@ -307,6 +618,7 @@ async def signal(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 BTC: ${btc_price:,.2f} ({btc_change:+.2f}%)
 恐懼貪婪: {fng_value}
+{candles.levels_text("BTCUSDT")}
 
 用繁體中文給出：
 1. 信號方向：🟢做多 / 🔴做空 / 🟡觀望
@@ -316,9 +628,16 @@ BTC: ${btc_price:,.2f} ({btc_change:+.2f}%)
 5. 倉位建議（輕倉/中倉/重倉）
 6. 信心指數 (1-10)
 
-格式清晰，100字內"""
+格式清晰，100字內
+{SIGNAL_FORMAT}"""
         
-        analysis = await call_grok(prompt)
+        analysis = await call_grok(
+            prompt, GROK_TTL["signal"], f"signal:{PROMPT_VERSION}:{price_bucket(btc_price)}:{btc_change:.0f}:{fng_value}",
+            chat_id=update.effective_chat.id, priority=grok_priority(update)
+        )
+        if not analysis.startswith("❌"):
+            signal_log.record("BTCUSDT", analysis, GROK_MODEL)
+        analysis = strip_signal_line(analysis)
         
         result = f"""🎯 *交易信號*
 ━━━━━━━━━━━━━━━━
@@ -335,26 +654,66 @@ BTC: ${btc_price:,.2f} ({btc_change:+.2f}%)
     
     await update.message.reply_text(result, parse_mode='Markdown')
 
-async def funding(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """資金費率"""
-    await update.message.reply_text("💸 正在分析資金費率...")
-    
-    prompt = """查詢現在 BTC 和 ETH 在 Binance/Bybit 的永續合約資金費率，並分析：
-
-用繁體中文回答：
-1. BTC 資金費率（%）
-2. ETH 資金費率（%）
-3. 費率解讀（正=多頭付空頭，負=空頭付多頭）
-4. 套利機會分析
-5. 費率異常警示（如有）
-
-100字內"""
-    
-    analysis = await call_grok(prompt)
-    
-    result = f"""💸 *資金費率分析*
+def build_signal_report(days: int) -> str:
+    """信號回測：命中率、R 倍數、信心校準（依模型 / 提示詞版本分組）"""
+    if not HAS_NUMPY:
+        return "⚠️ 需安裝 numpy"
+    report = replay(signal_log, candle_store, CANDLE_INTERVAL, since=time.time() - days * 86400)
+    if report["all"] is None:
+        return f"📭 近 {days} 日沒有可評估的信號"
+    o = report["all"]["overall"]
+    msg = f"""🎯 *信號回測（近 {days} 日）*
 ━━━━━━━━━━━━━━━━
-{analysis}
+已結算 {o['count']} / 未成交 {o['unfilled']} / 未結 {o['pending']}
+"""
+    for label, summary in report["groups"].items():
+        g = summary["overall"]
+        if not g["count"]:
+            msg += f"\n🤖 `{label}`：尚無結算\n"
+            continue
+        msg += f"\n🤖 `{label}`\n├ 命中率：{g['hit_rate'] * 100:.0f}%（{g['count']} 筆）\n├ 平均 R：{g['avg_r']:+.2f} ｜ 累計 R：{g['total_r']:+.1f}\n"
+        for bucket in summary["buckets"]:
+            if bucket["count"]:
+                low, high = bucket["range"]
+                msg += f"├ 信心 {low}-{high}：{bucket['hit_rate'] * 100:.0f}% vs 預期 {bucket['expected'] * 100:.0f}%（{bucket['count']} 筆，R {bucket['avg_r']:+.2f}）\n"
+    msg += "\n💡 用法：`/signals 30`（回測天數）"
+    return msg
+
+async def signals(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """已記錄信號的回測評估"""
+    days = 30
+    if context.args:
+        try:
+            days = max(1, int(context.args[0]))
+        except ValueError:
+            pass
+    await update.message.reply_text(build_signal_report(days), parse_mode='Markdown')
+
+def build_funding_report() -> str:
+    """資金費率報告（讀本地序列，無外呼）"""
+    msg = "💸 *資金費率*\n━━━━━━━━━━━━━━━━\n"
+    has_data = False
+    for symbol in FUNDING_SYMBOLS:
+        latest = funding_store.latest(symbol)
+        if latest is None:
+            msg += f"⚪ {symbol.removesuffix('USDT')}: 尚無資料\n"
+            continue
+        has_data = True
+        ts, rate = latest
+        avg_1d = funding_store.average(symbol, 1)
+        avg_7d = funding_store.average(symbol, 7)
+        avg_30d = funding_store.average(symbol, 30)
+        per_day = funding_store.periods_per_day(symbol)
+        emoji = "🟢" if rate >= 0 else "🔴"
+        msg += f"""{emoji} *{symbol.removesuffix('USDT')}*: {rate * 100:.4f}%/{24 / per_day:.0f}h
+   1日 {avg_1d * 100:.4f}% | 7日 {avg_7d * 100:.4f}% | 30日 {avg_30d * 100:.4f}%
+   年化(7日均) {avg_7d * per_day * 365 * 100:.2f}%
+"""
+    if has_data:
+        updated = max(funding_store.latest(s)[0] for s in FUNDING_SYMBOLS if funding_store.latest(s))
+        msg += f"\n🕗 最近結算：{datetime.fromtimestamp(updated / 1000).strftime('%m-%d %H:%M')}"
+    
+    msg += f"""
 
 📖 *套利說明：*
 正費率 → 做空收錢
@@ -362,20 +721,14 @@ async def funding(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 💡 用 /arb [本金] 計算收益
 ⏰ {datetime.now().strftime('%H:%M:%S')}"""
-    
-    await update.message.reply_text(result, parse_mode='Markdown')
+    return msg
 
-async def arb(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """資金費率套利計算器"""
-    principal = 300000  # 預設 NT$300K
-    if context.args:
-        try:
-            principal = float(context.args[0])
-        except:
-            pass
-    
-    await update.message.reply_text(f"💰 計算 NT${principal:,.0f} 套利收益...")
-    
+async def funding(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """資金費率"""
+    await update.message.reply_text(build_funding_report(), parse_mode='Markdown')
+
+def arb_estimate_report(principal: float) -> str:
+    """無歷史資料時：以假設費率估算"""
     # 假設平均費率 0.01%
     rate = 0.01
     
@@ -387,11 +740,11 @@ async def arb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     monthly_profit = principal * (monthly_rate / 100)
     annual_profit = principal * (annual_rate / 100)
     
-    usd_principal = principal / 32
+    usd_principal = principal / USD_TWD
     
-    result = f"""💰 *資金費率套利計算器*
+    return f"""💰 *資金費率套利計算器*
 ━━━━━━━━━━━━━━━━
-📊 假設 BTC 資金費率：{rate:.4f}%/8h
+📊 假設 BTC 資金費率：{rate:.4f}%/8h（尚無歷史資料）
 
 💵 *本金：NT${principal:,.0f}* (≈${usd_principal:,.0f})
 
@@ -409,19 +762,115 @@ async def arb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 4. 高費率時機會更好
 
 💡 用法：`/arb 500000`"""
+
+def arb_backtest_report(principal: float, days: int) -> str:
+    """以本地費率歷史回測（所有幣種一次向量化計算）"""
+    symbols = [s for s in FUNDING_SYMBOLS if len(funding_store.series.get(s, ())) >= 2]
+    if not HAS_NUMPY or not symbols:
+        return arb_estimate_report(principal)
     
-    await update.message.reply_text(result, parse_mode='Markdown')
+    # 依結算時間戳對齊：上架較晚或結算間隔不同的幣種各自只計有資料的期數
+    ts, rates = align_series([funding_store.history(s) for s in symbols])
+    keep = ts > ts[-1] - days * DAY_MS
+    ts, rates = ts[keep], rates[:, keep]
+    per_day = [funding_store.periods_per_day(s) for s in symbols]
+    result = backtest(rates, [principal], periods_per_day=per_day)
+    dist = window_distribution(rates, ts, min(30, days))
+    span = (ts[-1] - ts[0]) / DAY_MS
+    
+    msg = f"""💰 *資金費率套利回測*
+━━━━━━━━━━━━━━━━
+💵 *本金：NT${principal:,.0f}* (≈${principal / USD_TWD:,.0f})
+📅 回測區間：{span:.0f} 日（要求 {days} 日）
+"""
+    for idx, symbol in enumerate(symbols):
+        pnl = result["pnl"][idx, 0]
+        hours = 24 / per_day[idx]
+        p5, p50, p95 = dist[idx] * 100
+        spread = "資料不足" if math.isnan(p50) else f"P5 {p5:.2f}% / P50 {p50:.2f}% / P95 {p95:.2f}%"
+        msg += f"""
+{"🟢" if pnl >= 0 else "🔴"} *{symbol.removesuffix('USDT')}*（{result['periods'][idx]} 期 × {hours:.0f}h）
+├ 平均費率：{result['mean_rate'][idx] * 100:.4f}%/{hours:.0f}h（負費率 {result['negative_share'][idx] * 100:.0f}%）
+├ 淨年化：{result['annual_net'][idx] * 100:.2f}%
+├ 區間損益：NT${pnl:,.0f}（日均 NT${result['daily_pnl'][idx, 0]:,.0f}）
+├ 最大回撤：{result['max_drawdown'][idx] * 100:.3f}% ｜ 最差單期：{result['worst_period'][idx] * 100:.4f}%
+└ {min(30, days)}日持有分布：{spread}
+"""
+    msg += f"""
+⚠️ 已扣開平倉手續費 {ARB_ROUNDTRIP_FEE * 100:.2f}% 與對沖再平衡成本
+💡 用法：`/arb 500000 90`（本金、回測天數）"""
+    return msg
+
+async def arb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """資金費率套利計算器"""
+    principal = 300000  # 預設 NT$300K
+    days = ARB_LOOKBACK_DAYS
+    if context.args:
+        try:
+            principal = float(context.args[0])
+            if len(context.args) > 1:
+                days = max(1, int(context.args[1]))
+        except:
+            pass
+    
+    await update.message.reply_text(arb_backtest_report(principal, days), parse_mode='Markdown')
+
+def render_liq(symbol: str, price: float, open_interest: float) -> str:
+    """依持倉量與槓桿分層估算的清算地圖"""
+    name = symbol.removesuffix("USDT")
+    msg = f"""💥 *清算地圖：{name}*
+━━━━━━━━━━━━━━━━
+💰 價格：${price:,.2f}
+📦 持倉量：${open_interest:,.0f}
+
+⬆️ *空單清算帶：*
+"""
+    bands = liquidation_bands(price, open_interest)
+    for band in bands:
+        msg += f"├ {band['leverage']}x：${band['short_price']:,.0f}（≈${band['notional'] / 1e6:,.1f}M）\n"
+    msg += "\n⬇️ *多單清算帶：*\n"
+    for band in bands:
+        msg += f"├ {band['leverage']}x：${band['long_price']:,.0f}（≈${band['notional'] / 1e6:,.1f}M）\n"
+    if order_flow.ready(symbol):
+        walls = order_flow.snapshot(symbol)["walls"]
+        if walls["bids"] or walls["asks"]:
+            msg += "\n🧱 *盤口大單：*\n"
+            msg += "".join(f"🔴 ${p:,.2f} × {q:,.3f}\n" for p, q in walls["asks"])
+            msg += "".join(f"🟢 ${p:,.2f} × {q:,.3f}\n" for p, q in walls["bids"])
+    msg += "\n⚠️ _依持倉量與槓桿分布假設估算_"
+    return msg
 
 async def liq(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """清算地圖"""
+    symbol = flow_symbol(context)
+    if symbol is None:
+        await reply_flow_unsupported(update)
+        return
+    tick = trader.feed.get(symbol) if trader.feed else None
+    data = tick["result"]["list"][0] if tick else {}
+    if data.get("openInterestValue"):
+        msg = render_liq(symbol, float(data["lastPrice"]), float(data["openInterestValue"]))
+        if not wants_ai(context):
+            await update.message.reply_text(msg, parse_mode='Markdown')
+            return
+        placeholder = await update.message.reply_text(msg + "\n\n🧠 AI 解讀中...", parse_mode='Markdown')
+        prompt = f"""以下是 {symbol} 依持倉量估算的清算地圖：
+{msg}
+用繁體中文（100字內）說明哪邊清算量較大、價格可能被吸引的方向與風險。"""
+        cache_key = f"liqdata:{symbol}:{price_bucket(float(data['lastPrice']))}"
+        await reply_streaming(placeholder, msg + "\n\n🧠 *AI 解讀：*\n", prompt, "", GROK_TTL["liq"], cache_key,
+                              chat_id=update.effective_chat.id, priority=grok_priority(update))
+        return
+    
     await update.message.reply_text("💥 正在分析清算風險...")
     
-    ticker = await trader.get_ticker(symbol="BTCUSDT")
+    ticker = await trader.get_ticker(symbol=symbol)
     
     if ticker.get("retCode") == 0:
         price = float(ticker["result"]["list"][0]["lastPrice"])
+        name = symbol.removesuffix("USDT")
         
-        prompt = f"""BTC 當前價格 ${price:,.2f}，分析清算風險：
+        prompt = f"""{name} 當前價格 ${price:,.2f}，分析清算風險：
 
 用繁體中文回答（100字內）：
 1. 上方主要清算區（空單清算價位）
@@ -430,11 +879,14 @@ async def liq(update: Update, context: ContextTypes.DEFAULT_TYPE):
 4. 價格可能被吸引的方向
 5. 風險警示"""
         
-        analysis = await call_grok(prompt)
+        analysis = await call_grok(
+            prompt, GROK_TTL["liq"], f"liq:{symbol}:{price_bucket(price)}",
+            chat_id=update.effective_chat.id, priority=grok_priority(update)
+        )
         
         result = f"""💥 *清算風險分析*
 ━━━━━━━━━━━━━━━━
-💰 BTC: ${price:,.2f}
+💰 {name}: ${price:,.2f}
 
 🔍 *清算地圖：*
 {analysis}
@@ -445,12 +897,8 @@ async def liq(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(result, parse_mode='Markdown')
 
-async def calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """財經日曆"""
-    await update.message.reply_text("📅 正在獲取財經事件...")
-    
+def calendar_report_parts():
     today = datetime.now().strftime('%Y-%m-%d')
-    
     prompt = f"""今天是 {today}，列出本週重要財經事件：
 
 用繁體中文，格式：
@@ -463,108 +911,359 @@ async def calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 4. 其他重大事件
 
 最多 8 個，按重要性排序"""
-    
-    analysis = await call_grok(prompt)
-    
-    result = f"""📅 *本週財經日曆*
-━━━━━━━━━━━━━━━━
-{analysis}
+    header = "📅 *本週財經日曆*\n━━━━━━━━━━━━━━━━\n"
+    footer = f"""
 
 ⏰ 更新：{datetime.now().strftime('%H:%M')}
 💡 重大事件可能引發波動"""
-    
-    await update.message.reply_text(result, parse_mode='Markdown')
+    return header, prompt, footer
+
+async def calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """財經日曆"""
+    if await reply_precomputed(update, "calendar"):
+        return
+    placeholder = await update.message.reply_text("📅 正在獲取財經事件...")
+    header, prompt, footer = calendar_report_parts()
+    await reply_streaming(placeholder, header, prompt, footer, GROK_TTL["calendar"],
+                          chat_id=update.effective_chat.id, priority=grok_priority(update))
 
 # ═══════════════════════════════════════════════════════════════════════
-# 交易功能（需 VPS）
+# 價格提醒
 # ═══════════════════════════════════════════════════════════════════════
 
-async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
-        await update.message.reply_text("⛔ 僅管理員可用")
+def parse_alert(args: list):
+    """'BTC > 70000' / 'BTC>70000' / 'btc < 60000' → (symbol, direction, threshold)"""
+    text = "".join(args).upper().replace(",", "")
+    for direction in (">", "<"):
+        if direction in text:
+            coin, _, value = text.partition(direction)
+            symbol = coin if coin.endswith("USDT") else f"{coin}USDT"
+            threshold = float(value)
+            # nan / inf 會破壞提醒簿的排序陣列
+            if not math.isfinite(threshold) or threshold <= 0:
+                raise ValueError("價格需為正數")
+            return symbol, direction, threshold
+    raise ValueError("格式錯誤")
+
+async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """新增價格提醒"""
+    try:
+        symbol, direction, threshold = parse_alert(context.args or [])
+    except ValueError:
+        await update.message.reply_text("💡 用法：`/alert BTC > 70000` 或 `/alert ETH < 3000`", parse_mode='Markdown')
+        return
+    if not trader.market.supports(symbol):
+        await update.message.reply_text(f"❌ 不支援的幣種：{symbol}")
+        return
+    try:
+        alert_id = alert_engine.add(update.effective_chat.id, symbol, direction, threshold)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    word = "突破" if direction == ">" else "跌破"
+    await update.message.reply_text(f"🔔 已設定 #{alert_id}：{symbol.removesuffix('USDT')} {word} ${threshold:,.2f} 時通知")
+
+async def alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """列出價格提醒"""
+    items = alert_engine.for_chat(update.effective_chat.id)
+    if not items:
+        await update.message.reply_text("🔕 目前沒有價格提醒\n💡 用 `/alert BTC > 70000` 新增", parse_mode='Markdown')
+        return
+    msg = "🔔 *價格提醒*\n━━━━━━━━━━━━━━━━\n"
+    for alert_id, symbol, direction, threshold in items:
+        msg += f"#{alert_id} {symbol.removesuffix('USDT')} {direction} ${threshold:,.2f}\n"
+    msg += "\n💡 用 `/unalert 編號` 刪除"
+    await update.message.reply_text(msg, parse_mode='Markdown')
+
+async def unalert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """刪除價格提醒"""
+    try:
+        alert_id = int(context.args[0].lstrip("#"))
+    except (IndexError, ValueError):
+        await update.message.reply_text("💡 用法：`/unalert 編號`", parse_mode='Markdown')
         return
+    if alert_engine.remove(update.effective_chat.id, alert_id):
+        await update.message.reply_text(f"🗑 已刪除 #{alert_id}")
+    else:
+        await update.message.reply_text(f"❌ 找不到 #{alert_id}")
+
+async def alert_job(context: ContextTypes.DEFAULT_TYPE):
+    """補查沒有推送行情的幣種，並把觸發的提醒按 chat 合併送出"""
+    polled = [s for s in alert_engine.symbols if not (trader.feed and trader.feed.get(s))]
+    if polled:
+        tickers = await trader.get_tickers(polled)
+        for symbol, ticker in tickers.items():
+            if ticker.get("retCode") == 0:
+                alert_engine.on_price(symbol, float(ticker["result"]["list"][0]["lastPrice"]))
     
-    await update.message.reply_text("💰 正在查詢餘額...")
-    result = await trader.get_wallet_balance()
-    
-    if result.get("retCode") == 0:
-        coins = result.get("result", {}).get("list", [{}])[0].get("coin", [])
-        msg = "💰 *Bybit 帳戶餘額*\n━━━━━━━━━━━━━━━━\n"
-        total = 0
-        for coin in coins:
-            bal = float(coin.get("walletBalance", 0))
-            if bal > 0:
-                usd = float(coin.get("usdValue", 0))
-                total += usd
-                msg += f"💎 {coin['coin']}: {bal:.4f} (${usd:,.2f})\n"
-        msg += f"\n💵 *總資產：${total:,.2f}*"
+    for chat_id, hits in alert_engine.drain().items():
+        msg = "🔔 *價格提醒觸發*\n━━━━━━━━━━━━━━━━\n"
+        for _, (_, symbol, direction, threshold), price in hits:
+            word = "突破" if direction == ">" else "跌破"
+            msg += f"{symbol.removesuffix('USDT')} {word} ${threshold:,.2f}（現價 ${price:,.2f}）\n"
+        try:
+            await context.bot.send_message(chat_id, msg, parse_mode='Markdown')
+        except (Forbidden, BadRequest) as e:
+            # 被封鎖 / 聊天不存在：重送也不會成功
+            logger.warning(f"提醒無法送達 {chat_id}: {e}")
+        except Exception as e:
+            logger.warning(f"提醒送出失敗 {chat_id}，下次重送: {e}")
+            alert_engine.requeue(chat_id, hits)
+            continue
+        alert_engine.ack(hits)
+
+# ═══════════════════════════════════════════════════════════════════════
+# 訂閱推送
+# ═══════════════════════════════════════════════════════════════════════
+
+def topic_names() -> str:
+    return " / ".join(f"`{topic}`" for topic in BROADCAST_INTERVALS)
+
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """訂閱定時報告（預設 radar）"""
+    topic = (context.args[0] if context.args else "radar").lower()
+    if topic not in BROADCAST_INTERVALS:
+        await update.message.reply_text(f"💡 可訂閱：{topic_names()}", parse_mode='Markdown')
+        return
+    hours = BROADCAST_INTERVALS[topic] / 3600
+    if broadcaster.subscribe(update.effective_chat.id, topic):
+        await update.message.reply_text(f"📬 已訂閱 {topic}，每 {hours:g} 小時推送一次\n💡 `/unsubscribe {topic}` 取消", parse_mode='Markdown')
     else:
-        msg = f"""❌ {result.get('retMsg', '錯誤')}
+        await update.message.reply_text(f"📬 已經訂閱過 {topic}")
+
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """取消訂閱（不帶參數取消全部）"""
+    topic = context.args[0].lower() if context.args else None
+    if broadcaster.unsubscribe(update.effective_chat.id, topic):
+        await update.message.reply_text(f"🔕 已取消訂閱 {topic or '全部報告'}")
+    else:
+        topics = broadcaster.topics(update.effective_chat.id)
+        await update.message.reply_text(f"❌ 沒有訂閱 {topic}" if topics else "🔕 目前沒有訂閱")
+
+async def broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """報告只渲染一次，交給推播管線扇出"""
+    topic = context.job.data
+    if not broadcaster.subscribers(topic):
+        return
+    text = reports.get(topic) or await reports.refresh(topic)
+    if text:
+        count = broadcaster.publish(topic, text)
+        logger.info(f"📬 推送 {topic} → {count} 個訂閱")
+
+# ═══════════════════════════════════════════════════════════════════════
+# 交易功能（需 VPS）
+# ═══════════════════════════════════════════════════════════════════════
+
+ACCOUNT_ERROR = """❌ {error}
 
 💡 *解決方案：*
 雲端平台 IP 被 Bybit 封鎖
 請使用 VPS 部署（如 DigitalOcean $4/月）"""
+
+async def ensure_account() -> str:
+    """帳戶狀態未同步（推送未連線且已過期）時補一次快照；回傳錯誤訊息或 None"""
+    if account.ready:
+        return None
+    result = await account.refresh()
+    return None if result.get("retCode") == 0 else result.get("retMsg", "錯誤")
+
+async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """帳戶餘額（讀帳戶狀態服務，無外呼）"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        await update.message.reply_text("⛔ 僅管理員可用")
+        return
     
+    error = await ensure_account()
+    if error:
+        await update.message.reply_text(ACCOUNT_ERROR.format(error=error), parse_mode='Markdown')
+        return
+    
+    msg = "💰 *Bybit 帳戶餘額*\n━━━━━━━━━━━━━━━━\n"
+    total = 0
+    for coin, bal, usd in account.balances():
+        total += usd
+        msg += f"💎 {coin}: {bal:.4f} (${usd:,.2f})\n"
+    msg += f"\n💵 *總資產：${total:,.2f}*"
+    if account.equity:
+        msg += f"\n📈 權益：${account.equity:,.2f}"
+    msg += f"\n⏰ {account.age():.0f}s 前更新"
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 async def position(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """當前持倉（讀帳戶狀態服務，盈虧依即時標記價格）"""
     if str(update.effective_chat.id) != ADMIN_CHAT_ID:
         await update.message.reply_text("⛔ 僅管理員可用")
         return
     
-    result = await trader.get_positions()
-    
-    if result.get("retCode") == 0:
-        positions = result.get("result", {}).get("list", [])
-        has_pos = False
-        msg = "📊 *當前持倉*\n━━━━━━━━━━━━━━━━\n"
-        for pos in positions:
-            size = float(pos.get("size", 0))
-            if size > 0:
-                has_pos = True
-                pnl = float(pos.get("unrealisedPnl", 0))
-                emoji = "🟢" if pnl >= 0 else "🔴"
-                msg += f"{emoji} {pos['symbol']} {pos['side']}: {size}\n   盈虧: ${pnl:,.2f}\n"
-        if not has_pos:
-            msg = "📊 目前無持倉"
-    else:
-        msg = f"""❌ {result.get('retMsg')}
-
-💡 雲端 IP 被封鎖，請用 VPS 部署"""
+    error = await ensure_account()
+    if error:
+        await update.message.reply_text(ACCOUNT_ERROR.format(error=error), parse_mode='Markdown')
+        return
     
+    positions = account.open_positions()
+    if not positions:
+        await update.message.reply_text("📊 目前無持倉")
+        return
+    msg = "📊 *當前持倉*\n━━━━━━━━━━━━━━━━\n"
+    for pos in positions:
+        pnl = float(pos.get("unrealisedPnl") or 0)
+        emoji = "🟢" if pnl >= 0 else "🔴"
+        msg += f"{emoji} {pos['symbol']} {pos['side']}: {pos['size']}\n   盈虧: ${pnl:,.2f}\n"
+    msg += f"\n💵 *合計盈虧：${account.pnl():,.2f}*"
     await update.message.reply_text(msg, parse_mode='Markdown')
 
-async def long_btc(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def pnlalert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """盈虧門檻提醒：/pnlalert [幣種] <金額>、/pnlalert del <編號>、/pnlalert clear"""
     if str(update.effective_chat.id) != ADMIN_CHAT_ID:
         await update.message.reply_text("⛔ 僅管理員可用")
         return
     
-    await update.message.reply_text("""⚠️ *交易功能需要 VPS 部署*
+    args = list(context.args)
+    try:
+        if not args:
+            lines = [alert.describe() for alert in account.alerts]
+            msg = "💹 *盈虧提醒*\n━━━━━━━━━━━━━━━━\n" + ("\n".join(lines) or "尚無提醒")
+            msg += "\n\n💡 用法：`/pnlalert 500`、`/pnlalert BTC -200`、`/pnlalert del 1`、`/pnlalert clear`"
+        elif args[0].lower() == "clear":
+            msg = f"🗑 已刪除 {account.remove_alert()} 個提醒"
+        elif args[0].lower() == "del":
+            msg = "🗑 已刪除" if account.remove_alert(int(args[1])) else "⚠️ 找不到提醒"
+        else:
+            symbol = TOTAL
+            if len(args) > 1:
+                info = symbol_registry.resolve(args.pop(0))
+                if info is None:
+                    raise ValueError("未知幣種")
+                symbol = info.symbol
+            alert = account.add_alert(float(args[0]), symbol)
+            msg = f"✅ 已新增 {alert.describe()}"
+    except (ValueError, IndexError) as e:
+        msg = f"❌ 格式錯誤：{e}"
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-雲端平台 (Railway/Render) 的 IP 被 Bybit 封鎖
+ORDER_USAGE = """💡 *用法：*
+`/long 0.01` - BTC 市價
+`/long ETH 0.5` - 指定幣種
+`/long BTC 0.3 twap 6 30` - 30 分鐘內分 6 片
+`/long BTC 1 iceberg 0.2 65000` - 冰山限價，每片 0.2
+`/orders` 查看 ｜ `/cancel 1` 取消切單任務"""
+
+def parse_order_args(args: list):
+    """[幣種] 數量 [twap 片數 分鐘 | iceberg 每片數量 價格] → (symbol, qty, mode, params)"""
+    args = list(args)
+    symbol = "BTCUSDT"
+    if args and not args[0].replace(".", "", 1).isdigit():
+        info = symbol_registry.resolve(args.pop(0))
+        if info is None:
+            raise ValueError("未知幣種")
+        symbol = info.symbol
+    if not args:
+        raise ValueError("缺少數量")
+    qty = str(Decimal(args[0]))
+    mode = args[1].lower() if len(args) > 1 else "market"
+    if mode == "twap":
+        return symbol, qty, mode, (int(args[2]), float(args[3]) * 60)
+    if mode == "iceberg":
+        if Decimal(args[2]) <= 0:
+            raise ValueError("每片數量需大於 0")
+        return symbol, qty, mode, (str(Decimal(args[2])), str(Decimal(args[3])))
+    if mode != "market":
+        raise ValueError(f"未知模式: {mode}")
+    return symbol, qty, mode, ()
+
+async def place_command(update: Update, context: ContextTypes.DEFAULT_TYPE, side: str):
+    """/long、/short：市價、TWAP、冰山單（經執行引擎）"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        await update.message.reply_text("⛔ 僅管理員可用")
+        return
+    try:
+        symbol, qty, mode, params = parse_order_args(context.args)
+    except (ValueError, IndexError, ArithmeticError) as e:
+        await update.message.reply_text(f"❌ {e}\n\n{ORDER_USAGE}", parse_mode='Markdown')
+        return
+    
+    emoji = "🟢" if side == "Buy" else "🔴"
+    if mode == "market":
+        order = await executor.place(symbol, side, qty)
+        if order.status == "Rejected":
+            msg = f"❌ 下單失敗：{order.error}"
+        elif order.status == "Unknown":
+            msg = f"⚠️ *{symbol} {side} {qty}* 狀態未知（{order.error}），可能已下單，請以 /orders 或 /position 確認\n🆔 `{order.link_id}`"
+        else:
+            msg = f"{emoji} *{symbol} {side} {qty}* 已送出\n🆔 `{order.link_id}`"
+    else:
+        if mode == "twap":
+            job = executor.twap(symbol, side, qty, *params)
+        else:
+            job = executor.iceberg(symbol, side, qty, *params)
+        msg = f"{emoji} *切單任務已啟動*\n{job.summary()}\n\n取消：`/cancel {job.id}`"
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-💡 *解決方案：*
-使用 VPS（如 DigitalOcean $4/月）
-詳見部署指南""", parse_mode='Markdown')
+async def long_btc(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await place_command(update, context, "Buy")
 
 async def short_btc(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await place_command(update, context, "Sell")
+
+async def orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """本地訂單狀態與切單任務（不查詢交易所）"""
     if str(update.effective_chat.id) != ADMIN_CHAT_ID:
         await update.message.reply_text("⛔ 僅管理員可用")
         return
     
-    await update.message.reply_text("""⚠️ *交易功能需要 VPS 部署*
-
-雲端平台 IP 被 Bybit 封鎖
+    msg = "📋 *訂單*\n━━━━━━━━━━━━━━━━\n"
+    open_orders = executor.open_orders()
+    for order in open_orders[-20:]:
+        price = f" @ {order.price}" if order.price else ""
+        msg += f"⏳ {order.symbol} {order.side} {order.qty}{price}（{order.status}，成交 {order.filled}）\n"
+    if not open_orders:
+        msg += "無未完成訂單\n"
+    jobs = [job for job in executor.jobs.values()][-10:]
+    if jobs:
+        msg += "\n✂️ *切單任務：*\n" + "\n".join(job.summary() for job in jobs)
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-💡 使用 VPS 解鎖完整功能""", parse_mode='Markdown')
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """取消切單任務：/cancel <任務編號>"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        await update.message.reply_text("⛔ 僅管理員可用")
+        return
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("💡 用法：`/cancel 1`", parse_mode='Markdown')
+        return
+    if await executor.cancel_job(job_id):
+        await update.message.reply_text(f"🛑 已取消\n{executor.jobs[job_id].summary()}")
+    else:
+        await update.message.reply_text("⚠️ 找不到執行中的任務")
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = f"""⚙️ *FlowAI 系統狀態*
 ━━━━━━━━━━━━━━━━
 🤖 Grok API: {"✅" if GROK_API_KEY else "❌"}
-📊 價格來源: CoinCap ✅
+🛰 更新來源: {context.bot_data["webhook"].summary() if "webhook" in context.bot_data else "polling"}
+⚡ 更新處理: {update_processor.summary()}
+📡 即時推送: {trader.feed.summary() if trader.feed else "未啟用"}
+🗃 行情快取: {trader.ticker_cache.summary()}
+🪙 分析管線: {price_pipeline.summary()}
+🧠 AI 快取: {grok_cache.summary()}
+📦 批次分析: {batch_analyzer.summary()}
+🚦 AI 排程: {grok_limiter.summary()}
+💸 資金費率: {funding_collector.summary()}
+🔔 價格提醒: {alert_engine.summary()}
+📬 訂閱推送: {broadcaster.summary()}
+🎯 信號紀錄: {signal_log.count()} 筆
+🧾 下單執行: {executor.summary()}
+👛 帳戶狀態: {account.summary()}
 💹 交易 API: Bybit ⚠️需VPS
 
+📊 *行情來源：*
+{trader.market.summary()}
+
+🗓 *報告預算：*
+{reports.summary()}
+
 👤 Admin: {ADMIN_CHAT_ID}
 ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
@@ -578,44 +1277,153 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ⚠️ 餘額/持倉/下單 (需VPS)"""
     await update.message.reply_text(msg, parse_mode='Markdown')
 
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """延遲指標（管理員）：/metrics [handler|upstream|telegram]"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        await update.message.reply_text("⛔ 僅管理員可用")
+        return
+    name = context.args[0] if context.args else None
+    await update.message.reply_text(f"📈 延遲指標\n```\n{metrics.table(name)[:3800]}\n```", parse_mode='Markdown')
+
+async def trace(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """切換本聊天的命令追蹤（管理員）：開啟後每個命令回覆耗時拆解"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        await update.message.reply_text("⛔ 僅管理員可用")
+        return
+    chat_id = update.effective_chat.id
+    if chat_id in trace_chats:
+        trace_chats.discard(chat_id)
+        await update.message.reply_text("🔍 追蹤已關閉")
+    else:
+        trace_chats.add(chat_id)
+        await update.message.reply_text("🔍 追蹤已開啟，之後每個命令會附上耗時拆解")
+
 # ═══════════════════════════════════════════════════════════════════════
 # 主程序
 # ═══════════════════════════════════════════════════════════════════════
 
+def command(name: str, handler) -> CommandHandler:
+    """命令處理函數一律經 instrument 記錄延遲與追蹤"""
+    return CommandHandler(name, instrument(name, handler, trace_chats))
+
+def register_reports():
+    reports.register("radar", build_radar_report, REPORT_INTERVALS["radar"])
+    reports.register("gold", lambda: build_ai_report("gold", gold_report_parts), REPORT_INTERVALS["gold"])
+    reports.register("calendar", lambda: build_ai_report("calendar", calendar_report_parts), REPORT_INTERVALS["calendar"])
+
+async def on_startup(app: Application):
+    await http.start()
+    # 由本地 K 線暖機指標、還原價格提醒（不在 import 時讀檔）
+    candles.load()
+    alert_engine.load()
+    if app.job_queue:
+        register_reports()
+        reports.schedule(app.job_queue)
+        app.job_queue.run_repeating(funding_collector.run_job, interval=FUNDING_POLL_INTERVAL, first=0, name="funding")
+        app.job_queue.run_repeating(symbol_registry.run_job, interval=SYMBOL_REFRESH_INTERVAL, first=0, name="symbols")
+        app.job_queue.run_repeating(trader.market.run_job, interval=MARKET_HEALTH_INTERVAL, first=0, name="market-health")
+        app.job_queue.run_repeating(candles.run_job, interval=CANDLE_INTERVAL, first=0, name="candles")
+        app.job_queue.run_repeating(alert_job, interval=ALERT_CHECK_INTERVAL, first=ALERT_CHECK_INTERVAL, name="alerts")
+        app.job_queue.run_repeating(account.run_job, interval=ACCOUNT_POLL_INTERVAL, first=ACCOUNT_POLL_INTERVAL, name="account")
+        for topic, interval in BROADCAST_INTERVALS.items():
+            app.job_queue.run_repeating(broadcast_job, interval=interval, first=interval, name=f"broadcast:{topic}", data=topic)
+    else:
+        logger.warning("JobQueue 未安裝，報告預算停用（pip install python-telegram-bot[job-queue]）")
+    if PRICE_FEED_ENABLED:
+        trader.feed = PriceFeed(["BTCUSDT", "ETHUSDT", "SOLUSDT"] + RADAR_WATCHLIST)
+        trader.feed.listeners.append(candles.on_tick)
+        order_flow.attach(trader.feed)
+        trader.feed.listeners.append(alert_engine.on_tick)
+        trader.feed.listeners.append(account.on_tick)
+        account.watch = trader.feed.watch
+        trader.feed.start()
+    broadcaster.start(app.bot)
+    if ADMIN_CHAT_ID:
+        account.notify = lambda text: app.bot.send_message(ADMIN_CHAT_ID, text)
+    account.start()
+    # polling 與 webhook 模式都只在 METRICS_PORT 提供 /metrics
+    if METRICS_PORT:
+        app.bot_data["metrics_runner"] = await start_metrics_server(METRICS_PORT)
+
+async def on_shutdown(app: Application):
+    if "metrics_runner" in app.bot_data:
+        await app.bot_data["metrics_runner"].cleanup()
+    await broadcaster.stop()
+    await executor.stop()
+    await account.stop()
+    if trader.feed:
+        await trader.feed.stop()
+    await http.close()
+    funding_store.close()
+    candle_store.close()
+    alert_engine.close()
+    broadcaster.close()
+    signal_log.close()
+
 def main():
     if not TELEGRAM_TOKEN:
         print("❌ 請設置 TELEGRAM_TOKEN")
         return
     
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    mode = sys.argv[1].lower() if len(sys.argv) > 1 else BOT_MODE
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(update_processor)
+        .request(TelegramRequest())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if mode == "webhook":
+        builder = builder.updater(None)
+    app = builder.build()
     
     # 基本
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("status", status))
+    app.add_handler(command("start", start))
+    app.add_handler(command("status", status))
+    app.add_handler(command("metrics", metrics_command))
+    app.add_handler(command("trace", trace))
     
     # 價格
-    app.add_handler(CommandHandler("btc", btc))
-    app.add_handler(CommandHandler("eth", eth))
-    app.add_handler(CommandHandler("sol", sol))
-    app.add_handler(CommandHandler("radar", radar))
-    app.add_handler(CommandHandler("gold", gold))
+    app.add_handler(command("btc", btc))
+    app.add_handler(command("eth", eth))
+    app.add_handler(command("sol", sol))
+    app.add_handler(command("price", price))
+    app.add_handler(command("radar", radar))
+    app.add_handler(command("gold", gold))
     
     # 進階
-    app.add_handler(CommandHandler("flow", flow))
-    app.add_handler(CommandHandler("signal", signal))
-    app.add_handler(CommandHandler("funding", funding))
-    app.add_handler(CommandHandler("arb", arb))
-    app.add_handler(CommandHandler("liq", liq))
-    app.add_handler(CommandHandler("calendar", calendar))
+    app.add_handler(command("flow", flow))
+    app.add_handler(command("signal", signal))
+    app.add_handler(command("signals", signals))
+    app.add_handler(command("funding", funding))
+    app.add_handler(command("arb", arb))
+    app.add_handler(command("liq", liq))
+    app.add_handler(command("calendar", calendar))
+    
+    # 提醒
+    app.add_handler(command("alert", alert))
+    app.add_handler(command("alerts", alerts))
+    app.add_handler(command("unalert", unalert))
+    
+    # 訂閱
+    app.add_handler(command("subscribe", subscribe))
+    app.add_handler(command("unsubscribe", unsubscribe))
     
     # 交易
-    app.add_handler(CommandHandler("balance", balance))
-    app.add_handler(CommandHandler("position", position))
-    app.add_handler(CommandHandler("long", long_btc))
-    app.add_handler(CommandHandler("short", short_btc))
+    app.add_handler(command("balance", balance))
+    app.add_handler(command("position", position))
+    app.add_handler(command("long", long_btc))
+    app.add_handler(command("short", short_btc))
+    app.add_handler(command("orders", orders))
+    app.add_handler(command("pnlalert", pnlalert))
+    app.add_handler(command("cancel", cancel))
     
-    print("🚀 FlowAI v5.1 啟動！")
-    app.run_polling(drop_pending_updates=True)
+    print(f"🚀 FlowAI v5.1 啟動！({mode})")
+    if mode == "webhook":
+        run_webhook(app)
+    else:
+        app.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+"""
+行情快取
+- 以 symbol 為 key 的 TTL 快取
+- Single-flight：同時 miss 的請求共用同一個上游請求
+- Stale-while-revalidate：過期但仍在寬限期內的資料先回傳，背景刷新
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+TICKER_CACHE_TTL = float(os.getenv("TICKER_CACHE_TTL", "5"))
+TICKER_STALE_TTL = float(os.getenv("TICKER_STALE_TTL", "60"))
+
+
+class TTLCache:
+    """非同步 TTL 快取（只快取 retCode == 0 的結果）"""
+
+    def __init__(self, ttl: float = TICKER_CACHE_TTL, stale_ttl: float = TICKER_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}    # key -> (value, fetched_at)
+        self._inflight = {}   # key -> asyncio.Task
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0}
+
+    def peek(self, key):
+        """讀取未過期的快取值（不觸發請求）"""
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def put(self, key, value):
+        if value.get("retCode") == 0:
+            self._entries[key] = (value, time.monotonic())
+
+    async def get(self, key, fetch):
+        """fetch: 無參數的 coroutine function，回傳 Bybit 格式 dict"""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry:
+            age = now - entry[1]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return entry[0]
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale"] += 1
+                self._refresh(key, fetch)
+                return entry[0]
+
+        if key in self._inflight:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+        return await asyncio.shield(self._refresh(key, fetch))
+
+    def _refresh(self, key, fetch) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fetch))
+            self._inflight[key] = task
+        return task
+
+    async def _run(self, key, fetch):
+        try:
+            value = await fetch()
+            self.put(key, value)
+            return value
+        except Exception as e:
+            logger.error(f"快取刷新失敗 {key}: {e}")
+            return {"retCode": -1, "retMsg": str(e)}
+        finally:
+            self._inflight.pop(key, None)
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"命中 {s['hits']} / 未命中 {s['misses']} / 合併 {s['coalesced']} / 過期回傳 {s['stale']}"
@@ -0,0 +1,339 @@
+"""
+行情來源層
+- 多個公開行情來源（CoinCap / Bybit / Binance / 本地假資料），統一回傳 Bybit 格式 ticker
+- 每個來源記錄滾動延遲與錯誤率，定時健康檢查
+- 每次請求選最快的健康來源；失敗自動換下一個
+- 可選對沖：主來源超過延遲門檻仍未回應，同時請求第二快的來源，先成功者採用
+- 來源沒有的幣種（例如 Binance 現貨未上架）視為單一幣種缺漏，不算來源失敗
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+from http_client import http, timeout
+from metrics import metrics
+from symbols import registry
+
+logger = logging.getLogger(__name__)
+
+MARKET_PROVIDERS = [
+    p.strip().lower() for p in os.getenv("MARKET_PROVIDERS", "coincap,bybit,binance").split(",") if p.strip()
+]
+MARKET_HEDGE_DELAY = float(os.getenv("MARKET_HEDGE_DELAY", "0.8"))   # 秒，0 = 不對沖
+MARKET_TIMEOUT = float(os.getenv("MARKET_TIMEOUT", "10"))
+MARKET_HEALTH_INTERVAL = float(os.getenv("MARKET_HEALTH_INTERVAL", "60"))
+MARKET_MAX_ERROR_RATE = float(os.getenv("MARKET_MAX_ERROR_RATE", "0.5"))
+MARKET_STATS_WINDOW = int(os.getenv("MARKET_STATS_WINDOW", "50"))
+
+COINCAP_URL = os.getenv("COINCAP_URL", "https://api.coincap.io/v2")
+BYBIT_PUBLIC_URL = os.getenv("BYBIT_PUBLIC_URL", "https://api.bybit.com")
+BINANCE_URL = os.getenv("BINANCE_URL", "https://api.binance.com")
+
+def make_ticker(symbol: str, price: float, change: float, high: float, low: float, volume) -> dict:
+    """Bybit 格式 ticker；change 為小數（0.012 = +1.2%）"""
+    return {
+        "retCode": 0,
+        "result": {
+            "list": [{
+                "symbol": symbol,
+                "lastPrice": str(price),
+                "price24hPcnt": str(change),
+                "highPrice24h": str(high),
+                "lowPrice24h": str(low),
+                "volume24h": str(volume or "0"),
+            }]
+        }
+    }
+
+
+def _coincap_ticker(symbol: str, data: dict) -> dict:
+    """CoinCap asset → Bybit 格式 ticker（CoinCap 沒有 24h 高低點，±2% 估算）"""
+    price = float(data.get("priceUsd") or 0)
+    change = float(data.get("changePercent24Hr") or 0)
+    return make_ticker(symbol, price, change / 100, price * 1.02, price * 0.98, data.get("volumeUsd24Hr"))
+
+
+def error_ticker(message: str) -> dict:
+    return {"retCode": -1, "retMsg": message}
+
+
+class ProviderError(RuntimeError):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class ProviderStats:
+    """最近 N 次請求的延遲與成敗"""
+
+    def __init__(self, window: int = MARKET_STATS_WINDOW):
+        self.calls = deque(maxlen=window)   # (latency_sec, ok)
+        self.failures = 0                   # 連續失敗次數
+        self.total = 0
+        self.last_error = None
+
+    def record(self, latency: float, ok: bool, error: str = None):
+        self.calls.append((latency, ok))
+        self.total += 1
+        self.failures = 0 if ok else self.failures + 1
+        if not ok:
+            self.last_error = error
+
+    @property
+    def error_rate(self) -> float:
+        return sum(not ok for _, ok in self.calls) / len(self.calls) if self.calls else 0.0
+
+    @property
+    def latency(self):
+        """成功請求的延遲中位數（秒），無資料回傳 None"""
+        values = sorted(latency for latency, ok in self.calls if ok)
+        return values[len(values) // 2] if values else None
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < 3 and self.error_rate <= MARKET_MAX_ERROR_RATE
+
+
+class Provider:
+    name = "base"
+
+    def __init__(self):
+        self.stats = ProviderStats()
+
+    def supports(self, symbol: str) -> bool:
+        return symbol in registry
+
+    async def fetch(self, symbols: list) -> dict:
+        """{symbol: ticker}；缺少的幣種由呼叫端補錯誤"""
+        raise NotImplementedError
+
+    async def _get_json(self, url: str, params: dict = None):
+        async with http.session.get(url, params=params, timeout=timeout(MARKET_TIMEOUT)) as resp:
+            if resp.status != 200:
+                raise ProviderError(f"{self.name} HTTP {resp.status}", resp.status)
+            return await resp.json(content_type=None)
+
+
+class CoinCapProvider(Provider):
+    name = "coincap"
+
+    def supports(self, symbol: str) -> bool:
+        return registry.coincap_id(symbol) is not None
+
+    async def fetch(self, symbols: list) -> dict:
+        by_id = {registry.coincap_id(symbol): symbol for symbol in symbols}
+        result = await self._get_json(f"{COINCAP_URL}/assets", {"ids": ",".join(by_id), "limit": str(len(by_id))})
+        tickers = {}
+        for data in result.get("data", []):
+            symbol = by_id.get(data.get("id"))
+            if symbol:
+                tickers[symbol] = _coincap_ticker(symbol, data)
+        return tickers
+
+
+class BybitPublicProvider(Provider):
+    name = "bybit"
+
+    async def fetch(self, symbols: list) -> dict:
+        params = {"category": "linear"}
+        if len(symbols) == 1:
+            params["symbol"] = symbols[0]
+        result = await self._get_json(f"{BYBIT_PUBLIC_URL}/v5/market/tickers", params)
+        if result.get("retCode") != 0:
+            raise RuntimeError(f"bybit {result.get('retMsg')}")
+        wanted = set(symbols)
+        return {
+            item["symbol"]: {"retCode": 0, "result": {"list": [item]}}
+            for item in result.get("result", {}).get("list", []) if item.get("symbol") in wanted
+        }
+
+
+class BinanceProvider(Provider):
+    name = "binance"
+
+    def __init__(self):
+        super().__init__()
+        self.unlisted = set()     # Binance 現貨沒有的幣種（回 400 Invalid symbol），之後不再送出
+
+    def supports(self, symbol: str) -> bool:
+        return super().supports(symbol) and symbol not in self.unlisted
+
+    async def fetch(self, symbols: list) -> dict:
+        symbols = [s for s in symbols if s not in self.unlisted]
+        if not symbols:
+            return {}
+        params = {"symbols": "[" + ",".join(f'"{s}"' for s in symbols) + "]"}
+        try:
+            result = await self._get_json(f"{BINANCE_URL}/api/v3/ticker/24hr", params)
+        except ProviderError as e:
+            if e.status != 400:
+                raise
+            # 只要有一個幣種不存在整批就 400：單一幣種記為未上架，多個則逐一重試找出來
+            if len(symbols) == 1:
+                logger.info(f"Binance 無此幣種: {symbols[0]}")
+                self.unlisted.add(symbols[0])
+                return {}
+            tickers = {}
+            for batch in await asyncio.gather(*(self.fetch([s]) for s in symbols)):
+                tickers.update(batch)
+            return tickers
+        return {
+            item["symbol"]: make_ticker(
+                item["symbol"], float(item["lastPrice"]), float(item["priceChangePercent"]) / 100,
+                float(item["highPrice"]), float(item["lowPrice"]), item.get("quoteVolume"),
+            )
+            for item in result
+        }
+
+
+class FakeProvider(Provider):
+    """本地假行情（隨機漫步），離線開發與壓測用"""
+    name = "fake"
+
+    def __init__(self, latency: float = 0.01, seed: int = None):
+        super().__init__()
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.prices = {}
+
+    def supports(self, symbol: str) -> bool:
+        return True
+
+    async def fetch(self, symbols: list) -> dict:
+        await asyncio.sleep(self.latency)
+        tickers = {}
+        for symbol in symbols:
+            price = self.prices.get(symbol) or self.rng.uniform(1, 1000)
+            price *= 1 + self.rng.gauss(0, 0.001)
+            self.prices[symbol] = price
+            tickers[symbol] = make_ticker(symbol, price, 0.0, price * 1.01, price * 0.99, 0)
+        return tickers
+
+
+PROVIDERS = {
+    "coincap": CoinCapProvider,
+    "bybit": BybitPublicProvider,
+    "binance": BinanceProvider,
+    "fake": FakeProvider,
+}
+
+
+class MarketRouter:
+    def __init__(self, providers: list = None, hedge_delay: float = MARKET_HEDGE_DELAY):
+        if providers is None:
+            providers = [PROVIDERS[name]() for name in MARKET_PROVIDERS if name in PROVIDERS]
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.stats = {"hedged": 0, "hedge_wins": 0, "failovers": 0}
+
+    def supports(self, symbol: str) -> bool:
+        return any(p.supports(symbol) for p in self.providers)
+
+    def ranked(self, symbols: list) -> list:
+        """支援這些幣種的來源：健康優先，再依延遲（無資料者優先試探），同分維持設定順序"""
+        candidates = [p for p in self.providers if any(p.supports(s) for s in symbols)]
+        return sorted(candidates, key=lambda p: (not p.stats.healthy, p.stats.latency or 0.0))
+
+    async def _call(self, provider: Provider, symbols: list) -> dict:
+        started = time.monotonic()
+        try:
+            tickers = await provider.fetch(symbols)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            provider.stats.record(time.monotonic() - started, False, str(e))
+            metrics.observe("upstream", time.monotonic() - started, True, call=f"market:{provider.name}")
+            logger.warning(f"行情來源 {provider.name} 失敗: {e}")
+            raise
+        # 沒資料但所有幣種都已確認來源不支援：幣種缺漏，不是來源故障
+        ok = bool(tickers) or not any(provider.supports(s) for s in symbols)
+        provider.stats.record(time.monotonic() - started, ok, None if ok else "無資料")
+        metrics.observe("upstream", time.monotonic() - started, not ok, call=f"market:{provider.name}")
+        if not tickers:
+            raise RuntimeError(f"{provider.name} 無資料")
+        return tickers
+
+    async def _hedged(self, primary: Provider, secondary: Provider, symbols: list):
+        """主來源逾時門檻未回應時加開第二個請求，先成功者勝出"""
+        first = asyncio.ensure_future(self._call(primary, symbols))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done:
+            return primary, first.result()
+        self.stats["hedged"] += 1
+        second = asyncio.ensure_future(self._call(secondary, symbols))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return (primary if task is first else secondary), task.result()
+            return None, None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def fetch(self, symbols: list) -> dict:
+        """{symbol: ticker}；依序嘗試排名後的來源，直到所有幣種都有資料"""
+        results = {}
+        missing = [s for s in symbols if self.supports(s)]
+        for symbol in symbols:
+            if symbol not in missing:
+                results[symbol] = error_ticker(f"不支援的幣種: {symbol}")
+
+        tried = set()
+        while missing:
+            ranked = [p for p in self.ranked(missing) if p.name not in tried]
+            if not ranked:
+                break
+            primary = ranked[0]
+            wanted = [s for s in missing if primary.supports(s)]
+            secondary = next((p for p in ranked[1:] if all(p.supports(s) for s in wanted)), None)
+            try:
+                if self.hedge_delay > 0 and secondary is not None:
+                    winner, tickers = await self._hedged(primary, secondary, wanted)
+                    if winner is None:
+                        tried.add(secondary.name)
+                        raise RuntimeError("對沖請求皆失敗")
+                    tried.add(winner.name)
+                else:
+                    tickers = await self._call(primary, wanted)
+            except Exception:
+                tickers = {}
+            tried.add(primary.name)
+            results.update(tickers)
+            missing = [s for s in missing if s not in tickers]
+            if missing and ranked[1:]:
+                self.stats["failovers"] += 1
+
+        for symbol in missing:
+            results[symbol] = error_ticker("所有行情來源皆失敗")
+        return results
+
+    async def health_check(self):
+        """每個來源各打一次 BTCUSDT（不健康的來源靠這裡恢復）"""
+        async def probe(provider):
+            try:
+                await self._call(provider, ["BTCUSDT"])
+            except Exception:
+                pass
+        await asyncio.gather(*(probe(p) for p in self.providers if p.supports("BTCUSDT")))
+
+    async def run_job(self, context):
+        await self.health_check()
+
+    def summary(self) -> str:
+        lines = []
+        for p in self.providers:
+            s = p.stats
+            latency = f"{s.latency * 1000:.0f}ms" if s.latency is not None else "—"
+            lines.append(f"├ {p.name}: {'✅' if s.healthy else '❌'} {latency} / 錯誤 {s.error_rate:.0%} / {s.total} 次")
+        st = self.stats
+        lines.append(f"└ 對沖 {st['hedged']}（勝 {st['hedge_wins']}）/ 切換 {st['failovers']}")
+        return "\n".join(lines)
@@ -0,0 +1,269 @@
+"""
+延遲指標與追蹤
+- HDR 風格直方圖：對數 + 線性子桶（相對誤差約 3%），固定記憶體，任意百分位
+- 依 (指標, 標籤) 記錄延遲與錯誤數，另有純計數器（如快取命中）；Prometheus 文字格式匯出
+- 追蹤：contextvars 記錄單一命令內每段呼叫（span），顯示耗時拆解
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from aiohttp import web
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))          # 另開 /metrics 埠，不對外公開（0 = 不開）
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "5000"))     # 超過此耗時的命令記錄追蹤到 log（0 = 不記）
+HISTOGRAM_BITS = 5
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    """微秒整數值；< 2^bits 精確，其上每個 2 的冪次切成 2^(bits-1) 個線性子桶"""
+
+    def __init__(self, bits: int = HISTOGRAM_BITS):
+        self.bits = bits
+        self.half = 1 << (bits - 1)
+        self.counts = {}
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < (1 << self.bits):
+            return value
+        shift = value.bit_length() - self.bits
+        return (1 << self.bits) + (shift - 1) * self.half + ((value >> shift) - self.half)
+
+    def _value(self, index: int) -> int:
+        """桶的中點"""
+        if index < (1 << self.bits):
+            return index
+        shift, offset = divmod(index - (1 << self.bits), self.half)
+        shift += 1
+        low = (self.half + offset) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, micros: int):
+        micros = max(0, int(micros))
+        index = self._index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += micros
+        self.max = max(self.max, micros)
+
+    def percentile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.errors = {}       # (name, labels) -> int
+        self.counters = {}     # (name, labels) -> int，不含延遲的事件數
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, seconds: float, error: bool = False, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.record(seconds * 1_000_000)
+        if error:
+            self.errors[key] = self.errors.get(key, 0) + 1
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(labels.get("call") or labels.get("method") or labels.get("command") or name,
+                      seconds, error)
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, error, **labels)
+
+    def render(self) -> str:
+        """Prometheus 文字格式（summary 型別）"""
+        lines = []
+        names = sorted({name for name, _ in self.histograms})
+        for name in names:
+            metric = f"flowai_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+                base = ",".join(f'{k}="{v}"' for k, v in labels)
+                for q in QUANTILES:
+                    label = f'{base},quantile="{q}"' if base else f'quantile="{q}"'
+                    lines.append(f"{metric}{{{label}}} {h.percentile(q) / 1e6:.6f}")
+                lines.append(f"{metric}_sum{{{base}}} {h.sum / 1e6:.6f}")
+                lines.append(f"{metric}_count{{{base}}} {h.count}")
+            errors = f"flowai_{name}_errors_total"
+            lines.append(f"# TYPE {errors} counter")
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n == name:
+                    base = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{errors}{{{base}}} {self.errors.get((n, labels), 0)}")
+        for name in sorted({name for name, _ in self.counters}):
+            metric = f"flowai_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (n, labels), count in sorted(self.counters.items()):
+                if n == name:
+                    base = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{metric}{{{base}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def table(self, name: str = None) -> str:
+        """給 /metrics 的文字表：p50 / p99 / max / 次數 / 錯誤"""
+        lines = []
+        for (n, labels), h in sorted(self.histograms.items(), key=lambda item: -item[1].percentile(0.99)):
+            if name and n != name:
+                continue
+            label = "/".join(str(v) for _, v in labels) or n
+            lines.append(
+                f"{n}:{label} p50 {h.percentile(0.5) / 1000:.0f}ms p99 {h.percentile(0.99) / 1000:.0f}ms "
+                f"max {h.max / 1000:.0f}ms n={h.count} err={self.errors.get((n, labels), 0)}"
+            )
+        for (n, labels), count in sorted(self.counters.items()):
+            if not name or n == name:
+                lines.append(f"{n}:{'/'.join(str(v) for _, v in labels) or n} n={count}")
+        return "\n".join(lines) or "無資料"
+
+
+def _failed(result) -> bool:
+    """Bybit 格式錯誤或「❌」開頭的 AI 回應都算錯誤"""
+    if isinstance(result, dict):
+        return result.get("retCode", 0) != 0
+    if isinstance(result, str):
+        return result.startswith("❌")
+    return result is None
+
+
+def timed(call: str, name: str = "upstream"):
+    """async 函數裝飾器：記錄延遲、錯誤與追蹤 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                metrics.observe(name, time.perf_counter() - started, True, call=call)
+                raise
+            metrics.observe(name, time.perf_counter() - started, _failed(result), call=call)
+            return result
+        return wrapper
+    return decorator
+
+
+# ─── 追蹤 ───────────────────────────────────────────────
+
+class Trace:
+    def __init__(self, command: str):
+        self.command = command
+        self.started = time.perf_counter()
+        self.spans = []     # (開始偏移秒, 名稱, 耗時秒, 是否錯誤)
+        self.duration = None
+
+    def add(self, name: str, seconds: float, error: bool = False):
+        end = time.perf_counter() - self.started
+        self.spans.append((max(0.0, end - seconds), name, seconds, error))
+
+    def render(self) -> str:
+        total = self.duration if self.duration is not None else time.perf_counter() - self.started
+        lines = [f"🔍 /{self.command} 共 {total * 1000:.0f}ms"]
+        for start, name, seconds, error in sorted(self.spans):
+            lines.append(f"{'❌' if error else '├'} +{start * 1000:>5.0f}ms {name} {seconds * 1000:.0f}ms")
+        return "\n".join(lines)
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def instrument(command: str, handler, trace_chats: set = None):
+    """包裝命令處理函數：記錄延遲 / 錯誤，並為這次命令建立追蹤"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        trace = Trace(command)
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        error = False
+        try:
+            return await handler(update, context)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            error = True
+            raise
+        finally:
+            current_trace.reset(token)
+            trace.duration = time.perf_counter() - started
+            metrics.observe("handler", trace.duration, error, command=command)
+            if TRACE_SLOW_MS and trace.duration * 1000 >= TRACE_SLOW_MS:
+                logger.warning(trace.render())
+            chat = update.effective_chat
+            if trace_chats and chat and chat.id in trace_chats:
+                try:
+                    await context.bot.send_message(chat.id, trace.render())
+                except Exception:
+                    pass
+    return wrapper
+
+
+class TelegramRequest(HTTPXRequest):
+    """計時每個 Bot API 呼叫（sendMessage / editMessageText …）"""
+
+    def __init__(self, connection_pool_size: int = 256, **kwargs):
+        # 與 ApplicationBuilder 預設的連線池大小相同
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        with metrics.timer("telegram", method=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, request_data=request_data, **kwargs)
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def start_metrics_server(port: int = METRICS_PORT):
+    """只提供 GET /metrics；webhook 模式也不掛在公開的 webhook 埠上"""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    logger.info(f"✅ Prometheus 指標: :{port}/metrics")
+    return runner
+
+
+metrics = Metrics()
@@ -0,0 +1,206 @@
+"""
+盤口聚合引擎
+- 每個幣種一本 L2 訂單簿：排序價格陣列（bisect）+ 價格 → 數量表
+- 快照 / 增量更新時同步維護買賣總量，失衡度 O(1)
+- 成交流累計 Delta（CVD）與滾動窗口 Delta
+- 大單牆偵測、依持倉量與槓桿分層估算清算帶
+"""
+
+import os
+import time
+import bisect
+import logging
+from collections import deque
+
+from price_feed import WS_STALE_AFTER
+
+logger = logging.getLogger(__name__)
+
+ORDERBOOK_DEPTH = int(os.getenv("ORDERBOOK_DEPTH", "50"))
+WALL_MULTIPLIER = float(os.getenv("WALL_MULTIPLIER", "4"))
+CVD_WINDOW = float(os.getenv("CVD_WINDOW", "300"))  # 秒
+
+# (槓桿, 持倉量佔比)：估算清算帶用的槓桿分布假設
+LEVERAGE_TIERS = [(100, 0.10), (50, 0.20), (25, 0.30), (10, 0.40)]
+MAINTENANCE_MARGIN = 0.005
+
+
+class BookSide:
+    def __init__(self, descending: bool):
+        self.descending = descending
+        self.prices = []     # 遞增排序
+        self.qty = {}
+        self.total = 0.0
+
+    def set(self, price: float, qty: float):
+        old = self.qty.get(price)
+        if qty <= 0:
+            if old is not None:
+                del self.qty[price]
+                del self.prices[bisect.bisect_left(self.prices, price)]
+                self.total -= old
+            return
+        if old is None:
+            bisect.insort(self.prices, price)
+            old = 0.0
+        self.qty[price] = qty
+        self.total += qty - old
+
+    def clear(self):
+        self.prices.clear()
+        self.qty.clear()
+        self.total = 0.0
+
+    def best(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.descending else self.prices[0]
+
+    def levels(self, n: int = None):
+        """由最優價往外的 (price, qty)"""
+        prices = self.prices[::-1] if self.descending else self.prices
+        if n:
+            prices = prices[:n]
+        return [(p, self.qty[p]) for p in prices]
+
+
+class OrderBook:
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.update_id = None
+        self.updated_at = None
+
+    def apply(self, data: dict, snapshot: bool):
+        if snapshot:
+            self.bids.clear()
+            self.asks.clear()
+        for price, qty in data.get("b", []):
+            self.bids.set(float(price), float(qty))
+        for price, qty in data.get("a", []):
+            self.asks.set(float(price), float(qty))
+        self.update_id = data.get("u")
+        self.updated_at = time.monotonic()
+
+    @property
+    def mid(self):
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    @property
+    def imbalance(self):
+        total = self.bids.total + self.asks.total
+        return (self.bids.total - self.asks.total) / total if total else 0.0
+
+    def walls(self, multiplier: float = WALL_MULTIPLIER, limit: int = 3) -> dict:
+        """數量超過該側平均 multiplier 倍的價位（依數量排序）"""
+        result = {}
+        for name, side in (("bids", self.bids), ("asks", self.asks)):
+            if not side.qty:
+                result[name] = []
+                continue
+            threshold = side.total / len(side.qty) * multiplier
+            walls = [(p, q) for p, q in side.levels() if q >= threshold]
+            result[name] = sorted(walls, key=lambda w: -w[1])[:limit]
+        return result
+
+
+class TradeFlow:
+    """成交流 Delta：主動買 +、主動賣 −"""
+
+    def __init__(self, window: float = CVD_WINDOW):
+        self.window = window
+        self.cvd = 0.0
+        self.window_delta = 0.0
+        self.buy_volume = 0.0
+        self.sell_volume = 0.0
+        self._recent = deque()   # (ts_sec, signed_qty)
+
+    def add(self, ts: float, side: str, qty: float):
+        signed = qty if side == "Buy" else -qty
+        self.cvd += signed
+        if signed > 0:
+            self.buy_volume += qty
+        else:
+            self.sell_volume += qty
+        self._recent.append((ts, signed))
+        self.window_delta += signed
+        self._expire(ts)
+
+    def _expire(self, now: float):
+        while self._recent and self._recent[0][0] < now - self.window:
+            self.window_delta -= self._recent.popleft()[1]
+
+
+def liquidation_bands(price: float, open_interest: float, tiers=LEVERAGE_TIERS,
+                      mmr: float = MAINTENANCE_MARGIN) -> list:
+    """依槓桿分層估算多/空清算價位與名目量（假設多空各半）"""
+    bands = []
+    for leverage, share in tiers:
+        notional = open_interest * share / 2
+        bands.append({
+            "leverage": leverage,
+            "long_price": price * (1 - 1 / leverage + mmr),
+            "short_price": price * (1 + 1 / leverage - mmr),
+            "notional": notional,
+        })
+    return bands
+
+
+class OrderFlowEngine:
+    """處理 orderbook.* 與 publicTrade.* 推送"""
+
+    def __init__(self, symbols: list, depth: int = ORDERBOOK_DEPTH, stale_after: float = WS_STALE_AFTER):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.depth = depth
+        self.stale_after = stale_after
+        self.books = {s: OrderBook(s) for s in self.symbols}
+        self.flows = {s: TradeFlow() for s in self.symbols}
+
+    @property
+    def topics(self) -> dict:
+        return {
+            "orderbook.": [f"orderbook.{self.depth}.{s}" for s in self.symbols],
+            "publicTrade.": [f"publicTrade.{s}" for s in self.symbols],
+        }
+
+    def attach(self, feed):
+        self.stale_after = feed.stale_after
+        for prefix, topics in self.topics.items():
+            feed.subscribe(topics, prefix, self.handle)
+
+    def handle(self, message: dict):
+        topic = message.get("topic", "")
+        symbol = topic.rsplit(".", 1)[-1]
+        if topic.startswith("orderbook.") and symbol in self.books:
+            self.books[symbol].apply(message.get("data", {}), message.get("type") == "snapshot")
+        elif topic.startswith("publicTrade.") and symbol in self.flows:
+            flow = self.flows[symbol]
+            for trade in message.get("data", []):
+                flow.add(int(trade["T"]) / 1000, trade["S"], float(trade["v"]))
+
+    def ready(self, symbol: str) -> bool:
+        """有盤口且未過期（斷線後不把凍結的盤口當即時資料）"""
+        book = self.books.get(symbol)
+        return bool(book and book.mid is not None and book.updated_at is not None
+                    and time.monotonic() - book.updated_at <= self.stale_after)
+
+    def snapshot(self, symbol: str) -> dict:
+        book = self.books[symbol]
+        flow = self.flows[symbol]
+        flow._expire(time.time())
+        return {
+            "mid": book.mid,
+            "spread": book.asks.best() - book.bids.best(),
+            "bid_total": book.bids.total,
+            "ask_total": book.asks.total,
+            "imbalance": book.imbalance,
+            "walls": book.walls(),
+            "cvd": flow.cvd,
+            "window_delta": flow.window_delta,
+            "buy_volume": flow.buy_volume,
+            "sell_volume": flow.sell_volume,
+        }
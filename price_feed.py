@@ -0,0 +1,171 @@
+"""
+即時行情推送
+- 常駐 WebSocket 訂閱 Bybit 公開 tickers（BYBIT_WS_URL 可指向本地測試伺服器）
+- 記憶體內最新行情表，get_ticker 優先讀取（無網路 I/O）
+- 斷線指數退避重連、心跳偵測、資料過期標記
+- watch() 執行中追加幣種（例如新開持倉需要標記價格）
+"""
+
+import os
+import time
+import json
+import asyncio
+import logging
+import aiohttp
+
+from http_client import http
+
+logger = logging.getLogger(__name__)
+
+BYBIT_WS_URL = os.getenv("BYBIT_WS_URL", "wss://stream.bybit.com/v5/public/linear")
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "45"))
+WS_STALE_AFTER = float(os.getenv("WS_STALE_AFTER", "30"))
+WS_BACKOFF_MAX = float(os.getenv("WS_BACKOFF_MAX", "60"))
+
+
+class PriceFeed:
+    """Bybit 公開 tickers 訂閱 + 最新行情表"""
+
+    def __init__(self, symbols: list, url: str = BYBIT_WS_URL, stale_after: float = WS_STALE_AFTER):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.extra_topics = []  # 例如 orderbook.50.BTCUSDT、publicTrade.BTCUSDT
+        self.url = url
+        self.stale_after = stale_after
+        self.ticks = {}        # symbol -> {"data": dict, "ts": monotonic}
+        self.connected = False
+        self.reconnects = 0
+        self.listeners = []    # callback(symbol, data)，每筆行情更新時呼叫
+        self.handlers = {}     # topic 前綴 -> callback(message)，處理 tickers 以外的訂閱
+        self._task = None
+        self._ws = None
+
+    # ─── 查詢 ───────────────────────────────────────────────
+
+    def is_stale(self, symbol: str) -> bool:
+        tick = self.ticks.get(symbol)
+        return tick is None or time.monotonic() - tick["ts"] > self.stale_after
+
+    def get(self, symbol: str):
+        """回傳 Bybit 格式 ticker；無資料或已過期回傳 None"""
+        if self.is_stale(symbol):
+            return None
+        return {"retCode": 0, "result": {"list": [dict(self.ticks[symbol]["data"])]}}
+
+    def summary(self) -> str:
+        if not self._task:
+            return "未啟用"
+        fresh = sum(1 for s in self.symbols if not self.is_stale(s))
+        state = "✅" if self.connected else "❌"
+        return f"{state} {fresh}/{len(self.symbols)} 即時 (重連 {self.reconnects})"
+
+    # ─── 生命週期 ───────────────────────────────────────────
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"✅ 行情推送啟動: {self.url} ({len(self.symbols)} 幣種)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                async with http.session.ws_connect(self.url, heartbeat=None) as ws:
+                    await self._subscribe(ws)
+                    self._ws = ws
+                    self.connected = True
+                    backoff = 1.0
+                    await self._consume(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"行情推送斷線: {e}")
+            self._ws = None
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_BACKOFF_MAX)
+
+    async def _subscribe(self, ws, topics: list = None):
+        # Bybit 單次訂閱最多 10 個 topic
+        if topics is None:
+            topics = [f"tickers.{s}" for s in self.symbols] + self.extra_topics
+        for i in range(0, len(topics), 10):
+            await ws.send_json({"op": "subscribe", "args": topics[i:i + 10]})
+
+    async def _subscribe_live(self, ws, topics: list):
+        try:
+            await self._subscribe(ws, topics)
+        except Exception as e:
+            # 失敗也無妨：重連時會以完整清單重新訂閱
+            logger.warning(f"追加訂閱失敗: {e}")
+
+    async def _consume(self, ws):
+        pinger = asyncio.ensure_future(self._ping(ws))
+        try:
+            while True:
+                # 超過心跳逾時沒收到任何訊息視為斷線
+                msg = await ws.receive(timeout=WS_HEARTBEAT_TIMEOUT)
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self._handle(json.loads(msg.data))
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                    return
+        finally:
+            pinger.cancel()
+
+    async def _ping(self, ws):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            await ws.send_json({"op": "ping"})
+
+    def watch(self, symbols):
+        """追加 tickers 幣種；已連線時立即訂閱，否則於下次連線時一併訂閱"""
+        added = [s for s in dict.fromkeys(symbols) if s not in self.symbols]
+        if not added:
+            return
+        self.symbols.extend(added)
+        if self._ws is not None and not self._ws.closed:
+            asyncio.ensure_future(self._subscribe_live(self._ws, [f"tickers.{s}" for s in added]))
+
+    def subscribe(self, topics: list, prefix: str, handler):
+        """追加訂閱並註冊處理器（需在 start 前呼叫）"""
+        self.extra_topics.extend(t for t in topics if t not in self.extra_topics)
+        self.handlers[prefix] = handler
+
+    def _handle(self, message: dict):
+        topic = message.get("topic", "")
+        if not topic.startswith("tickers."):
+            for prefix, handler in self.handlers.items():
+                if topic.startswith(prefix):
+                    try:
+                        handler(message)
+                    except Exception as e:
+                        logger.error(f"訂閱處理錯誤 {topic}: {e}")
+            return
+        symbol = topic.split(".", 1)[1]
+        data = message.get("data", {})
+        tick = self.ticks.get(symbol)
+        if message.get("type") == "snapshot" or tick is None:
+            merged = dict(data)
+        else:
+            # delta 只帶有變動的欄位
+            merged = {**tick["data"], **data}
+        if "lastPrice" not in merged:
+            return
+        merged["symbol"] = symbol
+        self.ticks[symbol] = {"data": merged, "ts": time.monotonic()}
+        for listener in self.listeners:
+            try:
+                listener(symbol, merged)
+            except Exception as e:
+                logger.error(f"行情監聽錯誤: {e}")
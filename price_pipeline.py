@@ -0,0 +1,140 @@
+"""
+幣種分析管線（/price <SYMBOL>）
+- fetch → enrich → prompt → analyze → render 五個階段，任何已註冊幣種共用
+- 提示詞與輸出模板在載入時預先編譯（string.Template）
+- 階段結果依幣種快取：市場情緒、整理後的行情、AI 回應（價格分桶）
+- 所有請求共用一個併發額度
+"""
+
+import os
+import asyncio
+import logging
+from string import Template
+from datetime import datetime
+
+from market_cache import TTLCache
+from llm_cache import price_bucket
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", "16"))
+PIPELINE_CONTEXT_TTL = float(os.getenv("PIPELINE_CONTEXT_TTL", "10"))
+PIPELINE_SENTIMENT_TTL = float(os.getenv("PIPELINE_SENTIMENT_TTL", "300"))
+
+PROMPTS = {
+    "full": Template("""$base 即時數據：
+價格：$price_text
+24h 漲跌：$change_text
+恐懼貪婪指數：$fng_value ($fng_text)
+$levels
+
+用繁體中文分析（100字內）：
+1. 市場情緒解讀
+2. 短線方向判斷
+3. 關鍵支撐/阻力價位"""),
+    "brief": Template("$base 價格 $price_text，24h $change_text。$levels_inline用繁體中文簡短分析市場情緒和短線方向（50字內）"),
+}
+
+RENDER = Template("""$emoji *$base/USDT*
+━━━━━━━━━━━━━━━━
+💰 價格：$price_text
+📊 24h：$change_text
+${sentiment_line}⏰ $time
+
+📝 *AI 分析：*
+$analysis""")
+
+
+def format_price(price: float) -> str:
+    return f"${price:,.2f}" if price >= 1 else f"${price:.6g}"
+
+
+class PricePipeline:
+    def __init__(self, trader, analyze, sentiment, levels=None, registry=None,
+                 concurrency: int = PIPELINE_CONCURRENCY, ai_ttl: float = 60):
+        """analyze: call_grok 相容的 coroutine function；sentiment: 恐懼貪婪指數 coroutine function"""
+        self.trader = trader
+        self.analyze = analyze
+        self.sentiment = sentiment
+        self.levels = levels
+        self.registry = registry
+        self.ai_ttl = ai_ttl
+        self.budget = asyncio.Semaphore(concurrency)
+        self.sentiment_cache = TTLCache(ttl=PIPELINE_SENTIMENT_TTL, stale_ttl=PIPELINE_SENTIMENT_TTL)
+        self.context_cache = TTLCache(ttl=PIPELINE_CONTEXT_TTL, stale_ttl=0)
+
+    # ─── 階段 ───────────────────────────────────────────────
+
+    async def _fetch_sentiment(self) -> dict:
+        fng = await self.sentiment()
+        if not fng:
+            return {"retCode": -1, "retMsg": "恐懼貪婪指數無資料"}
+        return {"retCode": 0, "result": fng}
+
+    async def fetch(self, info) -> tuple:
+        """行情 + 市場情緒（情緒全幣種共用一份快取）"""
+        ticker, fng = await asyncio.gather(
+            self.trader.get_ticker(symbol=info.symbol),
+            self.sentiment_cache.get("fng", self._fetch_sentiment),
+        )
+        return ticker, fng.get("result") if fng.get("retCode") == 0 else None
+
+    async def _enrich(self, info) -> dict:
+        ticker, fng = await self.fetch(info)
+        if ticker.get("retCode") != 0:
+            return ticker
+        data = ticker["result"]["list"][0]
+        price = float(data["lastPrice"])
+        change = float(data["price24hPcnt"]) * 100
+        levels = self.levels(info.symbol) if self.levels else ""
+        return {"retCode": 0, "result": {
+            "symbol": info.symbol,
+            "base": info.base,
+            "emoji": info.emoji,
+            "profile": info.profile,
+            "price": price,
+            "change": change,
+            "price_text": format_price(price),
+            "change_text": f"{change:+.2f}%",
+            "fng_value": fng.get("value", "N/A") if fng else "N/A",
+            "fng_text": fng.get("value_classification", "") if fng else "",
+            "levels": levels,
+            "levels_inline": levels.replace("\n", "，") + "。" if levels else "",
+        }}
+
+    async def enrich(self, info) -> dict:
+        """整理後的行情（依幣種快取，同時請求合併）"""
+        return await self.context_cache.get(info.symbol, lambda: self._enrich(info))
+
+    @staticmethod
+    def prompt(ctx: dict) -> str:
+        return PROMPTS.get(ctx["profile"], PROMPTS["brief"]).substitute(ctx)
+
+    @staticmethod
+    def cache_key(ctx: dict) -> str:
+        key = f"price:{ctx['symbol']}:{price_bucket(ctx['price'])}:{ctx['change']:.0f}"
+        return f"{key}:{ctx['fng_value']}" if ctx["profile"] == "full" else key
+
+    @staticmethod
+    def render(ctx: dict, analysis: str) -> str:
+        sentiment = f"😱 恐懼貪婪：{ctx['fng_value']} ({ctx['fng_text']})\n" if ctx["profile"] == "full" else ""
+        return RENDER.substitute(ctx, sentiment_line=sentiment, analysis=analysis,
+                                 time=datetime.now().strftime('%H:%M:%S'))
+
+    # ─── 執行 ───────────────────────────────────────────────
+
+    async def run(self, info, chat_id=None, priority: int = None) -> str:
+        async with self.budget:
+            enriched = await self.enrich(info)
+            if enriched.get("retCode") != 0:
+                return f"❌ 錯誤: {enriched.get('retMsg', '未知')}"
+            ctx = enriched["result"]
+            kwargs = {"chat_id": chat_id}
+            if priority is not None:
+                kwargs["priority"] = priority
+            analysis = await self.analyze(self.prompt(ctx), self.ai_ttl, self.cache_key(ctx), **kwargs)
+            return self.render(ctx, analysis)
+
+    def summary(self) -> str:
+        c = self.context_cache.stats
+        return f"{len(self.registry) if self.registry is not None else '-'} 個幣種 / 行情階段 命中 {c['hits']} 未命中 {c['misses']} 合併 {c['coalesced']}"
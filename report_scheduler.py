@@ -0,0 +1,69 @@
+"""
+熱門報告預先計算
+- 在 Application.job_queue 上定時產生報告並保存渲染後文字
+- 命令直接回傳預算結果，缺少或過期時才即時生成
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReportScheduler:
+    def __init__(self):
+        self._jobs = {}      # name -> {"builder", "interval", "max_age"}
+        self._reports = {}   # name -> {"text", "at", "duration"}
+        self._last_error = {}
+
+    def register(self, name: str, builder, interval: float, max_age: float = None):
+        """builder: 無參數 coroutine function，回傳報告文字（None 表示失敗不保存）"""
+        self._jobs[name] = {
+            "builder": builder,
+            "interval": interval,
+            "max_age": max_age or interval * 2,
+        }
+
+    def schedule(self, job_queue):
+        for name, job in self._jobs.items():
+            job_queue.run_repeating(self._run_job, interval=job["interval"], first=0, name=f"report:{name}", data=name)
+        logger.info(f"✅ 報告預算排程: {', '.join(self._jobs)}")
+
+    async def _run_job(self, context):
+        await self.refresh(context.job.data)
+
+    async def refresh(self, name: str):
+        started = time.monotonic()
+        try:
+            text = await self._jobs[name]["builder"]()
+        except Exception as e:
+            logger.error(f"報告預算失敗 {name}: {e}")
+            self._last_error[name] = str(e)
+            return None
+        duration = time.monotonic() - started
+        if text:
+            self._reports[name] = {"text": text, "at": time.monotonic(), "duration": duration}
+            self._last_error.pop(name, None)
+        return text
+
+    def get(self, name: str):
+        """回傳未過期的預算報告，否則 None"""
+        report = self._reports.get(name)
+        if report is None or name not in self._jobs:
+            return None
+        if time.monotonic() - report["at"] > self._jobs[name]["max_age"]:
+            return None
+        return report["text"]
+
+    def summary(self) -> str:
+        lines = []
+        now = time.monotonic()
+        for name in self._jobs:
+            report = self._reports.get(name)
+            if report:
+                lines.append(f"├ {name}: 耗時 {report['duration']:.1f}s / {now - report['at']:.0f}s 前")
+            elif name in self._last_error:
+                lines.append(f"├ {name}: ❌ 失敗")
+            else:
+                lines.append(f"├ {name}: 等待中")
+        return "\n".join(lines) if lines else "未啟用"
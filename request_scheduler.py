@@ -0,0 +1,131 @@
+"""
+外呼請求排程
+- 全域併發上限 + Token Bucket 限速
+- 優先級（管理員交易 > 公開分析）
+- 同優先級內按 chat 公平輪流（排隊較少的 chat 先出列）
+- 佇列深度與等待時間指標
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_ADMIN = 0
+PRIORITY_PUBLIC = 1
+PRIORITY_BACKGROUND = 2
+
+GROK_MAX_CONCURRENCY = int(os.getenv("GROK_MAX_CONCURRENCY", "4"))
+GROK_RATE_PER_SEC = float(os.getenv("GROK_RATE_PER_SEC", "2"))
+GROK_RATE_BURST = float(os.getenv("GROK_RATE_BURST", "4"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 0.0
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrency: int = GROK_MAX_CONCURRENCY,
+                 rate: float = GROK_RATE_PER_SEC, burst: float = GROK_RATE_BURST):
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.active = 0
+        self._queue = []         # (priority, chat_queued, seq, chat_id, future, enqueued_at)
+        self._seq = 0
+        self._queued = {}        # chat_id -> 排隊中的請求數（公平性）
+        self._timer = None
+        self.stats = {"completed": 0, "wait_total": 0.0, "wait_max": 0.0, "depth_max": 0}
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @asynccontextmanager
+    async def slot(self, chat_id=None, priority: int = PRIORITY_PUBLIC):
+        """async with scheduler.slot(chat_id, priority): ... 取得一個外呼名額"""
+        await self.acquire(chat_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, chat_id=None, priority: int = PRIORITY_PUBLIC):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._seq += 1
+        queued = self._queued.get(chat_id, 0)
+        heapq.heappush(self._queue, (priority, queued, self._seq, chat_id, future, time.monotonic()))
+        self._queued[chat_id] = queued + 1
+        self.stats["depth_max"] = max(self.stats["depth_max"], len(self._queue))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已取得名額但呼叫端被取消，歸還名額
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.stats["completed"] += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._queue and self.active < self.max_concurrency:
+            if self.bucket and not self.bucket.try_take():
+                self._schedule_retry(self.bucket.wait_time())
+                return
+            _, _, _, chat_id, future, enqueued_at = heapq.heappop(self._queue)
+            self._queued[chat_id] = max(0, self._queued.get(chat_id, 1) - 1)
+            if not self._queued[chat_id]:
+                del self._queued[chat_id]
+            if future.cancelled():
+                if self.bucket:
+                    self.bucket.tokens = min(self.bucket.burst, self.bucket.tokens + 1)
+                continue
+            waited = time.monotonic() - enqueued_at
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            self.active += 1
+            future.set_result(None)
+
+    def _schedule_retry(self, delay: float):
+        if self._timer is None or self._timer.cancelled():
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def summary(self) -> str:
+        s = self.stats
+        started = s["completed"] + self.active
+        avg = s["wait_total"] / started if started else 0
+        return (f"執行 {self.active}/{self.max_concurrency} / 排隊 {self.depth} (峰值 {s['depth_max']}) / "
+                f"等待 平均 {avg:.1f}s 最長 {s['wait_max']:.1f}s")
@@ -0,0 +1,313 @@
+"""
+交易信號紀錄與回測評估
+- 由 AI 回應擷取方向 / 進場 / 止損 / TP1 / TP2 / 信心（優先讀 SIGNAL JSON 行，否則逐欄比對文字）
+- SQLite 持久化，同一回應（快取命中）只記一次
+- NumPy 向量化重播：以本地 K 線判斷先觸及止損或 TP1，計算命中率、R 倍數、依信心分組的校準
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+SIGNAL_DB = os.getenv("SIGNAL_DB", os.path.join(DATA_DIR, "signals.db"))
+SIGNAL_HORIZON = int(os.getenv("SIGNAL_HORIZON", "72"))   # 評估視窗（K 線根數）
+PROMPT_VERSION = os.getenv("SIGNAL_PROMPT_VERSION", "v1")
+
+# 信心分組（含上界）
+CONFIDENCE_BUCKETS = [(1, 3), (4, 6), (7, 8), (9, 10)]
+
+# 附在提示詞最後，要求模型多輸出一行機器可讀結果
+SIGNAL_FORMAT = (
+    '最後另起一行輸出：SIGNAL {"direction": "long|short|wait", "entry": 數字, "stop": 數字, '
+    '"tp1": 數字, "tp2": 數字, "confidence": 1-10}'
+)
+
+_SIGNAL_LINE = re.compile(r"^\s*`*SIGNAL\s*(\{.*?\})`*\s*$", re.M)
+_NUMBER = r"\$?\s*([0-9][0-9,]*(?:\.[0-9]+)?)"
+_FIELDS = {
+    "entry": re.compile(r"進場[^0-9$\n]*" + _NUMBER),
+    "stop": re.compile(r"止損[^0-9$\n]*" + _NUMBER),
+    "tp1": re.compile(r"TP\s*1[^0-9$\n]*" + _NUMBER, re.I),
+    "tp2": re.compile(r"TP\s*2[^0-9$\n]*" + _NUMBER, re.I),
+    "confidence": re.compile(r"信心[^0-9\n]*([0-9]+(?:\.[0-9]+)?)"),
+}
+DIRECTIONS = {"long": 1, "short": -1, "wait": 0}
+
+
+def strip_signal_line(text: str) -> str:
+    """顯示給使用者時移除 SIGNAL 行"""
+    return _SIGNAL_LINE.sub("", text).rstrip()
+
+
+def _direction_from_text(text: str) -> int:
+    """取第一個出現的方向關鍵字"""
+    found = [(text.find(word), d) for word, d in (("做多", 1), ("🟢", 1), ("做空", -1), ("🔴", -1), ("觀望", 0), ("🟡", 0))]
+    found = [(i, d) for i, d in found if i >= 0]
+    return min(found)[1] if found else 0
+
+
+def extract_signal(text: str):
+    """AI 回應 → dict(direction, entry, stop, tp1, tp2, confidence)；擷取不到必要欄位回傳 None"""
+    if not text or text.startswith("❌"):
+        return None
+    signal = None
+    match = _SIGNAL_LINE.search(text)
+    if match:
+        try:
+            data = json.loads(match.group(1))
+            signal = {
+                "direction": DIRECTIONS.get(str(data.get("direction", "")).lower(), 0),
+                **{k: float(data[k]) for k in ("entry", "stop", "tp1", "tp2", "confidence") if data.get(k) is not None},
+            }
+        except (ValueError, TypeError):
+            signal = None
+    if signal is None:
+        signal = {"direction": _direction_from_text(text)}
+        for name, pattern in _FIELDS.items():
+            found = pattern.search(text)
+            if found:
+                signal[name] = float(found.group(1).replace(",", ""))
+    if signal["direction"] == 0:
+        return {"direction": 0, "confidence": signal.get("confidence")}
+    if not all(k in signal for k in ("entry", "stop", "tp1")):
+        return None
+    # 止損需在進場價的反方向，TP1 在同方向
+    d = signal["direction"]
+    if (signal["entry"] - signal["stop"]) * d <= 0 or (signal["tp1"] - signal["entry"]) * d <= 0:
+        return None
+    return signal
+
+
+class SignalLog:
+    def __init__(self, path: str = SIGNAL_DB):
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """第一次使用時才開檔（import 不做 I/O）"""
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS signals ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, symbol TEXT NOT NULL,"
+                " model TEXT, prompt_version TEXT, direction INTEGER NOT NULL,"
+                " entry REAL, stop REAL, tp1 REAL, tp2 REAL, confidence REAL,"
+                " reply_hash TEXT UNIQUE)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS signals_ts ON signals (ts)")
+        return self._db
+
+    def record(self, symbol: str, reply: str, model: str = None,
+               prompt_version: str = PROMPT_VERSION, ts: float = None):
+        """擷取並寫入；回傳 signal dict（無法擷取回傳 None）"""
+        signal = extract_signal(reply)
+        if signal is None:
+            return None
+        digest = hashlib.sha1(f"{symbol}\x00{reply}".encode("utf-8")).hexdigest()
+        with self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO signals (ts, symbol, model, prompt_version, direction,"
+                " entry, stop, tp1, tp2, confidence, reply_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (ts or time.time(), symbol, model, prompt_version, signal["direction"], signal.get("entry"),
+                 signal.get("stop"), signal.get("tp1"), signal.get("tp2"), signal.get("confidence"), digest),
+            )
+        return signal
+
+    def load(self, since: float = 0, symbol: str = None) -> list:
+        """可評估的信號（有方向）：(ts, symbol, model, prompt_version, direction, entry, stop, tp1, confidence)"""
+        sql = ("SELECT ts, symbol, model, prompt_version, direction, entry, stop, tp1, confidence"
+               " FROM signals WHERE direction != 0 AND ts >= ?")
+        params = [since]
+        if symbol:
+            sql += " AND symbol = ?"
+            params.append(symbol)
+        return self.db.execute(sql + " ORDER BY ts", params).fetchall()
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM signals").fetchone()[0]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def evaluate(signals: dict, bars: dict, interval: int, horizon: int = SIGNAL_HORIZON) -> dict:
+    """向量化重播
+
+    signals: {"ts", "symbol", "direction", "entry", "stop", "tp1", "confidence"} 等長陣列
+    bars: {symbol: (ts, high, low, close) 陣列，ts 遞增}
+    進場價須在視窗內被觸及才算成交；同一根同時觸及止損與 TP1 視為止損（保守）
+    回傳每筆的 outcome（1 命中 TP1 / -1 止損 / 0 到期 / nan 未結算）、R 倍數與視窗內未成交標記
+    """
+    if not HAS_NUMPY:
+        raise ImportError("numpy not installed")
+
+    n = len(signals["ts"])
+    symbols = sorted(bars)
+    # 所有幣種的 K 線串接成一條，另記每個幣種的區段
+    offsets, ends, parts = {}, {}, []
+    cursor = 0
+    for symbol in symbols:
+        ts, high, low, close = (np.asarray(a, dtype=float) for a in bars[symbol])
+        offsets[symbol], ends[symbol] = cursor, cursor + len(ts)
+        parts.append((ts, high, low, close))
+        cursor += len(ts)
+    outcome = np.full(n, np.nan)
+    r_multiple = np.full(n, np.nan)
+    if not parts or n == 0:
+        return {"outcome": outcome, "r": r_multiple, "unfilled": np.zeros(n, dtype=bool)}
+    all_ts, high, low, close = (np.concatenate([p[i] for p in parts]) for i in range(4))
+
+    sym = np.asarray(signals["symbol"])
+    known = np.isin(sym, symbols)
+    start = np.zeros(n, dtype=np.int64)
+    end = np.zeros(n, dtype=np.int64)
+    for symbol in symbols:
+        mask = sym == symbol
+        if mask.any():
+            o, e = offsets[symbol], ends[symbol]
+            # 從信號之後第一根完整 K 線開始
+            start[mask] = o + np.searchsorted(all_ts[o:e], np.asarray(signals["ts"], dtype=float)[mask], side="left")
+            end[mask] = e
+
+    steps = np.arange(horizon)
+    index = start[:, None] + steps[None, :]
+    valid = known[:, None] & (index < end[:, None])
+    index = np.minimum(index, len(all_ts) - 1)
+    h, l, c = high[index], low[index], close[index]
+
+    d = np.asarray(signals["direction"], dtype=float)[:, None]
+    entry = np.asarray(signals["entry"], dtype=float)[:, None]
+    stop = np.asarray(signals["stop"], dtype=float)[:, None]
+    tp1 = np.asarray(signals["tp1"], dtype=float)[:, None]
+
+    filled = valid & (l <= entry) & (h >= entry)
+    has_fill = filled.any(axis=1)
+    fill_at = np.where(has_fill, filled.argmax(axis=1), horizon)
+    live = valid & (steps[None, :] >= fill_at[:, None])
+
+    long = d > 0
+    stop_hit = live & np.where(long, l <= stop, h >= stop)
+    tp_hit = live & np.where(long, h >= tp1, l <= tp1)
+    first_stop = np.where(stop_hit.any(axis=1), stop_hit.argmax(axis=1), horizon)
+    first_tp = np.where(tp_hit.any(axis=1), tp_hit.argmax(axis=1), horizon)
+
+    risk = np.abs(entry - stop)[:, 0]
+    reward = np.abs(tp1 - entry)[:, 0] / risk
+    complete = valid.all(axis=1)
+    last = np.where(valid, steps[None, :], -1).max(axis=1)
+    mark = (c[np.arange(n), np.maximum(last, 0)] - entry[:, 0]) * d[:, 0] / risk
+
+    win = has_fill & (first_tp < first_stop)
+    loss = has_fill & (first_stop <= first_tp) & (first_stop < horizon)
+    expired = has_fill & ~win & ~loss & complete
+    outcome[win], r_multiple[win] = 1, reward[win]
+    outcome[loss], r_multiple[loss] = -1, -1.0
+    outcome[expired], r_multiple[expired] = 0, mark[expired]
+    return {"outcome": outcome, "r": r_multiple, "unfilled": ~has_fill & complete}
+
+
+def summarize(signals: dict, result: dict) -> dict:
+    """整體與依信心分組的命中率 / 平均 R；expected 為信心 / 10"""
+    outcome, r = result["outcome"], result["r"]
+    done = ~np.isnan(outcome)
+    confidence = np.asarray(signals["confidence"], dtype=float)
+
+    def stats(mask):
+        m = mask & done
+        count = int(m.sum())
+        return {
+            "count": count,
+            "hit_rate": float((outcome[m] == 1).mean()) if count else None,
+            "avg_r": float(r[m].mean()) if count else None,
+            "total_r": float(r[m].sum()) if count else 0.0,
+        }
+
+    overall = stats(np.ones(len(outcome), dtype=bool))
+    overall["unfilled"] = int(result["unfilled"].sum())
+    overall["pending"] = int((~done).sum()) - overall["unfilled"]
+    buckets = []
+    for low, high in CONFIDENCE_BUCKETS:
+        entry = stats((confidence >= low) & (confidence <= high))
+        entry.update(range=(low, high), expected=(low + high) / 20)
+        buckets.append(entry)
+    return {"overall": overall, "buckets": buckets}
+
+
+def replay(log: SignalLog, store, interval: int, since: float = 0, horizon: int = SIGNAL_HORIZON) -> dict:
+    """信號紀錄 × 本地 K 線 → {"all": summary, "groups": {"model/prompt_version": summary}}"""
+    rows = log.load(since)
+    if not rows:
+        return {"all": None, "groups": {}}
+    ts, symbol, model, version, direction, entry, stop, tp1, confidence = zip(*rows)
+    signals = {
+        "ts": np.array(ts), "symbol": np.array(symbol), "direction": np.array(direction),
+        "entry": np.array(entry), "stop": np.array(stop), "tp1": np.array(tp1),
+        "confidence": np.array([c if c is not None else np.nan for c in confidence], dtype=float),
+    }
+    bars = {}
+    for name in set(symbol):
+        first = min(t for t, s in zip(ts, symbol) if s == name)
+        history = store.load(name, interval, since=int(first - interval))
+        if history:
+            t, _, high, low, close, _ = zip(*history)
+            bars[name] = (t, high, low, close)
+    result = evaluate(signals, bars, interval, horizon)
+
+    groups = {}
+    labels = np.array([f"{m or '-'}/{v or '-'}" for m, v in zip(model, version)])
+    for label in sorted(set(labels)):
+        mask = labels == label
+        subset = {k: v[mask] for k, v in signals.items()}
+        groups[str(label)] = summarize(subset, {k: v[mask] for k, v in result.items()})
+    return {"all": summarize(signals, result), "groups": groups}
+
+
+def _benchmark(signals_count: int = 10000, bars_count: int = 20000, seed: int = 1):
+    """python signals.py：隨機漫步 K 線 + 隨機信號，量測向量化評估耗時"""
+    rng = np.random.default_rng(seed)
+    bars = {}
+    for symbol in ("BTCUSDT", "ETHUSDT", "SOLUSDT"):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars_count)))
+        spread = np.abs(rng.normal(0, 0.005, bars_count)) * close
+        ts = np.arange(bars_count) * 3600.0
+        bars[symbol] = (ts, close + spread, close - spread, close)
+
+    symbol = rng.choice(list(bars), signals_count)
+    ts = rng.uniform(0, (bars_count - 100) * 3600, signals_count)
+    price = np.array([bars[s][3][int(t // 3600)] for s, t in zip(symbol, ts)])
+    direction = rng.choice([-1, 1], signals_count)
+    risk = price * rng.uniform(0.005, 0.03, signals_count)
+    signals = {
+        "ts": ts, "symbol": symbol, "direction": direction, "entry": price,
+        "stop": price - direction * risk, "tp1": price + direction * risk * 1.5,
+        "confidence": rng.integers(1, 11, signals_count),
+    }
+    started = time.perf_counter()
+    result = evaluate(signals, bars, 3600)
+    report = summarize(signals, result)
+    elapsed = time.perf_counter() - started
+    o = report["overall"]
+    print(f"{signals_count} 筆信號 × {SIGNAL_HORIZON} 根 / {len(bars)} 幣種各 {bars_count} 根：{elapsed * 1000:.0f}ms")
+    print(f"命中率 {o['hit_rate']:.1%} / 平均 R {o['avg_r']:+.2f} / 已結算 {o['count']} / 未成交 {o['unfilled']} / 未結 {o['pending']}")
+
+
+if __name__ == "__main__":
+    _benchmark()
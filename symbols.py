@@ -0,0 +1,134 @@
+"""
+幣種註冊表
+- 統一的幣種資料：交易對、CoinCap id、顯示 emoji、分析模板
+- 使用者輸入（btc / BTC/USDT / btcusdt）正規化為交易對
+- 定時由 Bybit 合約清單補齊所有 USDT 永續（數百個幣種，無需逐一寫死）
+"""
+
+import os
+import logging
+
+from http_client import http, timeout
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTS_URL = os.getenv("INSTRUMENTS_URL", "https://api.bybit.com")
+SYMBOL_REFRESH_INTERVAL = float(os.getenv("SYMBOL_REFRESH_INTERVAL", "86400"))
+
+# (交易對, CoinCap id, emoji, 分析模板)
+DEFAULT_SYMBOLS = [
+    ("BTCUSDT", "bitcoin", "🔶", "full"),
+    ("ETHUSDT", "ethereum", "🔷", "brief"),
+    ("SOLUSDT", "solana", "🟣", "brief"),
+    ("BNBUSDT", "binance-coin", "🟡", "brief"),
+    ("XRPUSDT", "xrp", "⚪", "brief"),
+    ("DOGEUSDT", "dogecoin", "🐕", "brief"),
+    ("ADAUSDT", "cardano", "🔵", "brief"),
+    ("TRXUSDT", "tron", "🔴", "brief"),
+    ("AVAXUSDT", "avalanche", "🔺", "brief"),
+    ("LINKUSDT", "chainlink", "🔗", "brief"),
+    ("DOTUSDT", "polkadot", "🟣", "brief"),
+    ("TONUSDT", "toncoin", "💎", "brief"),
+    ("LTCUSDT", "litecoin", "🪙", "brief"),
+    ("BCHUSDT", "bitcoin-cash", "🟢", "brief"),
+    ("NEARUSDT", "near-protocol", "🪙", "brief"),
+    ("UNIUSDT", "uniswap", "🦄", "brief"),
+    ("APTUSDT", "aptos", "🪙", "brief"),
+    ("SUIUSDT", "sui", "💧", "brief"),
+    ("ARBUSDT", "arbitrum", "🔵", "brief"),
+    ("OPUSDT", "optimism", "🔴", "brief"),
+    ("ATOMUSDT", "cosmos", "⚛️", "brief"),
+    ("FILUSDT", "filecoin", "🪙", "brief"),
+    ("ETCUSDT", "ethereum-classic", "🟢", "brief"),
+    ("XLMUSDT", "stellar", "⭐", "brief"),
+    ("PEPEUSDT", "pepe", "🐸", "brief"),
+    ("SHIBUSDT", "shiba-inu", "🐕", "brief"),
+]
+
+
+class SymbolInfo:
+    __slots__ = ("symbol", "base", "coincap_id", "emoji", "profile")
+
+    def __init__(self, symbol: str, coincap_id: str = None, emoji: str = "🪙", profile: str = "brief"):
+        self.symbol = symbol
+        self.base = symbol.removesuffix("USDT")
+        self.coincap_id = coincap_id
+        self.emoji = emoji
+        self.profile = profile
+
+
+class SymbolRegistry:
+    def __init__(self, entries=DEFAULT_SYMBOLS):
+        self.symbols = {}
+        for symbol, coincap_id, emoji, profile in entries:
+            self.register(symbol, coincap_id, emoji, profile)
+
+    def register(self, symbol: str, coincap_id: str = None, emoji: str = None, profile: str = None) -> SymbolInfo:
+        """已存在的幣種只補上缺少的欄位"""
+        info = self.symbols.get(symbol)
+        if info is None:
+            info = self.symbols[symbol] = SymbolInfo(symbol)
+        if coincap_id:
+            info.coincap_id = coincap_id
+        if emoji:
+            info.emoji = emoji
+        if profile:
+            info.profile = profile
+        return info
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """'btc' / 'BTC/USDT' / 'btc-usdt' → 'BTCUSDT'"""
+        symbol = text.strip().upper().replace("/", "").replace("-", "")
+        return symbol if symbol.endswith("USDT") else f"{symbol}USDT"
+
+    def resolve(self, text: str):
+        """使用者輸入 → SymbolInfo（未知回傳 None）"""
+        return self.symbols.get(self.normalize(text)) if text else None
+
+    def get(self, symbol: str):
+        return self.symbols.get(symbol)
+
+    def coincap_id(self, symbol: str):
+        info = self.symbols.get(symbol)
+        return info.coincap_id if info else None
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.symbols
+
+    def __len__(self):
+        return len(self.symbols)
+
+    async def refresh(self, base_url: str = INSTRUMENTS_URL) -> int:
+        """Bybit 合約清單 → 註冊所有交易中的 USDT 永續，回傳新增數量"""
+        url = f"{base_url}/v5/market/instruments-info"
+        params = {"category": "linear", "limit": "1000"}
+        added = 0
+        while True:
+            try:
+                async with http.session.get(url, params=params, timeout=timeout(15)) as resp:
+                    result = await resp.json(content_type=None)
+            except Exception as e:
+                logger.warning(f"合約清單更新失敗: {e}")
+                break
+            if result.get("retCode") != 0:
+                break
+            for item in result.get("result", {}).get("list", []):
+                if item.get("quoteCoin") == "USDT" and item.get("status") == "Trading" \
+                        and item.get("contractType") == "LinearPerpetual":
+                    if item["symbol"] not in self.symbols:
+                        added += 1
+                    self.register(item["symbol"])
+            cursor = result.get("result", {}).get("nextPageCursor")
+            if not cursor:
+                break
+            params["cursor"] = cursor
+        if added:
+            logger.info(f"✅ 幣種註冊表新增 {added} 個，共 {len(self.symbols)} 個")
+        return added
+
+    async def run_job(self, context):
+        await self.refresh()
+
+
+registry = SymbolRegistry()
@@ -0,0 +1,20 @@
+"""
+測試共用設定
+- 專案為平鋪模組：把專案根目錄加入 sys.path
+- async def 測試以 asyncio.run 執行（不需 pytest-asyncio）
+"""
+
+import os
+import sys
+import asyncio
+import inspect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**args))
+    return True
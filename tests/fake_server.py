@@ -0,0 +1,27 @@
+"""
+本地假伺服器（aiohttp）：假交易所、假 SSE、假 Bot API 共用
+"""
+
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from http_client import http
+
+
+@asynccontextmanager
+async def serve(routes: list):
+    """routes: [(method, path, handler)]；隨機埠啟動並開啟共用連線池，yield 基底網址"""
+    app = web.Application()
+    for method, path, handler in routes:
+        app.router.add_route(method, path, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    await http.start()
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await http.close()
+        await runner.cleanup()
@@ -0,0 +1,150 @@
+"""
+推播管線：flood 暫停、封鎖 chat 移除訂閱、退避重試、Markdown 失敗改純文字、重啟續送
+"""
+
+import time
+import asyncio
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import broadcast
+from broadcast import Broadcaster
+
+
+class FakeBot:
+    """failures: chat_id → 依序拋出的例外；用完後正常送出"""
+
+    def __init__(self, failures: dict = None):
+        self.failures = {chat_id: list(errors) for chat_id, errors in (failures or {}).items()}
+        self.calls = []      # (chat_id, parse_mode, monotonic)
+        self.sent = []       # (chat_id, text, parse_mode)
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.calls.append((chat_id, parse_mode, time.monotonic()))
+        errors = self.failures.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text, parse_mode))
+
+
+def make_broadcaster(path=":memory:", chats=(), topic: str = "radar") -> Broadcaster:
+    broadcaster = Broadcaster(path=str(path), workers=4, rate=1000, chat_interval=0)
+    for chat_id in chats:
+        broadcaster.subscribe(chat_id, topic)
+    return broadcaster
+
+
+def pending(broadcaster: Broadcaster) -> list:
+    return broadcaster.db.execute("SELECT chat_id, attempts FROM deliveries ORDER BY id").fetchall()
+
+
+async def test_blocked_and_missing_chats_are_pruned():
+    bot = FakeBot({2: [Forbidden("Forbidden: bot was blocked by the user")],
+                   3: [BadRequest("Chat not found")]})
+    broadcaster = make_broadcaster(chats=[1, 2, 3])
+    broadcaster.start(bot)
+    assert broadcaster.publish("radar", "report") == 3
+    await broadcaster.join()
+    await broadcaster.stop()
+
+    assert [chat_id for chat_id, _, _ in bot.sent] == [1]
+    assert broadcaster.stats["pruned"] == 2 and broadcaster.stats["failed"] == 0
+    assert broadcaster.subscribers("radar") == [1]
+    assert pending(broadcaster) == []
+
+
+async def test_retry_after_pauses_then_resends():
+    bot = FakeBot({1: [RetryAfter(0.3)]})
+    broadcaster = make_broadcaster(chats=[1, 2])
+    broadcaster.start(bot)
+    broadcaster.publish("radar", "report")
+    await broadcaster.join()
+    await broadcaster.stop()
+
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == [1, 2]
+    assert broadcaster.stats["retried"] == 1 and broadcaster.stats["sent"] == 2
+    first, resend = [at for chat_id, _, at in bot.calls if chat_id == 1]
+    assert resend - first >= 0.25
+    # flood 限制不是 chat 的問題，不移除訂閱
+    assert broadcaster.subscribers("radar") == [1, 2]
+
+
+async def test_transient_error_backs_off_and_join_waits_for_it():
+    bot = FakeBot({1: [NetworkError("connection reset")]})
+    broadcaster = make_broadcaster(chats=[1])
+    broadcaster.start(bot)
+    broadcaster.publish("radar", "report")
+    await broadcaster.join()
+
+    # join 需等退避中的重試送完才返回
+    assert [chat_id for chat_id, _, _ in bot.sent] == [1]
+    assert broadcaster.stats["retried"] == 1 and broadcaster.stats["sent"] == 1
+    assert pending(broadcaster) == []
+    await broadcaster.stop()
+
+
+async def test_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(broadcast, "BROADCAST_MAX_ATTEMPTS", 1)
+    bot = FakeBot({1: [NetworkError("connection reset")]})
+    broadcaster = make_broadcaster(chats=[1])
+    broadcaster.start(bot)
+    broadcaster.publish("radar", "report")
+    await broadcaster.join()
+    await broadcaster.stop()
+
+    assert bot.sent == []
+    assert broadcaster.stats["failed"] == 1
+    assert broadcaster.subscribers("radar") == [1]     # 暫時性錯誤不移除訂閱
+    assert pending(broadcaster) == []
+
+
+async def test_markdown_parse_error_falls_back_to_plain_text():
+    bot = FakeBot({1: [BadRequest("Can't parse entities: can't find end of the entity starting at byte offset 3")]})
+    broadcaster = make_broadcaster(chats=[1])
+    broadcaster.start(bot)
+    broadcaster.publish("radar", "*unclosed")
+    await broadcaster.join()
+    await broadcaster.stop()
+
+    assert bot.sent == [(1, "*unclosed", None)]
+    assert broadcaster.stats["plain"] == 1 and broadcaster.stats["failed"] == 0
+
+
+async def test_undelivered_rows_survive_restart(tmp_path):
+    path = tmp_path / "broadcast.db"
+    first = make_broadcaster(path, chats=[1, 2, 3])
+    first.publish("radar", "report")          # 尚未啟動 worker 即關閉
+    first.close()
+
+    second = make_broadcaster(path)
+    assert pending(second) == [(1, 0), (2, 0), (3, 0)]
+    bot = FakeBot()
+    second.start(bot)
+    await second.join()
+    await second.stop()
+
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == [1, 2, 3]
+    assert pending(second) == []
+    second.close()
+
+
+async def test_stop_during_backoff_keeps_row_and_attempts(tmp_path):
+    path = tmp_path / "broadcast.db"
+    first = make_broadcaster(path, chats=[1])
+    first.start(FakeBot({1: [NetworkError("connection reset")]}))
+    first.publish("radar", "report")
+    while not first._retries:
+        await asyncio.sleep(0.01)
+    await first.stop()
+    first.close()
+
+    second = make_broadcaster(path)
+    assert pending(second) == [(1, 1)]
+    bot = FakeBot()
+    second.start(bot)
+    await second.join()
+    await second.stop()
+
+    assert bot.sent == [(1, "report", "Markdown")]
+    assert pending(second) == []
+    second.close()
@@ -0,0 +1,213 @@
+"""
+ExecutionEngine 對本地假交易所：批次、冪等重試、結果不明查回、撤單、TWAP / 冰山單
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+import bybit_trader
+from execution import ExecutionEngine, Order, DUPLICATE_LINK_ID, ORDER_NOT_EXISTS, TERMINAL
+from signing import make_signer
+
+from fake_server import serve
+
+
+class FakeExchange:
+    """以 orderLinkId 為鍵的訂單簿；市價單立即成交，價格 1 的限價單掛著不成交，其餘限價單 0.1s 後成交"""
+
+    def __init__(self, latency: float = 0.01):
+        self.latency = latency
+        self.book = {}
+        self.calls = {"create": 0, "batch": 0, "cancel": 0, "realtime": 0}
+        self.lose = 0              # 受理後丟棄回應的次數
+        self.down = False          # 完全不受理（502）
+        self.limited_batches = set()   # 第 N 次批次請求回 10006 限頻
+        self.engine = None
+
+    def routes(self) -> list:
+        return [
+            ("POST", "/v5/order/create", self.create),
+            ("POST", "/v5/order/create-batch", self.create_batch),
+            ("POST", "/v5/order/cancel", self.cancel),
+            ("GET", "/v5/order/realtime", self.realtime),
+        ]
+
+    def fill(self, link_id: str):
+        item = self.book[link_id]
+        if item["orderStatus"] in TERMINAL:
+            return
+        item.update(orderStatus="Filled", cumExecQty=item["qty"], avgPrice=item.get("price") or "100")
+        self.engine.apply(dict(item))   # 模擬私有訂單推送
+
+    def accept(self, params: dict):
+        link_id = params["orderLinkId"]
+        if link_id in self.book:
+            return {}, {"code": DUPLICATE_LINK_ID, "msg": "OrderLinkedID is duplicate"}
+        item = self.book[link_id] = {**params, "orderId": f"ex-{len(self.book)}", "orderStatus": "New",
+                                     "cumExecQty": "0"}
+        if params["orderType"] == "Market":
+            self.fill(link_id)
+        elif params.get("price") != "1":
+            asyncio.get_running_loop().call_later(0.1, self.fill, link_id)
+        return {"orderId": item["orderId"], "orderLinkId": link_id}, {"code": 0, "msg": "OK"}
+
+    async def create(self, request):
+        self.calls["create"] += 1
+        await asyncio.sleep(self.latency)
+        if self.down:
+            return web.Response(status=502, text="bad gateway")
+        result, info = self.accept(await request.json())
+        if self.lose:
+            self.lose -= 1
+            return web.Response(status=502, text="bad gateway")
+        return web.json_response({"retCode": info["code"], "retMsg": info["msg"], "result": result})
+
+    async def create_batch(self, request):
+        self.calls["batch"] += 1
+        seq = self.calls["batch"]
+        await asyncio.sleep(self.latency)
+        if seq in self.limited_batches:
+            return web.json_response({"retCode": 10006, "retMsg": "Too many visits!"})
+        body = await request.json()
+        results = [self.accept({**p, "category": body["category"]}) for p in body["request"]]
+        return web.json_response({"retCode": 0, "retMsg": "OK",
+                                  "result": {"list": [r for r, _ in results]},
+                                  "retExtInfo": {"list": [i for _, i in results]}})
+
+    async def cancel(self, request):
+        self.calls["cancel"] += 1
+        item = self.book.get((await request.json()).get("orderLinkId"))
+        if item is None or item["orderStatus"] in TERMINAL:
+            return web.json_response({"retCode": ORDER_NOT_EXISTS, "retMsg": "order not exists or too late to cancel"})
+        item["orderStatus"] = "Cancelled"
+        return web.json_response({"retCode": 0, "result": {"orderId": item["orderId"],
+                                                           "orderLinkId": item["orderLinkId"]}})
+
+    async def realtime(self, request):
+        self.calls["realtime"] += 1
+        item = self.book.get(request.query.get("orderLinkId"))
+        return web.json_response({"retCode": 0, "result": {"list": [dict(item)] if item else []}})
+
+
+@asynccontextmanager
+async def exchange(monkeypatch, max_retries: int = 3):
+    fake = FakeExchange()
+    async with serve(fake.routes()) as base:
+        monkeypatch.setattr(bybit_trader, "BYBIT_URL", base)
+        trader = bybit_trader.BybitTrader()
+        trader.signer = make_signer("", "test")
+        fake.engine = ExecutionEngine(trader, max_retries=max_retries, retry_delay=0.01)
+        yield fake, fake.engine
+        await fake.engine.stop()
+
+
+async def test_batches_place_each_order_exactly_once(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.limited_batches = {2}
+        symbols = ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+        orders = [Order(symbols[i % 3], "Buy", "0.01", "Limit", "100") for i in range(60)]
+        await engine.submit(orders)
+        await asyncio.gather(*(engine.wait(o, 1) for o in orders))
+
+        assert len(fake.book) == 60
+        assert all(o.status == "Filled" and o.order_id for o in orders)
+        # 3 幣種 × 20 筆 ÷ 每批 10 筆 = 6 批，外加 1 次限頻重試
+        assert fake.calls["batch"] == 7
+        assert fake.calls["create"] == 0
+        assert engine.stats["retries"] == 1 and engine.stats["duplicates"] == 0
+
+
+async def test_lost_response_retries_with_same_link_id(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.lose = 1
+        order = await engine.place("BTCUSDT", "Sell", "0.02", "Limit", "1")
+
+        assert fake.calls["create"] == 2
+        assert list(fake.book) == [order.link_id]
+        assert engine.stats["duplicates"] == 1
+        # 重複回應不帶 orderId：以 orderLinkId 查回
+        assert fake.calls["realtime"] == 1
+        assert order.status == "New" and order.order_id == fake.book[order.link_id]["orderId"]
+
+
+async def test_cancel_uses_order_link_id(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.lose = 1
+        order = await engine.place("BTCUSDT", "Buy", "0.01", "Limit", "1")
+
+        assert (await engine.cancel(order)).get("retCode") == 0
+        assert order.status == "Cancelled"
+        assert fake.book[order.link_id]["orderStatus"] == "Cancelled"
+
+
+async def test_cancel_after_fill_keeps_filled_status(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        order = await engine.place("BTCUSDT", "Buy", "0.01")
+        assert order.status == "Filled"
+        order.status = "New"        # 推送尚未套用時撤單：交易所回報不存在 → 查詢後以實際狀態為準
+
+        result = await engine.cancel(order)
+
+        assert result.get("retCode") == ORDER_NOT_EXISTS
+        assert fake.calls["realtime"] == 1
+        assert order.status == "Filled"
+
+
+async def test_exhausted_retries_resolve_accepted_order(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.lose = engine.max_retries + 1
+        order = await engine.place("BTCUSDT", "Buy", "0.01", "Limit", "1")
+
+        assert fake.calls["create"] == engine.max_retries + 1
+        assert len(fake.book) == 1
+        # 每次都逾時：Unknown → get_order 查回實際掛單
+        assert fake.calls["realtime"] == 1
+        assert order.status == "New" and order.order_id == fake.book[order.link_id]["orderId"]
+        assert engine.stats["rejected"] == 0
+
+
+async def test_exhausted_retries_never_accepted_is_rejected(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.down = True
+        order = await engine.place("BTCUSDT", "Buy", "0.01")
+
+        assert fake.calls["create"] == engine.max_retries + 1
+        assert fake.calls["realtime"] == 1
+        assert fake.book == {}
+        assert order.status == "Rejected" and order.error
+        assert engine.stats["rejected"] == 1
+
+
+async def test_twap_sends_every_slice(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        job = engine.twap("ETHUSDT", "Buy", "1", 5, 0.1, step="0.01")
+        await job.task
+
+        assert job.status == "done"
+        assert len(fake.book) == 5
+        assert all(o.status == "Filled" for o in job.orders)
+        assert str(job.filled()) == "1.00"
+
+
+async def test_twap_stops_when_slice_outcome_unknown(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        fake.down = True
+        job = engine.twap("ETHUSDT", "Buy", "1", 5, 0.1, step="0.01")
+        await job.task
+
+        assert job.status == "failed"
+        assert len(job.orders) == 1
+        assert fake.calls["create"] == engine.max_retries + 1
+        assert fake.book == {}
+
+
+async def test_iceberg_places_next_slice_after_fill(monkeypatch):
+    async with exchange(monkeypatch) as (fake, engine):
+        job = engine.iceberg("BTCUSDT", "Sell", "1", "0.3", "101")
+        await job.task
+
+        assert job.status == "done"
+        assert [o.qty for o in job.orders] == ["0.3", "0.3", "0.3", "0.1"]
+        assert len(fake.book) == 4 and all(o.status == "Filled" for o in job.orders)
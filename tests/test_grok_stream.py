@@ -0,0 +1,114 @@
+"""
+Grok SSE 串流對本地假伺服器：完整串流、中途斷線、非 200、單飛合併與失敗不快取
+"""
+
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from grok_stream import GrokStreamError, stream_chat, collect
+from llm_cache import LLMCache
+from metrics import metrics
+
+from fake_server import serve
+
+WORDS = ["BTC ", "短線", "偏多"]
+
+
+class FakeGrok:
+    def __init__(self):
+        self.hits = {"ok": 0, "broken": 0, "error": 0}
+
+    def routes(self) -> list:
+        return [("POST", "/sse/{mode}", self.sse), ("POST", "/error", self.error)]
+
+    async def sse(self, request):
+        mode = request.match_info["mode"]
+        self.hits[mode] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for word in WORDS:
+            await resp.write(f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode())
+            await asyncio.sleep(0.02)
+            if mode == "broken" and word == "短線":
+                return resp       # 不送 [DONE] 即斷線
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def error(self, request):
+        self.hits["error"] += 1
+        return web.Response(status=503)
+
+
+async def test_full_stream_reports_progress():
+    fake = FakeGrok()
+    async with serve(fake.routes()) as base:
+        progress = []
+
+        async def on_text(text):
+            progress.append(text)
+
+        text = await collect(stream_chat(f"{base}/sse/ok", {}, {}), on_text, interval=0)
+
+    assert text == "".join(WORDS)
+    assert progress == ["BTC ", "BTC 短線", "BTC 短線偏多"]
+
+
+async def test_disconnect_before_done_raises_with_partial():
+    fake = FakeGrok()
+    async with serve(fake.routes()) as base:
+        with pytest.raises(GrokStreamError) as info:
+            await collect(stream_chat(f"{base}/sse/broken", {}, {}))
+
+    assert str(info.value).startswith("❌")
+    assert info.value.partial == "BTC 短線"
+
+
+async def test_non_200_raises():
+    fake = FakeGrok()
+    async with serve(fake.routes()) as base:
+        with pytest.raises(GrokStreamError) as info:
+            await collect(stream_chat(f"{base}/error", {}, {}))
+
+    assert "503" in str(info.value)
+    assert info.value.partial == ""
+
+
+def cache_counts() -> dict:
+    return {labels[0][1]: count for (name, labels), count in metrics.counters.items() if name == "llm_cache"}
+
+
+async def test_concurrent_requests_share_one_stream():
+    fake = FakeGrok()
+    cache = LLMCache()
+    before = cache_counts()
+    async with serve(fake.routes()) as base:
+        texts = await asyncio.gather(*(
+            cache.get_or_call("ok", 60, lambda: collect(stream_chat(f"{base}/sse/ok", {}, {}))) for _ in range(5)
+        ))
+        again = await cache.get_or_call("ok", 60, lambda: collect(stream_chat(f"{base}/sse/ok", {}, {})))
+
+    assert texts == ["".join(WORDS)] * 5 and again == texts[0]
+    assert fake.hits["ok"] == 1
+    after = cache_counts()
+    assert {k: after[k] - before.get(k, 0) for k in after} == {"miss": 1, "coalesced": 4, "hit": 1}
+    assert 'flowai_llm_cache_total{result="hit"}' in metrics.render()
+
+
+async def test_failed_stream_is_shared_but_not_cached():
+    fake = FakeGrok()
+    cache = LLMCache()
+    async with serve(fake.routes()) as base:
+        def call():
+            return cache.get_or_call("broken", 60, lambda: collect(stream_chat(f"{base}/sse/broken", {}, {})))
+
+        results = await asyncio.gather(*(call() for _ in range(5)), return_exceptions=True)
+        assert all(isinstance(r, GrokStreamError) for r in results)
+        assert fake.hits["broken"] == 1
+        assert cache.get("broken") is None
+
+        with pytest.raises(GrokStreamError):
+            await call()
+    assert fake.hits["broken"] == 2
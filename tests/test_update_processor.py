@@ -0,0 +1,82 @@
+"""
+ChatOrderedProcessor：同 chat 保持順序、只有同一使用者的新分析命令才取消舊分析
+"""
+
+import asyncio
+
+from telegram import Update
+
+from update_processor import ChatOrderedProcessor
+
+
+def make_update(update_id: int, text: str, chat_id: int = 1, user_id: int = 1) -> Update:
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "group"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"},
+    }}, None)
+
+
+class Recorder:
+    def __init__(self):
+        self.started = []
+        self.finished = []
+
+    async def handle(self, update, delay: float):
+        self.started.append(update.update_id)
+        await asyncio.sleep(delay)
+        self.finished.append(update.update_id)
+
+
+def processor() -> ChatOrderedProcessor:
+    return ChatOrderedProcessor(workers=4, cancellable=("btc", "gold"))
+
+
+async def submit(proc, recorder, update, delay):
+    task = asyncio.ensure_future(proc.process_update(update, recorder.handle(update, delay)))
+    await asyncio.sleep(0.01)
+    return task
+
+
+async def test_same_user_new_analysis_cancels_old():
+    proc, recorder = processor(), Recorder()
+    tasks = [await submit(proc, recorder, make_update(1, "/gold"), 0.3),
+             await submit(proc, recorder, make_update(2, "/btc"), 0.05)]
+    await asyncio.gather(*tasks)
+
+    assert recorder.finished == [2]
+    assert proc.stats["cancelled"] == 1
+
+
+async def test_non_cancellable_command_does_not_cancel():
+    proc, recorder = processor(), Recorder()
+    tasks = [await submit(proc, recorder, make_update(1, "/gold"), 0.1),
+             await submit(proc, recorder, make_update(2, "/help"), 0.01)]
+    await asyncio.gather(*tasks)
+
+    # /help 排在 /gold 之後執行，不取消它
+    assert recorder.finished == [1, 2]
+    assert proc.stats["cancelled"] == 0 and proc.stats["skipped"] == 0
+
+
+async def test_other_member_does_not_cancel_in_group():
+    proc, recorder = processor(), Recorder()
+    tasks = [await submit(proc, recorder, make_update(1, "/gold", user_id=1), 0.1),
+             await submit(proc, recorder, make_update(2, "/btc", user_id=2), 0.01)]
+    await asyncio.gather(*tasks)
+
+    assert recorder.finished == [1, 2]
+    assert proc.stats["cancelled"] == 0 and proc.stats["skipped"] == 0
+
+
+async def test_queued_analysis_is_skipped_when_superseded():
+    proc, recorder = processor(), Recorder()
+    tasks = [await submit(proc, recorder, make_update(1, "/help"), 0.1),
+             await submit(proc, recorder, make_update(2, "/btc"), 0.01),
+             await submit(proc, recorder, make_update(3, "/gold"), 0.01)]
+    await asyncio.gather(*tasks)
+
+    # /btc 仍在排隊時被同一使用者的 /gold 取代
+    assert recorder.started == [1, 3]
+    assert proc.stats["skipped"] == 1
+    assert proc._latest == {} and proc._running == {}
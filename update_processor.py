@@ -0,0 +1,214 @@
+"""
+更新併發處理
+- 不同 chat 的更新併發處理（固定 worker 數），同一 chat 內保持先後順序
+- 每個命令可設定逾時，逾時取消並通知
+- 同一 chat 的同一位使用者再發 AI 分析命令時，取消他仍在執行 / 排隊中的舊分析並通知（群組內不互相取消）
+- 端到端延遲（含排隊）p50 / p99
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", os.getenv("BOT_CONCURRENT_UPDATES", "8")))
+UPDATE_BACKLOG = int(os.getenv("UPDATE_BACKLOG", "512"))     # 同時排隊 + 執行的更新上限
+UPDATE_TIMEOUT = float(os.getenv("UPDATE_TIMEOUT", "60"))
+
+
+def update_command(update) -> str:
+    """'/gold@FlowAI_TradeBot 1' → 'gold'；非命令回傳 None"""
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) or ""
+    if not text.startswith("/"):
+        return None
+    return text[1:].split(maxsplit=1)[0].split("@")[0].lower() if len(text) > 1 else None
+
+
+def percentile(values, pct: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Application.builder().concurrent_updates(ChatOrderedProcessor(...))"""
+
+    def __init__(self, workers: int = UPDATE_WORKERS, timeouts: dict = None,
+                 default_timeout: float = UPDATE_TIMEOUT, cancellable=(), backlog: int = UPDATE_BACKLOG):
+        # 父類的 semaphore 只限制排隊總量；真正的併發由 _slots 控制（等待前一則時不佔 worker）
+        super().__init__(max(backlog, workers))
+        self.workers = workers
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.cancellable = set(cancellable)
+        self._slots = asyncio.Semaphore(workers)
+        self._tails = {}      # chat_id -> 該 chat 最後一則更新的完成 future
+        self._latest = {}     # (chat_id, user_id) -> 最新一則可取消命令的序號
+        self._running = {}    # (chat_id, user_id) -> (command, task)
+        self._seq = 0
+        self.active = 0
+        self.latencies = deque(maxlen=2000)
+        self.stats = {"processed": 0, "timeouts": 0, "cancelled": 0, "skipped": 0}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        for _, task in list(self._running.values()):
+            task.cancel()
+
+    async def do_process_update(self, update, coroutine):
+        started = time.monotonic()
+        chat = getattr(update, "effective_chat", None)
+        command = update_command(update)
+        if chat is None:
+            async with self._slots:
+                await self._run(update, None, command, coroutine)
+            self.latencies.append(time.monotonic() - started)
+            return
+
+        chat_id = chat.id
+        user = getattr(update, "effective_user", None)
+        owner = (chat_id, user.id if user else None)
+        self._seq += 1
+        seq = self._seq
+        # 只有新的 AI 分析命令會取代同一位使用者的舊分析；/help 或群組其他人的命令不影響
+        if command in self.cancellable:
+            self._latest[owner] = seq
+            running = self._running.get(owner)
+            if running and running[0] in self.cancellable and not running[1].done():
+                running[1].cancel()
+                self.stats["cancelled"] += 1
+
+        prev = self._tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[chat_id] = done
+        try:
+            if prev is not None:
+                await prev
+            async with self._slots:
+                # 排隊期間同一使用者已送出新的分析命令：舊分析直接略過
+                if command in self.cancellable and self._latest.get(owner) != seq:
+                    coroutine.close()
+                    self.stats["skipped"] += 1
+                    await self._notify(update, "⏹ 已取消：已送出新的分析命令")
+                    return
+                await self._run(update, owner, command, coroutine)
+        finally:
+            done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+            if self._latest.get(owner) == seq:
+                del self._latest[owner]
+            self.latencies.append(time.monotonic() - started)
+
+    async def _run(self, update, owner, command, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        if owner is not None:
+            self._running[owner] = (command, task)
+        self.active += 1
+        try:
+            finished, _ = await asyncio.wait({task}, timeout=self.timeouts.get(command, self.default_timeout))
+            if not finished:
+                task.cancel()
+                await asyncio.wait({task})
+                self.stats["timeouts"] += 1
+                logger.warning(f"更新逾時: /{command} chat={owner and owner[0]}")
+                await self._notify(update, "⏱ 處理逾時，請稍後再試")
+            elif task.cancelled():
+                # 被同一使用者的新分析命令取代
+                await self._notify(update, "⏹ 已取消：已送出新的分析命令")
+            elif task.exception():
+                logger.error(f"更新處理錯誤: {task.exception()}")
+            self.stats["processed"] += 1
+        finally:
+            self.active -= 1
+            if not task.done():
+                task.cancel()
+            if owner is not None and self._running.get(owner, (None, None))[1] is task:
+                del self._running[owner]
+
+    async def _notify(self, update, text: str):
+        message = getattr(update, "effective_message", None)
+        if message is None:
+            return
+        try:
+            await message.reply_text(text)
+        except Exception:
+            pass
+
+    def summary(self) -> str:
+        s = self.stats
+        p50, p99 = percentile(self.latencies, 50), percentile(self.latencies, 99)
+        latency = f"p50 {p50:.2f}s / p99 {p99:.2f}s" if p50 is not None else "無資料"
+        return (f"執行 {self.active}/{self.workers} / 處理 {s['processed']} / {latency} / "
+                f"逾時 {s['timeouts']} / 取消 {s['cancelled'] + s['skipped']}")
+
+
+async def _load_test(users: int = 60, commands_per_user: int = 3, window: float = 3.0, seed: int = 7):
+    """模擬多位使用者混合送出快 / 慢命令，比較循序處理與 ChatOrderedProcessor：python update_processor.py"""
+    import random
+    from telegram.ext import SimpleUpdateProcessor
+
+    # 模擬處理時間（秒）：radar 讀預算結果、btc 一次 AI 呼叫、gold 長時間 AI 分析
+    service = {"radar": 0.01, "btc": 0.15, "gold": 0.6}
+    mix = ["radar"] * 6 + ["btc"] * 3 + ["gold"]
+
+    rng = random.Random(seed)
+    arrivals = sorted(
+        (rng.uniform(0, window), user, rng.choice(mix))
+        for user in range(1, users + 1) for _ in range(commands_per_user)
+    )
+    updates = [
+        (at, Update.de_json({"update_id": i, "message": {
+            "message_id": i, "date": 0, "chat": {"id": user, "type": "private"}, "text": f"/{command}",
+        }}, None), command)
+        for i, (at, user, command) in enumerate(arrivals)
+    ]
+
+    async def run(processor):
+        latency = {name: [] for name in service}
+        order = {}
+
+        async def handler(update, command, enqueued):
+            order.setdefault(update.effective_chat.id, []).append(update.update_id)
+            await asyncio.sleep(service[command])
+            latency[command].append(time.monotonic() - enqueued)
+
+        # 與 Application._update_fetcher 相同：併發 > 1 時每則開 task，否則逐則 await
+        tasks = []
+        started = time.monotonic()
+        for at, update, command in updates:
+            await asyncio.sleep(max(0.0, started + at - time.monotonic()))
+            coroutine = processor.process_update(update, handler(update, command, started + at))
+            if processor.max_concurrent_updates > 1:
+                tasks.append(asyncio.ensure_future(coroutine))
+            else:
+                await coroutine
+        await asyncio.gather(*tasks)
+        in_order = all(ids == sorted(ids) for ids in order.values())
+        return latency, time.monotonic() - started, in_order
+
+    for name, processor in (
+        ("循序（預設）", SimpleUpdateProcessor(1)),
+        ("ChatOrdered", ChatOrderedProcessor(workers=16, cancellable=("btc", "gold"))),
+    ):
+        latency, elapsed, in_order = await run(processor)
+        print(f"── {name}：{len(updates)} 則 / {users} 位使用者 / 總耗時 {elapsed:.1f}s / chat 內順序 {'✅' if in_order else '❌'}")
+        for command, values in latency.items():
+            if values:
+                print(f"   /{command:<6} n={len(values):<4} p50 {percentile(values, 50):.3f}s  p99 {percentile(values, 99):.3f}s")
+        if isinstance(processor, ChatOrderedProcessor):
+            print(f"   {processor.summary()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_load_test())
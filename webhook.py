@@ -0,0 +1,128 @@
+"""
+Webhook 模式
+- 內建 aiohttp 伺服器接收 Telegram 推送，取代 long polling
+- X-Telegram-Bot-Api-Secret-Token 驗證（常數時間比較）
+- 收到即放入 update_queue 並回 200，處理交給 Application（concurrent_updates）
+- /healthz 健康檢查；/metrics 不在公開埠提供，改由 METRICS_PORT 另開
+"""
+
+import os
+import time
+import hmac
+import signal
+import asyncio
+import hashlib
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")              # 對外網址，例如 https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+def webhook_secret(token: str) -> str:
+    """未設定 WEBHOOK_SECRET 時由 bot token 推導（Telegram 只接受 A-Z a-z 0-9 _ -）"""
+    return WEBHOOK_SECRET or hashlib.sha256(f"webhook:{token}".encode()).hexdigest()
+
+
+class WebhookServer:
+    def __init__(self, app, path: str = WEBHOOK_PATH, secret: str = None):
+        self.app = app
+        self.path = path
+        self.secret = secret or webhook_secret(app.bot.token)
+        self.started_at = time.monotonic()
+        self.stats = {"received": 0, "rejected": 0, "invalid": 0}
+        self.web = web.Application()
+        self.web.router.add_post(path, self.handle_update)
+        self.web.router.add_get("/healthz", self.health)
+        self._runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret):
+            self.stats["rejected"] += 1
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.app.bot)
+        except Exception as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"Webhook 無法解析: {e}")
+            return web.Response(status=400)
+        self.stats["received"] += 1
+        await self.app.update_queue.put(update)
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        running = self.app.running
+        return web.json_response({
+            "ok": running,
+            "mode": "webhook",
+            "uptime": round(time.monotonic() - self.started_at),
+            "pending": self.app.update_queue.qsize(),
+            **self.stats,
+        }, status=200 if running else 503)
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        self._runner = web.AppRunner(self.web, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"✅ Webhook 伺服器: {host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"webhook / 收 {s['received']} / 拒 {s['rejected']} / 待處理 {self.app.update_queue.qsize()}"
+
+
+async def serve_webhook(app, url: str = WEBHOOK_URL):
+    """與 Application.run_polling 相同的生命週期：initialize → post_init → start → 等待停止訊號"""
+    if not url:
+        raise ValueError("Webhook 模式需設定 WEBHOOK_URL")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    server = WebhookServer(app)
+    app.bot_data["webhook"] = server
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await server.start()
+        # 不丟棄積壓：重啟期間的訊息由 Telegram 重新推送
+        await app.bot.set_webhook(
+            url=url.rstrip("/") + server.path,
+            secret_token=server.secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await app.start()
+        await stop.wait()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_webhook(app, url: str = WEBHOOK_URL):
+    asyncio.run(serve_webhook(app, url))